@@ -0,0 +1,63 @@
+'''
+Compare the two ways of producing html/docx from notebooks:
+    two-step: ipynb2md (jinja over the notebook json) then render the markdown.
+    notebook: render the notebook with pandoc's ipynb reader (render_notebook).
+
+Usage: python benchmark_notebook_render.py [NOTEBOOK_FOLDER] [--format html] [--repeat 3]
+'''
+from __future__ import annotations
+
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import sys
+sys.path.append('../src')
+import pymddoc
+
+
+def two_step(ipynb_path: Path, tmp: Path, output_format: str) -> None:
+    md_path = tmp / f'{ipynb_path.stem}.md'
+    pymddoc.convert_ipynb2md_file(pymddoc.ipynb2md_default_template, ipynb_path, md_path, assets_dir=tmp / 'assets')
+    doc = pymddoc.MarkdownDoc.from_file(md_path)
+    doc.render_to_file(tmp / f'{ipynb_path.stem}-two-step.{output_format}', output_format=output_format, strict_render=False)
+
+
+def notebook(ipynb_path: Path, tmp: Path, output_format: str) -> None:
+    pymddoc.render_notebook(ipynb_path, tmp / f'{ipynb_path.stem}-notebook.{output_format}', output_format=output_format, strict_render=False)
+
+
+def best_time(func, *args, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', nargs='?', default='../examples')
+    parser.add_argument('--format', default='html', choices=['html', 'docx'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ratios = []
+    print(f'{"notebook":40} {"MB":>6} {"two-step":>9} {"notebook":>9} {"speedup":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for ipynb_path in sorted(Path(args.folder).glob('*.ipynb')):
+            try:
+                a = best_time(two_step, ipynb_path, Path(tmp), args.format, repeat=args.repeat)
+                b = best_time(notebook, ipynb_path, Path(tmp), args.format, repeat=args.repeat)
+            except Exception as e:
+                print(f'{ipynb_path.name:40} error: {e}')
+                continue
+            ratios.append(a / b)
+            size = ipynb_path.stat().st_size / 1024**2
+            print(f'{ipynb_path.name:40} {size:6.2f} {a:8.3f}s {b:8.3f}s {a/b:7.2f}x')
+
+    if len(ratios):
+        print(f'geometric mean speedup: {statistics.geometric_mean(ratios):.2f}x')
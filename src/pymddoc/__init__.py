@@ -4,6 +4,10 @@ from .depricated import Document, DocMaker
 
 from .notebooks import (
     convert_ipynb2md, 
+    convert_ipynb2md_file, 
+    convert_ipynb2md_files,
+    read_notebook,
+    render_notebook,
 )
 from .templates import (
     templates, 
@@ -11,14 +15,24 @@ from .templates import (
 )
 
 from .markdown_doc import MarkdownDoc
+from .compiled_doc import CompiledMarkdownDoc, RenderResult, render_files
+from .project import Project, ProjectDocument
+from .watch import Watcher
 from .metadata import Metadata
-from .compile import PandocArgs
+from .metadata_index import MetadataIndex
+from .compile import PandocArgs, PandocAST, set_async_pandoc_limit
+from .output_cache import OutputCache
+from .images import ImageCache, ImagePolicy, ImageChoice, image_policies
+from .tables import TableCache, get_table_cache, clear_table_cache, set_table_engine
+from .render import TemplateCache, get_template_cache, clear_template_cache
 
 from .builtin_methods import (
     get_builtin_methods, 
     builtin_methods_str,
     csv_to_markdown, 
     excel_to_markdown, 
+    parquet_to_markdown, 
+    feather_to_markdown, 
     svg_to_png, 
     pdf_to_png
 )
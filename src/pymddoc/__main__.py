@@ -1,24 +1,63 @@
+import typing
 import jinja2
 import json
 import pathlib
 from pathlib import Path
 import sys
+import glob
+import os
+import time
 import click
 
-from .info import package_name
+from .info import package_name, default_cache_dir
 from .templates import templates
 from .markdown_doc import MarkdownDoc
-from .errors import PandocError
+from .compiled_doc import RenderResult, render_files
+from .project import Project
+from .metadata_index import MetadataIndex
+from .output_cache import OutputCache
+from .images import ImageCache
+from .tables import set_table_engine
+from .errors import PandocError, ImageConversionError
 
-from .notebooks import convert_ipynb2md
+from .notebooks import convert_ipynb2md_file, convert_ipynb2md_files, render_notebook
+from .watch import Watcher
+from .util import val_or_None
 
 def get_default_ipynb2md_template():
     """Get the content of the default template inside the package."""
     return templates['ipynb2md_default']
 
+def get_output_cache(cache_dir: str|None, size_mb: int) -> OutputCache:
+    """Get the pandoc output cache inside the cache directory."""
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir
+    return OutputCache(cache_dir / 'pandoc', max_bytes=size_mb*1024**2)
+
+def get_image_cache(cache_dir: str|None, size_mb: int) -> ImageCache:
+    """Get the rasterized image cache inside the cache directory."""
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir
+    return ImageCache(cache_dir / 'images', max_bytes=size_mb*1024**2)
+
 def handle_error(e: Exception) -> None:
     print(f'Error: {e}', file=sys.stderr)
 
+def parse_query_value(value: str) -> typing.Any:
+    """Parse a --query value the way pandoc stores metadata: true/false and json
+        lists or quoted strings are parsed, everything else (numbers included) is text.
+    """
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        return value
+    return value if isinstance(parsed, (int, float)) and not isinstance(parsed, bool) else parsed
+
+def print_timings(results: list[RenderResult]) -> int:
+    """Print the time spent on each output in input order and return the number of failures."""
+    for result in sorted(results, key=lambda r: r.index):
+        status = f'{result.elapsed:8.3f}s' if result.ok else '  FAILED '
+        print(f'{status}  {result.output_path}', file=sys.stderr)
+    return sum(not r.ok for r in results)
+
 
 @click.group()
 def cli():
@@ -29,82 +68,384 @@ def cli():
 @click.argument('md_file', type=click.Path())
 @click.option("--template", type=click.Path(exists=True), default=None)
 @click.option("--linenums", is_flag=True, default=False)
-def ipynb2md(ipynb_file: str, md_file: str, template: str, linenums: bool) -> None:
+@click.option("--cache-dir", type=click.Path(), default=None, help='Directory for persistent caches.')
+@click.option("--assets-dir", type=click.Path(file_okay=False), default=None, help='Folder for image outputs (default: assets next to the markdown file).')
+@click.option("--no-assets", is_flag=True, default=False, help='Drop image outputs instead of writing them to files.')
+def ipynb2md(
+    ipynb_file: str, 
+    md_file: str, 
+    template: str, 
+    linenums: bool, 
+    cache_dir: str|None, 
+    assets_dir: str|None, 
+    no_assets: bool,
+) -> None:
     '''Convert a Jupyter notebook (json file) to a markdown file.
-    Description: reads a jupyter notebook as a regular json file, passes the json to the template,
-        and renders the template with the json information.
+    Description: reads a jupyter notebook one cell at a time, passes the json to the template,
+        and renders the template with the json information. Image outputs are written to
+        files named by their content and linked from the markdown. Other output data the 
+        template does not name is dropped.
     '''
-    with Path(ipynb_file).open('r') as f:
-        ipynb_dict = json.load(f)
-    
     if template is not None:
         with Path(template).open('r') as f:
             template_str = f.read()
     else:
         template_str = get_default_ipynb2md_template()
 
-    markdown = convert_ipynb2md(template_str, ipynb_dict, linenums=linenums)
-
-    with Path(md_file).open('w') as f:
-        f.write(markdown)
+    convert_ipynb2md_file(
+        template_str, 
+        ipynb_file, 
+        md_file, 
+        linenums=linenums, 
+        cache_dir=cache_dir, 
+        assets_dir=None if no_assets else val_or_None(assets_dir, Path(md_file).parent / 'assets'),
+    )
 
 
 @cli.command()
 @click.argument('ipynb_files', nargs=-1, type=click.Path(exists=True))
 @click.option("--template", type=click.Path(exists=True), default=None)
-def ipynb2md_multi(ipynb_files: list[str], template: str) -> None:
+@click.option("--cache-dir", type=click.Path(), default=None, help='Directory for persistent caches.')
+@click.option("--out-dir", type=click.Path(file_okay=False), default=None, help='Write markdown files here instead of next to the notebooks.')
+@click.option("-j", "--jobs", type=click.INT, default=1, help='Number of processes converting notebooks.')
+@click.option("--manifest", type=click.Path(dir_okay=False), default=None, help='Manifest of converted notebooks (default: .ipynb2md-manifest.json in the output folder).')
+@click.option("--force", is_flag=True, default=False, help='Convert notebooks even if they did not change.')
+@click.option("--assets-dir", type=click.Path(file_okay=False), default=None, help='Folder for image outputs of all notebooks (default: assets in the output folder).')
+@click.option("--no-assets", is_flag=True, default=False, help='Drop image outputs instead of writing them to files.')
+def ipynb2md_multi(
+    ipynb_files: list[str], 
+    template: str, 
+    cache_dir: str|None, 
+    out_dir: str|None, 
+    jobs: int, 
+    manifest: str|None, 
+    force: bool,
+    assets_dir: str|None, 
+    no_assets: bool,
+) -> None:
     '''Convert multiple Jupyter notebooks (json files) to markdown files.
+        Notebooks that did not change since the last run are skipped. Identical image 
+        outputs are written to the assets folder once.
     '''
-    for ipynb_file in ipynb_files:
-        with Path(ipynb_file).open('r') as f:
-            ipynb_dict = json.load(f)
-        
-        if template is not None:
-            with Path(template).open('r') as f:
-                template_str = f.read()
-        else:
-            template_str = get_default_ipynb2md_template()
+    if template is not None:
+        with Path(template).open('r') as f:
+            template_str = f.read()
+    else:
+        template_str = get_default_ipynb2md_template()
 
-        markdown = convert_ipynb2md(template_str, ipynb_dict)
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        md_files = [Path(out_dir) / Path(f).with_suffix('.md').name for f in ipynb_files]
+    else:
+        md_files = [Path(f).with_suffix('.md') for f in ipynb_files]
 
-        md_file = Path(ipynb_file).with_suffix('.md')
-        with Path(md_file).open('w') as f:
-            f.write(markdown)
+    converted = convert_ipynb2md_files(
+        template_str, 
+        ipynb_files, 
+        md_files, 
+        cache_dir=cache_dir, 
+        workers=jobs, 
+        manifest_path=Path(manifest) if manifest is not None else Path(val_or_None(out_dir, '.')) / '.ipynb2md-manifest.json',
+        force=force,
+        assets_dir=None if no_assets else val_or_None(assets_dir, Path(val_or_None(out_dir, '.')) / 'assets'),
+    )
+    num_converted = sum(converted.values())
+    print(f'converted {num_converted}, unchanged {len(converted) - num_converted}', file=sys.stderr)
 
 
 @cli.command()
 @click.argument('md_file', type=click.Path())
-def metadata(md_file: str) -> None:
+@click.option("--exact", is_flag=True, default=False, help='Always read metadata with pandoc.')
+def metadata(md_file: str, exact: bool) -> None:
     '''Extract metadata from a markdown file as json.
     '''
     doc = MarkdownDoc.from_file(md_file)
     try:
-        md = doc.extract_metadata()
+        md = doc.extract_metadata(exact=exact)
     except PandocError as e:
         handle_error(e)
         return
     print(json.dumps(md, indent=2))
 
 
+@cli.command()
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--db', type=click.Path(), default='pymddoc-metadata.sqlite', help='Path to the sqlite index.')
+@click.option('--pattern', default='*.md', help='Glob pattern for document file names.')
+@click.option('-j', '--jobs', type=click.INT, default=1, help='Number of processes reading metadata.')
+@click.option('--query', 'queries', multiple=True, help='Print documents where key=value (repeatable).')
+@click.option('--no-scan', is_flag=True, default=False, help='Query the existing index without rescanning.')
+@click.option("--exact", is_flag=True, default=False, help='Always read metadata with pandoc.')
+def metadata_index(
+    root: str, 
+    db: str, 
+    pattern: str, 
+    jobs: int, 
+    queries: list[str], 
+    no_scan: bool, 
+    exact: bool,
+) -> None:
+    '''Index metadata of all markdown files under a directory in sqlite.
+    Description: only files whose mtime or size changed since the last scan
+        are re-read. With --query, prints the matching documents as json.
+    '''
+    with MetadataIndex(db) as index:
+        if not no_scan:
+            result = index.scan(root, pattern=pattern, workers=jobs, exact=exact)
+            for path, error in result.errors.items():
+                handle_error(Exception(f'{path}: {error}'))
+            print(f'added {len(result.added)}, updated {len(result.updated)}, '
+                f'removed {len(result.removed)}, unchanged {result.unchanged}', file=sys.stderr)
+
+        if len(queries):
+            fields = {k: parse_query_value(v) for k, v in (q.split('=', 1) for q in queries)}
+            matches = {str(path): md for path, md in index.query(**fields)}
+            print(json.dumps(matches, indent=2))
+
+
 @cli.command()
 @click.argument('md_file', type=click.Path())
 @click.argument('out_file', type=click.Path())
 @click.option('--out_format', type=click.Choice(['html', 'pdf', 'docx']), default=None)
 @click.option('--strict_render', type=click.BOOL, default=True)
-def render(md_file: str, out_file: str, out_format: str|None, strict_render: bool) -> None:
-    '''Render and compile a markdown file.
+@click.option("--cache-dir", type=click.Path(), default=None, help='Directory for persistent caches.')
+@click.option("--output-cache/--no-output-cache", default=False, help='Reuse pandoc outputs of identical conversions.')
+@click.option("--output-cache-size", type=click.INT, default=1024, help='Maximum size of the output cache in MB.')
+@click.option("--image-cache/--no-image-cache", default=False, help='Reuse images rasterized by svg_to_png and pdf_to_png.')
+@click.option("--image-cache-size", type=click.INT, default=256, help='Maximum size of the image cache in MB.')
+@click.option("--image-workers", type=click.INT, default=1, help='Number of processes converting images.')
+@click.option("--table-engine", type=click.Choice(['pandas', 'csv']), default='pandas', help='Engine used by csv_to_markdown.')
+@click.option("--assets-dir", type=click.Path(file_okay=False), default=None, help='Folder for image outputs of notebooks (default: assets next to the output file, or a temporary folder for docx and pdf).')
+def render(
+    md_file: str, 
+    out_file: str, 
+    out_format: str|None, 
+    strict_render: bool, 
+    cache_dir: str|None, 
+    output_cache: bool,
+    output_cache_size: int,
+    image_cache: bool,
+    image_cache_size: int,
+    image_workers: int,
+    table_engine: str,
+    assets_dir: str|None,
+) -> None:
+    '''Render and compile a markdown file. Notebooks (.ipynb files) are read by 
+        pandoc directly; markdown cells that use jinja are rendered first.
     '''
-    doc = MarkdownDoc.from_file(md_file)
+    set_table_engine(table_engine)
+    if Path(md_file).suffix == '.ipynb':
+        try:
+            render_notebook(
+                md_file,
+                output_path=Path(out_file),
+                output_format=out_format,
+                strict_render=bool(strict_render),
+                cache_dir=cache_dir,
+                output_cache=get_output_cache(cache_dir, output_cache_size) if output_cache else None,
+                image_cache=get_image_cache(cache_dir, image_cache_size) if image_cache else None,
+                assets_dir=assets_dir,
+            )
+        except (PandocError, ImageConversionError) as e:
+            handle_error(e)
+        return
+
+    doc = MarkdownDoc.from_file(
+        md_file, 
+        cache_dir=cache_dir,
+        output_cache=get_output_cache(cache_dir, output_cache_size) if output_cache else None,
+        image_cache=get_image_cache(cache_dir, image_cache_size) if image_cache else None,
+        image_workers=image_workers,
+    )
     try:
         doc.render_to_file(
             output_path=Path(out_file),
             output_format=out_format,
             strict_render=bool(strict_render),
         )
-    except PandocError as e:
+    except (PandocError, ImageConversionError) as e:
         handle_error(e)
 
 
+@cli.command()
+@click.argument('patterns', nargs=-1)
+@click.option("--files-from", type=click.File('r'), default=None, help='File listing markdown files, one per line.')
+@click.option("--out-dir", type=click.Path(file_okay=False), default=None, help='Write outputs here, keeping the folder structure of the inputs (default: next to the inputs).')
+@click.option("-f", "--format", "out_formats", type=click.Choice(['html', 'pdf', 'docx']), multiple=True, default=['html'], help='Output format (repeatable).')
+@click.option("-j", "--jobs", type=click.INT, default=1, help='Number of processes rendering documents.')
+@click.option('--strict_render', type=click.BOOL, default=True)
+@click.option("--cache-dir", type=click.Path(), default=None, help='Directory for persistent caches.')
+@click.option("--output-cache/--no-output-cache", default=False, help='Reuse pandoc outputs of identical conversions.')
+@click.option("--output-cache-size", type=click.INT, default=1024, help='Maximum size of the output cache in MB.')
+@click.option("--image-cache/--no-image-cache", default=False, help='Reuse images rasterized by svg_to_png and pdf_to_png.')
+@click.option("--image-cache-size", type=click.INT, default=256, help='Maximum size of the image cache in MB.')
+@click.option("--table-engine", type=click.Choice(['pandas', 'csv']), default='pandas', help='Engine used by csv_to_markdown.')
+def render_multi(
+    patterns: tuple[str, ...], 
+    files_from: typing.TextIO|None, 
+    out_dir: str|None, 
+    out_formats: tuple[str, ...], 
+    jobs: int, 
+    strict_render: bool, 
+    cache_dir: str|None, 
+    output_cache: bool,
+    output_cache_size: int,
+    image_cache: bool,
+    image_cache_size: int,
+    table_engine: str,
+) -> None:
+    '''Render and compile many markdown files (paths or glob patterns) in one 
+        process, continuing after failures. Prints the time spent on each output
+        and exits with status 1 if any output failed.
+    '''
+    set_table_engine(table_engine)
+    md_files = _expand_patterns(list(patterns) + ([l.strip() for l in files_from if l.strip()] if files_from is not None else []))
+    if not len(md_files):
+        raise click.UsageError('No markdown files given.')
+
+    # keep the folder structure below the deepest folder shared by all inputs
+    root = Path(os.path.commonpath([Path(f).resolve().parent for f in md_files]))
+    output_paths = []
+    for md_file in md_files:
+        base = Path(out_dir) / Path(md_file).resolve().relative_to(root) if out_dir is not None else Path(md_file)
+        base.parent.mkdir(parents=True, exist_ok=True)
+        output_paths.append([base.with_suffix(f'.{fmt}') for fmt in out_formats])
+
+    start = time.perf_counter()
+    results = []
+    for result in render_files(
+        md_files,
+        output_paths,
+        strict_render=bool(strict_render),
+        cache_dir=cache_dir,
+        output_cache=get_output_cache(cache_dir, output_cache_size) if output_cache else None,
+        image_cache=get_image_cache(cache_dir, image_cache_size) if image_cache else None,
+        workers=jobs,
+    ):
+        if not result.ok:
+            handle_error(Exception(f'{md_files[result.index]} -> {result.output_path}: {result.error}'))
+        results.append(result)
+    elapsed = time.perf_counter() - start
+
+    num_failed = print_timings(results)
+    print(f'rendered {len(results) - num_failed} of {len(results)} outputs from {len(md_files)} files in {elapsed:.2f}s, {num_failed} failed', file=sys.stderr)
+    if num_failed:
+        sys.exit(1)
+
+def _expand_patterns(patterns: list[str]) -> list[str]:
+    '''Expand glob patterns, keeping plain paths (even missing ones) and the first occurrence of each file.'''
+    files = []
+    for pattern in patterns:
+        files += sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+    return list(dict.fromkeys(files))
+
+
+@cli.command()
+@click.argument('md_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('out_files', nargs=-1, required=True, type=click.Path())
+@click.option('--strict_render', type=click.BOOL, default=True)
+@click.option("--cache-dir", type=click.Path(), default=None, help='Directory for persistent caches.')
+@click.option("--image-cache/--no-image-cache", default=False, help='Reuse images rasterized by svg_to_png and pdf_to_png.')
+@click.option("--image-cache-size", type=click.INT, default=256, help='Maximum size of the image cache in MB.')
+@click.option("--table-engine", type=click.Choice(['pandas', 'csv']), default='pandas', help='Engine used by csv_to_markdown.')
+@click.option("--debounce", type=click.FLOAT, default=0.2, help='Seconds without further changes before rebuilding.')
+@click.option("--interval", type=click.FLOAT, default=0.25, help='Seconds between checks for changed files.')
+def watch(
+    md_file: str, 
+    out_files: tuple[str, ...], 
+    strict_render: bool, 
+    cache_dir: str|None, 
+    image_cache: bool,
+    image_cache_size: int,
+    table_engine: str,
+    debounce: float,
+    interval: float,
+) -> None:
+    '''Render a markdown file to one or more outputs (format from the suffix)
+        and rebuild the affected outputs whenever the file or the tables, 
+        images and bibliographies it uses change. Stop with Ctrl-C.
+    '''
+    set_table_engine(table_engine)
+    with Watcher(
+        Path(md_file),
+        output_paths=[Path(f) for f in out_files],
+        strict_render=bool(strict_render),
+        cache_dir=cache_dir,
+        image_cache=get_image_cache(cache_dir, image_cache_size) if image_cache else None,
+        debounce=debounce,
+        interval=interval,
+    ) as watcher:
+        print(f'watching {md_file}', file=sys.stderr)
+        try:
+            for results in watcher.watch():
+                for result in results:
+                    if result.ok:
+                        print(f'built {result.output_path} in {result.elapsed:.3f}s', file=sys.stderr)
+                    else:
+                        handle_error(result.error)
+        except KeyboardInterrupt:
+            pass
+
+
+@cli.command()
+@click.option("-p", "--project", type=click.Path(exists=True, dir_okay=False), default='pymddoc.toml', help='Project file listing documents, formats, vars and pandoc settings.')
+@click.option("-j", "--jobs", type=click.INT, default=1, help='Number of processes rendering documents.')
+@click.option("--force", is_flag=True, default=False, help='Render all outputs, even if up to date.')
+@click.option("--dry-run", is_flag=True, default=False, help='Only print the outputs that would be rendered.')
+@click.option("--output-cache/--no-output-cache", default=False, help='Reuse pandoc outputs of identical conversions.')
+@click.option("--output-cache-size", type=click.INT, default=1024, help='Maximum size of the output cache in MB.')
+@click.option("--image-cache/--no-image-cache", default=False, help='Reuse images rasterized by svg_to_png and pdf_to_png.')
+@click.option("--image-cache-size", type=click.INT, default=256, help='Maximum size of the image cache in MB.')
+@click.option("--table-engine", type=click.Choice(['pandas', 'csv']), default='pandas', help='Engine used by csv_to_markdown.')
+def build(
+    project: str, 
+    jobs: int, 
+    force: bool, 
+    dry_run: bool, 
+    output_cache: bool,
+    output_cache_size: int,
+    image_cache: bool,
+    image_cache_size: int,
+    table_engine: str,
+) -> None:
+    '''Build the outputs of a project, rendering only those whose markdown file, 
+        tables, images, bibliography, pandoc template or settings changed since 
+        the last build. Exits with status 1 if any output failed.
+    '''
+    set_table_engine(table_engine)
+    try:
+        proj = Project.from_file(Path(project))
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    cache_dir = proj.cache_dir
+    num_outputs = sum(len(d.output_paths) for d in proj.documents)
+
+    if dry_run:
+        outdated = [p for d in proj.documents for p in d.output_paths] if force else proj.outdated()
+        for output_path in outdated:
+            print(output_path)
+        print(f'{len(outdated)} of {num_outputs} outputs to build', file=sys.stderr)
+        return
+
+    start = time.perf_counter()
+    results = []
+    for result in proj.build(
+        force=force,
+        workers=jobs,
+        output_cache=get_output_cache(cache_dir, output_cache_size) if output_cache else None,
+        image_cache=get_image_cache(cache_dir, image_cache_size) if image_cache else None,
+    ):
+        if not result.ok:
+            handle_error(Exception(f'{proj.documents[result.index].md_path} -> {result.output_path}: {result.error}'))
+        results.append(result)
+    elapsed = time.perf_counter() - start
+
+    num_failed = print_timings(results)
+    print(f'built {len(results) - num_failed} outputs in {elapsed:.2f}s, {num_outputs - len(results)} up to date, {num_failed} failed', file=sys.stderr)
+    if num_failed:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     cli()
 
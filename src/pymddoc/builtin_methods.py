@@ -1,27 +1,55 @@
+from __future__ import annotations
+
 import pathlib
-import pandas as pd
 import typing
-import cairosvg
 import functools
+import io
 
 
 from .util import val_or_None, TempPath
+from .images import ImageConverter, ImagePolicy, ImageChoice, ImageFormat, PdfDocuments, get_image_policy
+from .dependencies import add_dependency
+from .tables import (
+    get_table_cache, 
+    get_table_engine, 
+    read_head_and_tail, 
+    read_arrow_table, 
+    csv_to_markdown_table, 
+    TableEngine, 
+    ArrowFormat, 
+    func_key, 
+    kwargs_key,
+)
+
+# pandas and cairosvg are slow to import, so they are imported when first used
+if typing.TYPE_CHECKING:
+    import pandas as pd
 
 def get_builtin_methods(
         tmp_dir: str,
         output_format: typing.Literal['html', 'pdf', 'docx'] | None,
+        image_converter: ImageConverter | None = None,
 ) -> dict[str,typing.Callable|str|None]:
     '''Return a dictionary of template methods.'''
+    image_converter = val_or_None(image_converter, ImageConverter(tmp_dir))
+    policy = get_image_policy(output_format)
     return {
         'csv_to_markdown': csv_to_markdown,
         'excel_to_markdown': excel_to_markdown,
-        'svg_to_png': functools.partial(svg_to_png, tmp_dir),
-        'pdf_to_png': functools.partial(pdf_to_png, tmp_dir),
+        'parquet_to_markdown': parquet_to_markdown,
+        'feather_to_markdown': feather_to_markdown,
+        'svg_to_png': functools.partial(svg_to_png, image_converter, policy),
+        'pdf_to_png': functools.partial(pdf_to_png, image_converter, policy),
+        'pdf_pages_to_png': functools.partial(pdf_pages_to_png, image_converter, policy),
         'HOME_DIR': str(pathlib.Path('~/').expanduser()),
         'OUTPUT_FORMAT': output_format,
     }
 
 
+# builtins whose output depends on the output format (see get_image_policy)
+format_dependent_builtins = frozenset({'OUTPUT_FORMAT', 'svg_to_png', 'pdf_to_png', 'pdf_pages_to_png'})
+
+
 def builtin_methods_str() -> str:
     '''Return a string detailing the builtin methods.'''
     output = ''
@@ -31,40 +59,155 @@ def builtin_methods_str() -> str:
     return output
 
 
-def svg_to_png(tmpfolder: str, url: str, dpi: int = 300, **kwargs) -> str:
-    '''Convert an svg file to a png file stored in /tmp for pandoc compilation.
+def svg_to_png(
+    image_converter: ImageConverter, 
+    policy: ImagePolicy, 
+    url: str, 
+    dpi: int | None = None, 
+    format: ImageFormat | None = None, 
+    **kwargs
+) -> str:
+    '''Convert an svg file to an image stored in /tmp for pandoc compilation. 
+        For html output the svg is inserted as it is; other formats get a 300 dpi png.
     Args:
         url: str: The url of the svg file to convert.
-        dpi: int: The dpi of the output image.
+        dpi: int | None: The dpi of the output image. Depends on the output format if None.
+        format: 'svg' | 'png' | 'webp' | None: The format of the output image. Depends on 
+            the output format if None.
         kwargs: dict: Additional keyword arguments to pass to cairosvg.svg2png().
     '''
-    outfile = f"{tmpfolder}/{pathlib.Path(url).name}.png"
-    cairosvg.svg2png(url=url, write_to=outfile, dpi=dpi, **kwargs)
-    return outfile
+    format = val_or_None(format, policy.format)
+    dpi = val_or_None(dpi, policy.dpi)
+    if format == 'svg':
+        add_dependency(url)
+        image_converter.record(ImageChoice(url, url, 'svg', None))
+        return url
+
+    import cairosvg
+
+    return image_converter.convert(
+        url,
+        f'cairosvg {cairosvg.__version__}',
+        {'dpi': dpi, 'format': format, **kwargs},
+        _svg_to_png, dpi, kwargs,
+        format=format,
+    )
 
-def pdf_to_png(tmpfolder: str, filename: str, pageno: int = 0, dpi: int = 300, **kwargs) -> str:
-    '''Convert a pdf file to a png file stored in /tmp for pandoc compilation.
+def pdf_to_png(
+    image_converter: ImageConverter, 
+    policy: ImagePolicy, 
+    filename: str, 
+    pageno: int = 0, 
+    dpi: int | None = None, 
+    format: ImageFormat | None = None, 
+    **kwargs
+) -> str:
+    '''Convert a pdf file to an image stored in /tmp for pandoc compilation. 
+        For html output the page is converted to svg; other formats get a 300 dpi png.
     Args:
         filename: str: The filename of the pdf file to convert.
         pageno: int: The page number of the svg file to convert.
-        dpi: int: The dpi of the output image.
+        dpi: int | None: The dpi of the output image. Depends on the output format if None.
+        format: 'svg' | 'png' | 'webp' | None: The format of the output image. Depends on 
+            the output format if None.
+        kwargs: dict: Additional keyword arguments to pass to page.get_pixmap().
+    '''
+    return pdf_pages_to_png(image_converter, policy, filename, pages=[pageno], dpi=dpi, format=format, **kwargs)[0]
+
+def pdf_pages_to_png(
+    image_converter: ImageConverter, 
+    policy: ImagePolicy, 
+    filename: str, 
+    pages: typing.Iterable[int] | None = None, 
+    dpi: int | None = None, 
+    format: ImageFormat | None = None, 
+    **kwargs
+) -> list[str]:
+    '''Convert several pages of a pdf file to images stored in /tmp for 
+        pandoc compilation. The pdf is opened once for all pages.
+    Args:
+        filename: str: The filename of the pdf file to convert.
+        pages: typing.Iterable[int] | None: The page numbers to convert. All pages if None.
+        dpi: int | None: The dpi of the output images. Depends on the output format if None.
+        format: 'svg' | 'png' | 'webp' | None: The format of the output images. Depends on 
+            the output format if None.
         kwargs: dict: Additional keyword arguments to pass to page.get_pixmap().
     '''
     import fitz
 
-    outfile = f"{tmpfolder}/{pathlib.Path(filename).name}.png"
-    doc = fitz.open(filename)
-    page = doc.load_page(pageno)
-    pixmap = page.get_pixmap(dpi=dpi, **kwargs)
-    pixmap.save(outfile)
-    return outfile
+    format = val_or_None(format, policy.format)
+    dpi = val_or_None(dpi, policy.dpi)
+    if pages is None:
+        with image_converter.pdf_documents.open(filename) as doc:
+            pages = range(doc.page_count)
+
+    # vector pages do not depend on the resolution
+    params = {'format': 'svg'} if format == 'svg' else {'dpi': dpi, 'format': format, **kwargs}
+    return image_converter.convert_many(
+        filename,
+        f'pymupdf {fitz.VersionBind}',
+        [{'pageno': pageno, **params} for pageno in pages],
+        # open documents are not shared with worker processes
+        _pdf_pages_to_png, kwargs, None if image_converter.parallel else image_converter.pdf_documents,
+        format=format,
+    )
+
+def _svg_to_png(url: str, items: list[tuple[str, dict]], dpi: int, kwargs: dict[str,typing.Any]) -> None:
+    import cairosvg
+
+    for outfile, params in items:
+        if params['format'] == 'webp':
+            _save_webp(cairosvg.svg2png(url=url, dpi=dpi, **kwargs), outfile)
+        else:
+            cairosvg.svg2png(url=url, write_to=outfile, dpi=dpi, **kwargs)
+
+def _pdf_pages_to_png(
+    filename: str, 
+    items: list[tuple[str, dict]], 
+    kwargs: dict[str,typing.Any], 
+    documents: PdfDocuments | None,
+) -> None:
+    if documents is None:
+        import fitz
+        with fitz.open(filename) as doc:
+            _write_pdf_pages(doc, items, kwargs)
+    else:
+        with documents.open(filename) as doc:
+            _write_pdf_pages(doc, items, kwargs)
+
+def _write_pdf_pages(doc, items: list[tuple[str, dict]], kwargs: dict[str,typing.Any]) -> None:
+    for outfile, params in items:
+        page = doc.load_page(params['pageno'])
+        if params['format'] == 'svg':
+            with open(outfile, 'w', encoding='utf-8') as f:
+                f.write(page.get_svg_image())
+            continue
+
+        pixmap = page.get_pixmap(dpi=params['dpi'], **kwargs)
+        if params['format'] == 'webp':
+            _save_webp(pixmap.tobytes('png'), outfile)
+        else:
+            pixmap.save(outfile)
+
+def _save_webp(png: bytes, outfile: str) -> None:
+    '''Write png data as a webp image. Requires Pillow.'''
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ImportError('Writing webp images requires Pillow (pip install pillow).') from e
+
+    with Image.open(io.BytesIO(png)) as image:
+        image.save(outfile, 'WEBP')
 
 
 def csv_to_markdown(
     fname: str, 
     num_rows: int | None = None,
     read_kwargs: dict[str,typing.Any] | None = None, 
-    to_markdown_kwargs: dict[str,typing.Any] | None = None
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
+    engine: TableEngine | None = None,
 ) -> str:
     '''Read a csv file from disk and insert it into the document as markdown.
     Args:
@@ -73,13 +216,29 @@ def csv_to_markdown(
         read_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the read
             function.
         to_markdown_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the
+        columns: list[str] | None: The columns to read. All columns if None.
+        tail_rows: int | None: Also show this many rows from the end of the table, 
+            separated from the first num_rows rows by a row of ellipses.
+        engine: 'pandas' | 'csv' | None: 'csv' writes the table without pandas and supports
+            fewer read/markdown arguments. Uses set_table_engine() if None.
     '''
+    if val_or_None(engine, get_table_engine()) == 'csv':
+        return get_table_cache().memoize(
+            fname,
+            ('markdown', 'csv', kwargs_key(val_or_None(read_kwargs, {})), num_rows, tail_rows, 
+                repr(columns), kwargs_key(val_or_None(to_markdown_kwargs, {}))),
+            lambda: csv_to_markdown_table(fname, num_rows, read_kwargs, to_markdown_kwargs, columns, tail_rows),
+        )
+
+    import pandas as pd
     return table_to_md(
         pd.read_csv,
         fname = fname,
         num_rows=num_rows,
         read_kwargs=read_kwargs,
         to_markdown_kwargs=to_markdown_kwargs,
+        columns=columns,
+        tail_rows=tail_rows,
     )
 
 
@@ -87,7 +246,9 @@ def excel_to_markdown(
     fname: str, 
     num_rows: int | None = None,
     read_kwargs: dict[str,typing.Any] | None = None, 
-    to_markdown_kwargs: dict[str,typing.Any] | None = None
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
 ) -> str:
     '''Read an excel file from disk and insert it into the document as markdown.
     Args:
@@ -96,23 +257,105 @@ def excel_to_markdown(
         read_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the read
             function.
         to_markdown_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the
+        columns: list[str] | None: The columns to read. All columns if None.
+        tail_rows: int | None: Also show this many rows from the end of the table, 
+            separated from the first num_rows rows by a row of ellipses.
     '''
+    import pandas as pd
     return table_to_md(
         pd.read_excel,
         fname = fname,
         num_rows=num_rows,
         read_kwargs=read_kwargs,
         to_markdown_kwargs=to_markdown_kwargs,
+        columns=columns,
+        tail_rows=tail_rows,
     )
 
+def parquet_to_markdown(
+    fname: str, 
+    num_rows: int | None = None,
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
+    filters: list[tuple] | None = None,
+) -> str:
+    '''Read a parquet file from disk and insert it into the document as markdown.
+        Only the requested columns and row groups are read. Requires pyarrow.
+    Args:
+        fname: str: The file name to read.
+        num_rows: int | None: The number of rows to read.
+        to_markdown_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the
+        columns: list[str] | None: The columns to read. All columns if None.
+        tail_rows: int | None: Also show this many rows from the end of the table, 
+            separated from the first num_rows rows by a row of ellipses.
+        filters: list[tuple] | None: Only show rows matching (column, op, value) predicates, 
+            e.g. [('year', '>=', 2020)].
+    '''
+    return arrow_to_md(fname, 'parquet', num_rows, to_markdown_kwargs, columns, tail_rows, filters)
+
+def feather_to_markdown(
+    fname: str, 
+    num_rows: int | None = None,
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
+    filters: list[tuple] | None = None,
+) -> str:
+    '''Read a feather (Arrow IPC) file from disk and insert it into the document as 
+        markdown. Only the requested columns are read. Requires pyarrow.
+    Args:
+        fname: str: The file name to read.
+        num_rows: int | None: The number of rows to read.
+        to_markdown_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the
+        columns: list[str] | None: The columns to read. All columns if None.
+        tail_rows: int | None: Also show this many rows from the end of the table, 
+            separated from the first num_rows rows by a row of ellipses.
+        filters: list[tuple] | None: Only show rows matching (column, op, value) predicates, 
+            e.g. [('year', '>=', 2020)].
+    '''
+    return arrow_to_md(fname, 'ipc', num_rows, to_markdown_kwargs, columns, tail_rows, filters)
+
+def arrow_to_md(
+    fname: str,
+    format: ArrowFormat,
+    num_rows: int | None = None,
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
+    filters: list[tuple] | None = None,
+) -> str:
+    '''Read a parquet or Arrow IPC file (see read_arrow_table) and insert it into
+        the document as markdown.
+    '''
+    to_markdown_kwargs = val_or_None(to_markdown_kwargs, {})
+    num_rows = int(num_rows) if num_rows is not None else None
+    tail_rows = int(tail_rows) if tail_rows is not None else None
+    key = (format, repr(columns), repr(filters), num_rows, tail_rows)
+
+    def render() -> str:
+        df = cache.memoize(
+            fname, 
+            ('arrow', *key), 
+            lambda: read_arrow_table(fname, format, columns, filters, num_rows, tail_rows),
+        )
+        return df.to_markdown(**{'index': False, **to_markdown_kwargs})
+
+    cache = get_table_cache()
+    return cache.memoize(fname, ('markdown', *key, kwargs_key(to_markdown_kwargs)), render)
+
 def table_to_md(
     read_func: typing.Callable[..., pd.DataFrame],
     fname: str, 
     num_rows: int | None = None,
     read_kwargs: dict[str,typing.Any] | None = None, 
-    to_markdown_kwargs: dict[str,typing.Any] | None = None
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
 ) -> str:
     '''Read a table file from disk and insert it into the document as markdown.
+        Only the requested rows and columns are read where the read function
+        supports it (nrows/usecols), so large files are not fully loaded.
     Args:
         read_func: typing.Callable[..., pd.DataFrame]: The function to read the table.
         fname: str: The file name to read.
@@ -120,23 +363,31 @@ def table_to_md(
         read_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the read
             function.
         to_markdown_kwargs: dict[str,typing.Any] | None: The keyword arguments to pass to the
+        columns: list[str] | None: The columns to read. All columns if None.
+        tail_rows: int | None: Also show this many rows from the end of the table.
     '''
-    #read_kwargs = read_kwargs if read_kwargs is not None else {}
     read_kwargs = val_or_None(read_kwargs, {})
-    #to_markdown_kwargs = to_markdown_kwargs if to_markdown_kwargs is not None else {}
     to_markdown_kwargs = val_or_None(to_markdown_kwargs, {})
+    num_rows = int(num_rows) if num_rows is not None else None
 
-    df = read_func(fname, **read_kwargs)
-
-    if num_rows is not None:
-        df = df.head(int(num_rows))
-
-    to_markdown_kwargs = {'index': False, **to_markdown_kwargs}
-    df_md = df.to_markdown(**to_markdown_kwargs)
-
-    return df_md
-
-
+    # project columns while parsing instead of after loading
+    if columns is not None:
+        read_kwargs = {'usecols': list(columns), **read_kwargs}
 
+    def render() -> str:
+        if tail_rows is not None:
+            df = read_head_and_tail(read_func, fname, val_or_None(num_rows, 0), int(tail_rows), read_kwargs)
+        elif num_rows is not None:
+            df = cache.read_table(read_func, fname, {'nrows': num_rows, **read_kwargs}).head(num_rows)
+        else:
+            df = cache.read_table(read_func, fname, read_kwargs)
 
+        return df.to_markdown(**{'index': False, **to_markdown_kwargs})
 
+    # the same table is often inserted several times in a document
+    cache = get_table_cache()
+    return cache.memoize(
+        fname,
+        ('markdown', func_key(read_func), kwargs_key(read_kwargs), num_rows, tail_rows, kwargs_key(to_markdown_kwargs)),
+        render,
+    )
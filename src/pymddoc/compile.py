@@ -6,8 +6,16 @@ import pypandoc
 import json
 import jinja2
 import tempfile
+import asyncio
+import weakref
+import subprocess
+import threading
+import io
+import contextlib
 
 from .util import val_or_None, map_or_None, pandoc_execute
+from .errors import PandocError
+from .output_cache import OutputCache
 
 InputFormat = typing.Literal['md', 'markdown']
 RenderFormat = typing.Literal['html', 'pdf', 'docx']
@@ -39,7 +47,8 @@ class PandocArgs:
         '''Accept specific args to create list of arguments for the pandoc conversion.
         Example: pandoc ... --standalone --embed-resources -f markdown --toc --citeproc --bibliography {filename}
         '''
-        extra_args: list[str] = val_or_None(self.extra_args, [])
+        # copy so repeated calls do not keep appending to self.extra_args
+        extra_args: list[str] = list(val_or_None(self.extra_args, []))
 
         if self.template is not None:
             extra_args.append(f'--template={self.template}')
@@ -60,12 +69,66 @@ class PandocArgs:
 
 
 
+@dataclasses.dataclass(frozen=True)
+class PandocAST:
+    '''Pandoc's JSON representation of a parsed document. Parse markdown
+        once with from_text() and write it to any number of formats.
+    Args:
+        json_text: the document as produced by pandoc's json writer.
+    '''
+    json_text: str
+
+    @classmethod
+    def from_text(cls, 
+        input_text: str, 
+        input_format: typing.Literal['md', 'markdown'] = 'md',
+    ) -> typing.Self:
+        '''Parse text into pandoc's AST.'''
+        return cls(pandoc_execute(
+            pypandoc.convert_text,
+            source=input_text,
+            to='json',
+            format=input_format,
+        ))
+
+    def to_string(self,
+        output_format: typing.Literal['html'],
+        pandoc_args: PandocArgs | None = None,
+        output_cache: OutputCache | None = None,
+    ) -> str:
+        '''Write the document to a string in the output format.'''
+        return pandoc_convert_text(
+            input_text=self.json_text,
+            input_format='json',
+            output_format=output_format,
+            pandoc_args=pandoc_args,
+            output_cache=output_cache,
+        )
+
+    def to_file(self,
+        output_path: Path,
+        output_format: typing.Optional[typing.Literal['html', 'pdf', 'docx']] = None,
+        pandoc_args: PandocArgs | None = None,
+        output_cache: OutputCache | None = None,
+    ) -> str:
+        '''Write the document to a file in the output format.'''
+        return pandoc_convert_stream(
+            input_chunks=[self.json_text],
+            input_format='json',
+            output_path=output_path,
+            output_format=output_format,
+            pandoc_args=pandoc_args,
+            output_cache=output_cache,
+        )
+
+
 ###################### Converting to Other Formats with Pandoc ######################
 def pandoc_convert_text(
     input_text: str,
-    input_format: typing.Literal['md', 'markdown'],
+    input_format: typing.Literal['md', 'markdown', 'json'],
     output_format: typing.Literal['html'],
     pandoc_args: PandocArgs | None = None,
+    output_cache: OutputCache | None = None,
 ) -> str:
     '''Convert the markdown file to another template.
         See this page for more about pandoc markdown:
@@ -75,11 +138,17 @@ def pandoc_convert_text(
         input_format: the format of the input file.
         output_format: the format of the output file.
         pandoc_args: the arguments for the pandoc conversion.
+        output_cache: if provided, reuse the output of identical conversions.
     '''
     pandoc_args = val_or_None(pandoc_args, PandocArgs())
     extra_args, kwargs = pandoc_args.to_list()
 
-    return pandoc_execute(
+    if output_cache is not None:
+        key = output_cache.key(input_text, input_format, output_format, pandoc_args)
+        if (cached := output_cache.get_text(key)) is not None:
+            return cached
+
+    converted = pandoc_execute(
         pypandoc.convert_text,
         source=input_text, 
         to=output_format,
@@ -87,6 +156,9 @@ def pandoc_convert_text(
         extra_args=extra_args,
         **kwargs
     )
+    if output_cache is not None:
+        output_cache.put_text(key, converted)
+    return converted
 
 def pandoc_convert_file(
     input_path: Path,
@@ -94,6 +166,7 @@ def pandoc_convert_file(
     output_path: Path,
     output_format: typing.Optional[typing.Literal['html', 'pdf', 'docx']] = None,
     pandoc_args: PandocArgs | None = None,
+    output_cache: OutputCache | None = None,
 ) -> str:
     '''Convert the markdown text to a file using pandoc.
         See this page for more about pandoc markdown:
@@ -104,20 +177,254 @@ def pandoc_convert_file(
         output_path: path to the output file.
         output_format: the format of the output file.
         pandoc_args: the arguments for the pandoc conversion.
+        output_cache: if provided, reuse the output of identical conversions.
     '''
     input_path = map_or_None(input_path, Path)
     output_path = map_or_None(output_path, Path)
     
     pandoc_args = val_or_None(pandoc_args, PandocArgs())
     extra_args, kwargs = pandoc_args.to_list()
+    output_format = val_or_None(output_format, output_path.suffix[1:])
+
+    if output_cache is not None:
+        key = output_cache.key(input_path.read_text(), input_format, output_format, pandoc_args)
+        if output_cache.get_file(key, output_path):
+            return ''
 
-    return pandoc_execute(
+    converted = pandoc_execute(
         pypandoc.convert_file,
         source_file=str(input_path), 
-        to = val_or_None(output_format, output_path.suffix[1:]),
+        to = output_format,
         format=input_format,
         outputfile=str(output_path),
         extra_args=extra_args,
         **kwargs,
     )
+    if output_cache is not None:
+        output_cache.put_file(key, output_path)
+    return converted
+
+def pandoc_convert_stream(
+    input_chunks: typing.Iterable[str],
+    input_format: str,
+    output_path: Path,
+    output_format: typing.Optional[typing.Literal['html', 'pdf', 'docx']] = None,
+    pandoc_args: PandocArgs | None = None,
+    output_cache: OutputCache | None = None,
+) -> str:
+    '''Convert text to a file by writing it to pandoc's stdin as it is 
+        produced, e.g. from jinja2.Template.generate(). The full input is 
+        never held in memory or written to disk, except when output_cache 
+        is used because the key depends on the whole input.
+    Args:
+        input_chunks: pieces of the input text, in order.
+        input_format: the format of the input text.
+        output_path: path to the output file.
+        output_format: the format of the output file.
+        pandoc_args: the arguments for the pandoc conversion.
+        output_cache: if provided, reuse the output of identical conversions.
+    '''
+    output_path = Path(output_path)
+    pandoc_args = val_or_None(pandoc_args, PandocArgs())
+    output_format = val_or_None(output_format, output_path.suffix[1:])
+
+    if output_cache is not None:
+        input_text = ''.join(input_chunks)
+        key = output_cache.key(input_text, input_format, output_format, pandoc_args)
+        if output_cache.get_file(key, output_path):
+            return ''
+        input_chunks = [input_text]
+
+    command, cwd = pandoc_command(
+        input_format=input_format,
+        output_format=output_format,
+        output_path=output_path,
+        pandoc_args=pandoc_args,
+    )
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+    )
+
+    # drain the output pipes so pandoc never blocks while we are writing
+    outputs: dict[str, bytes] = {}
+    readers = [
+        threading.Thread(target=lambda n=n, p=p: outputs.__setitem__(n, p.read()))
+        for n, p in (('stdout', process.stdout), ('stderr', process.stderr))
+    ]
+    for reader in readers:
+        reader.start()
+
+    stdin = io.TextIOWrapper(process.stdin, encoding='utf-8')
+    try:
+        for chunk in input_chunks:
+            stdin.write(chunk)
+        stdin.close()
+    except BrokenPipeError:
+        # pandoc exited early; its error is reported below
+        pass
+    except BaseException:
+        # kill pandoc while its stdin is still open: closing it first would
+        # be a clean EOF, and pandoc would write the partial input
+        process.kill()
+        raise
+    finally:
+        with contextlib.suppress(OSError):
+            stdin.close()
+        process.wait()
+        for reader in readers:
+            reader.join()
 
+    if process.returncode != 0:
+        raise PandocError(f'Pandoc died with exitcode "{process.returncode}" '
+            f'during conversion: {outputs["stderr"].decode("utf-8")}')
+    
+    if output_cache is not None:
+        output_cache.put_file(key, output_path)
+    return outputs['stdout'].decode('utf-8')
+
+
+###################### Pandoc Command Line ######################
+def pandoc_command(
+    input_format: str,
+    output_format: str,
+    output_path: Path | None = None,
+    pandoc_args: PandocArgs | None = None,
+) -> tuple[list[str], str | None]:
+    '''Build the pandoc command that pypandoc would run for a conversion 
+        reading from stdin. Returns the command and its working directory.
+    Args:
+        input_format: the format of the input.
+        output_format: the format of the output.
+        output_path: path to the output file. Output goes to stdout if None.
+        pandoc_args: the arguments for the pandoc conversion.
+    '''
+    pandoc_args = val_or_None(pandoc_args, PandocArgs())
+    extra_args, kwargs = pandoc_args.to_list()
+
+    # translate the pypandoc keyword arguments that affect the command
+    kwargs = dict(kwargs)
+    filters = kwargs.pop('filters', None)
+    sandbox = kwargs.pop('sandbox', False)
+    cworkdir = kwargs.pop('cworkdir', None)
+    kwargs.pop('verify_format', None)
+    kwargs.pop('encoding', None)
+    if len(kwargs):
+        raise ValueError(f'Unsupported pandoc_kwargs: {", ".join(kwargs)}')
+    
+    # pdf is produced by pandoc's latex writer
+    output_format = pypandoc.normalize_format(output_format)
+    if output_format == 'pdf':
+        output_format = 'latex'
+
+    command = [
+        pypandoc.get_pandoc_path(),
+        f'--from={pypandoc.normalize_format(input_format)}',
+        f'--to={output_format}',
+    ]
+    if output_path is not None:
+        command.append(f'--output={output_path}')
+    if sandbox:
+        command.append('--sandbox')
+    command += extra_args
+
+    if isinstance(filters, str):
+        filters = filters.split()
+    for f in val_or_None(filters, []):
+        command.append(f'--lua-filter={f}' if f.endswith('.lua') else f'--filter={f}')
+
+    return command, cworkdir
+
+
+###################### Async Conversion ######################
+_async_pandoc_limit: int = 8
+_async_pandoc_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple[int, asyncio.Semaphore]] = weakref.WeakKeyDictionary()
+
+def set_async_pandoc_limit(limit: int) -> None:
+    '''Set the maximum number of pandoc processes run at once by the 
+        async conversion functions in each event loop.
+    '''
+    global _async_pandoc_limit
+    if limit < 1:
+        raise ValueError(f'limit must be at least 1, not {limit}.')
+    _async_pandoc_limit = limit
+
+def _get_async_pandoc_semaphore() -> asyncio.Semaphore:
+    '''Get the semaphore limiting pandoc processes in the running loop.'''
+    loop = asyncio.get_running_loop()
+    limit, semaphore = _async_pandoc_semaphores.get(loop, (None, None))
+    if limit != _async_pandoc_limit:
+        semaphore = asyncio.Semaphore(_async_pandoc_limit)
+        _async_pandoc_semaphores[loop] = (_async_pandoc_limit, semaphore)
+    return semaphore
+
+
+async def apandoc_convert_text(
+    input_text: str,
+    input_format: typing.Literal['md', 'markdown'],
+    output_format: typing.Literal['html', 'pdf', 'docx'],
+    output_path: Path | None = None,
+    pandoc_args: PandocArgs | None = None,
+    timeout: float | None = None,
+    output_cache: OutputCache | None = None,
+) -> str:
+    '''Convert text with a non-blocking pandoc subprocess. Waits if the
+        concurrency limit (see set_async_pandoc_limit) has been reached. 
+        The pandoc process is killed if the task is cancelled or times out.
+    Args:
+        input_text: the markdown text to convert.
+        input_format: the format of the input text.
+        output_format: the format of the output.
+        output_path: path to the output file. Output is returned if None.
+        pandoc_args: the arguments for the pandoc conversion.
+        timeout: seconds to wait for pandoc before raising PandocError.
+        output_cache: if provided, reuse the output of identical conversions.
+    '''
+    pandoc_args = val_or_None(pandoc_args, PandocArgs())
+    if output_cache is not None:
+        key = output_cache.key(input_text, input_format, output_format, pandoc_args)
+        if output_path is not None and output_cache.get_file(key, output_path):
+            return ''
+        elif output_path is None and (cached := output_cache.get_text(key)) is not None:
+            return cached
+
+    command, cwd = pandoc_command(
+        input_format=input_format,
+        output_format=output_format,
+        output_path=output_path,
+        pandoc_args=pandoc_args,
+    )
+    async with _get_async_pandoc_semaphore():
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input_text.encode('utf-8')), 
+                timeout=timeout,
+            )
+        except TimeoutError as e:
+            raise PandocError(f'Pandoc did not finish within {timeout} seconds.') from e
+        finally:
+            # cancelled or timed out: do not leave pandoc running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    if process.returncode != 0:
+        raise PandocError(f'Pandoc died with exitcode "{process.returncode}" '
+            f'during conversion: {stderr.decode("utf-8")}')
+    
+    converted = stdout.decode('utf-8')
+    if output_cache is not None and output_path is not None:
+        output_cache.put_file(key, output_path)
+    elif output_cache is not None:
+        output_cache.put_text(key, converted)
+    return converted
@@ -0,0 +1,654 @@
+from __future__ import annotations
+
+import typing
+from pathlib import Path
+import dataclasses
+import tempfile
+import time
+import concurrent.futures
+import multiprocessing.util
+import asyncio
+import jinja2
+
+from .builtin_methods import get_builtin_methods, format_dependent_builtins
+from .util import val_or_None
+from .output_cache import OutputCache
+from .images import ImageCache, ImageConverter, ImageChoice
+from .tables import get_table_engine, set_table_engine
+from .dependencies import record_dependencies, referenced_files
+
+from .render import (
+    text_as_jinja_template,
+    jinja_get_variables,
+    get_template_cache,
+    _add_line_number_to_exception_message,
+    jinja_generate,
+)
+from .compile import (
+    pandoc_convert_text, 
+    pandoc_convert_stream, 
+    apandoc_convert_text, 
+    PandocArgs, 
+    PandocAST,
+    RenderFormat,
+)
+
+
+@dataclasses.dataclass
+class RenderResult:
+    '''Outcome of one render in a batch.
+    Args:
+        index: position of the item in the input iterables.
+        output_path: path to the output file.
+        elapsed: seconds spent rendering this item.
+        error: the exception raised by this item, if any.
+        images: images inserted by builtin methods, with their format and dpi.
+        dependencies: resolved paths of the local files the output was built
+            from (tables and images read by builtin methods, files read by pandoc).
+    '''
+    index: int
+    output_path: Path
+    elapsed: float
+    error: Exception | None = None
+    images: list[ImageChoice] = dataclasses.field(default_factory=list)
+    dependencies: set[str] = dataclasses.field(default_factory=set)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclasses.dataclass(repr=False)
+class CompiledMarkdownDoc:
+    '''Markdown document whose jinja template is compiled once to be
+        rendered with many different sets of variables. Builtin methods
+        and the temporary folder they write to are reused across renders;
+        use as a context manager or call close() to remove the folder.
+    Args:
+        md_text: the markdown text (a jinja template).
+        cache_dir: optional directory for persistent caches.
+        output_cache: if provided, reuse pandoc outputs of identical conversions.
+        image_cache: if provided, reuse images rasterized by builtin methods.
+        image_workers: number of processes rasterizing images for builtin
+            methods. Images are converted while rendering if None or 1.
+    '''
+    md_text: str
+    cache_dir: Path | None = None
+    output_cache: OutputCache | None = None
+    image_cache: ImageCache | None = None
+    image_workers: int | None = None
+    template: jinja2.Template = dataclasses.field(init=False)
+    variables: frozenset[str] = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        cache = get_template_cache(self.cache_dir)
+        try:
+            self.template = text_as_jinja_template(self.md_text, cache=cache)
+        except jinja2.exceptions.TemplateSyntaxError as e:
+            raise _add_line_number_to_exception_message(e)
+        self.variables = frozenset(jinja_get_variables(self.md_text, cache=cache))
+        self._tmp: tempfile.TemporaryDirectory | None = None
+        self._builtins: dict[str|None, dict[str,typing.Any]] = {}
+        self._image_converter: ImageConverter | None = None
+
+    ###################### rendering ######################
+    def render_text(self,
+        output_format: RenderFormat | None = None,
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+    ) -> str:
+        '''Render the jinja template to markdown text.
+        Args:
+            output_format: the output format exposed to the template as OUTPUT_FORMAT.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+        '''
+        rendered = ''.join(jinja_generate(self.template, self._get_vars(output_format, vars), strict_render))
+        self._wait_for_images()
+        return rendered
+
+    def render_to_file(self,
+        output_path: Path,
+        output_format: RenderFormat | None = None,
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+    ) -> str:
+        '''Render/compile the markdown document to a file using jinja/pandoc.
+        Args:
+            output_path: path to the output file.
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+        '''
+        # stream rendered chunks straight into pandoc's stdin
+        rendered_chunks = self._generate(
+            self._get_vars(output_format, vars), strict_render
+        )
+        return pandoc_convert_stream(
+            input_chunks=rendered_chunks,
+            input_format='md',
+            output_path=output_path,
+            output_format=output_format,
+            pandoc_args=pandoc_args,
+            output_cache=self._get_output_cache(),
+        )
+
+    def render_to_string(self,
+        output_format: typing.Literal['html'],
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+    ) -> str:
+        '''Render the markdown document to a string using jinja/pandoc.
+        Args:
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+        '''
+        rendered = self.render_text(
+            output_format=output_format,
+            vars=vars,
+            strict_render=strict_render,
+        )
+        return pandoc_convert_text(
+            input_text=rendered,
+            input_format='md',
+            output_format=output_format,
+            pandoc_args=pandoc_args,
+            output_cache=self._get_output_cache(),
+        )
+
+    def render_ast(self,
+        output_format: RenderFormat | None = None,
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+    ) -> PandocAST:
+        '''Render the jinja template and parse the result into pandoc's AST. 
+            Images created by builtin methods are only available while this 
+            compiled document is open.
+        Args:
+            output_format: the output format exposed to the template as OUTPUT_FORMAT.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+        '''
+        return PandocAST.from_text(
+            self.render_text(
+                output_format=output_format,
+                vars=vars,
+                strict_render=strict_render,
+            ),
+            input_format='md',
+        )
+
+    def render_to_files(self,
+        output_paths: dict[RenderFormat, Path],
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+    ) -> dict[RenderFormat, str]:
+        '''Render the document to several formats at once. The template is 
+            rendered once per distinct OUTPUT_FORMAT (only once if neither
+            the template nor the image builtins it calls use it), parsed 
+            into pandoc's AST once per distinct rendered text, and the 
+            writers run concurrently.
+        Args:
+            output_paths: output file for each format, e.g. {'html': 'doc.html'}.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+        '''
+        if not len(output_paths):
+            return {}
+        uses_format = not self.variables.isdisjoint(format_dependent_builtins)
+        pandoc_args = val_or_None(pandoc_args, PandocArgs())
+
+        asts: dict[str, PandocAST] = {}
+        format_asts: dict[RenderFormat, PandocAST] = {}
+        cache_keys: dict[RenderFormat, str] = {}
+        results: dict[RenderFormat, str] = {}
+        for output_format, output_path in output_paths.items():
+            rendered = self.render_text(
+                output_format=output_format if uses_format else None,
+                vars=vars,
+                strict_render=strict_render,
+            )
+
+            # cache hits skip both the parse and the writer
+            if (output_cache := self._get_output_cache()) is not None:
+                key = output_cache.key(rendered, 'md', output_format, pandoc_args)
+                if output_cache.get_file(key, output_path):
+                    results[output_format] = ''
+                    continue
+                cache_keys[output_format] = key
+
+            if rendered not in asts:
+                asts[rendered] = PandocAST.from_text(rendered, input_format='md')
+            format_asts[output_format] = asts[rendered]
+
+        # each writer is a separate pandoc process
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(output_paths)) as executor:
+            futures = {
+                output_format: executor.submit(
+                    ast.to_file,
+                    output_path=output_paths[output_format],
+                    output_format=output_format,
+                    pandoc_args=pandoc_args,
+                )
+                for output_format, ast in format_asts.items()
+            }
+            for output_format, future in futures.items():
+                results[output_format] = future.result()
+                if output_format in cache_keys:
+                    output_cache.put_file(cache_keys[output_format], output_paths[output_format])
+        
+        return {output_format: results[output_format] for output_format in output_paths}
+
+    async def arender_to_file(self,
+        output_path: Path,
+        output_format: RenderFormat | None = None,
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        '''Async version of render_to_file that runs pandoc without blocking
+            the event loop (see apandoc_convert_text).
+        Args:
+            output_path: path to the output file.
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+            timeout: seconds to wait for pandoc before raising PandocError.
+        '''
+        # builtins may convert images, so render outside the event loop
+        rendered = await asyncio.to_thread(self.render_text,
+            output_format=output_format,
+            vars=vars,
+            strict_render=strict_render,
+        )
+        return await apandoc_convert_text(
+            input_text=rendered,
+            input_format='md',
+            output_format=val_or_None(output_format, Path(output_path).suffix[1:]),
+            output_path=output_path,
+            pandoc_args=pandoc_args,
+            output_cache=self._get_output_cache(),
+            timeout=timeout,
+        )
+
+    async def arender_to_string(self,
+        output_format: typing.Literal['html'],
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        '''Async version of render_to_string that runs pandoc without blocking
+            the event loop (see apandoc_convert_text).
+        Args:
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+            timeout: seconds to wait for pandoc before raising PandocError.
+        '''
+        rendered = await asyncio.to_thread(self.render_text,
+            output_format=output_format,
+            vars=vars,
+            strict_render=strict_render,
+        )
+        return await apandoc_convert_text(
+            input_text=rendered,
+            input_format='md',
+            output_format=output_format,
+            pandoc_args=pandoc_args,
+            output_cache=self._get_output_cache(),
+            timeout=timeout,
+        )
+
+    def render_many(self,
+        vars_iter: typing.Iterable[dict[str,typing.Any]],
+        output_paths: typing.Iterable[Path],
+        output_format: RenderFormat | None = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        workers: int | None = None,
+    ) -> typing.Iterator[RenderResult]:
+        '''Render one output file per set of variables, yielding results as
+            they complete. Errors are reported per item in the results and
+            do not stop the batch.
+        Args:
+            vars_iter: the variables for each render.
+            output_paths: the output file for each render.
+            output_format: the format of the output files.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+            workers: number of worker processes. Render in this process if
+                None or 1.
+        '''
+        items = enumerate(zip(vars_iter, output_paths, strict=True))
+        render_kwargs = dict(
+            output_format=output_format,
+            strict_render=strict_render,
+            pandoc_args=pandoc_args,
+        )
+
+        if workers is None or workers <= 1:
+            for i, (vars, output_path) in items:
+                yield render_item(self, i, vars, output_path, render_kwargs)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.__getstate__(),),
+        ) as executor:
+
+            # keep a bounded number of items in flight so large batches stream
+            pending: dict[concurrent.futures.Future, tuple[int, Path]] = {}
+            for i, (vars, output_path) in items:
+                if len(pending) >= 4 * workers:
+                    yield from _collect_done(pending)
+                future = executor.submit(_render_in_worker, i, vars, output_path, render_kwargs)
+                pending[future] = (i, output_path)
+
+            while pending:
+                yield from _collect_done(pending)
+
+    def image_choices(self) -> list[ImageChoice]:
+        '''Get the images inserted by builtin methods during the last render
+            in this thread, with the format and resolution chosen for them.
+        '''
+        if self._image_converter is None:
+            return []
+        return self._image_converter.choices()
+
+    ###################### resources ######################
+    def close(self) -> None:
+        '''Remove the temporary folder used by the builtin methods.'''
+        if self._image_converter is not None:
+            self._image_converter.close()
+            self._image_converter = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+        self._builtins.clear()
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict[str,typing.Any]:
+        # templates and temporary folders are recreated in other processes
+        return {f.name: getattr(self, f.name) for f in dataclasses.fields(self) if f.init}
+
+    def __setstate__(self, state: dict[str,typing.Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.__post_init__()
+
+    def _generate(self, vars: dict[str,typing.Any], strict_render: bool) -> typing.Iterator[str]:
+        '''Render the template in chunks, waiting for scheduled image 
+            conversions before the last chunk is consumed.
+        '''
+        yield from jinja_generate(self.template, vars, strict_render)
+        self._wait_for_images()
+
+    def _wait_for_images(self) -> None:
+        '''Wait for image conversions scheduled by builtin methods.'''
+        if self._image_converter is not None:
+            self._image_converter.wait()
+
+    def _get_tmp_dir(self) -> str:
+        '''Get the temporary folder shared by all renders.'''
+        if self._tmp is None:
+            self._tmp = tempfile.TemporaryDirectory()
+        return self._tmp.name
+
+    def _get_output_cache(self) -> OutputCache | None:
+        '''Get the output cache with keys independent of the temporary folder.'''
+        if self.output_cache is None:
+            return None
+        return self.output_cache.ignoring_dirs(self._get_tmp_dir())
+
+    def _get_vars(self,
+        output_format: RenderFormat | None,
+        vars: typing.Optional[dict[str,typing.Any]],
+    ) -> dict[str,typing.Any]:
+        '''Get builtins and user variables for a render.'''
+        vars = {
+            **self._get_builtins(output_format),
+            **val_or_None(vars, {}),
+        }
+        self._get_image_converter().reset_choices()
+        return vars
+
+    def _get_image_converter(self) -> ImageConverter:
+        '''Get the image converter shared by the builtins of all formats.'''
+        if self._image_converter is None:
+            self._image_converter = ImageConverter(
+                self._get_tmp_dir(),
+                image_cache=self.image_cache,
+                workers=self.image_workers,
+            )
+        return self._image_converter
+
+    def _get_builtins(self, output_format: RenderFormat | None) -> dict[str,typing.Any]:
+        '''Get builtin methods for the output format, created once per format.'''
+        if output_format not in self._builtins:
+            self._builtins[output_format] = get_builtin_methods(
+                tmp_dir=self._get_tmp_dir(),
+                output_format=output_format,
+                image_converter=self._get_image_converter(),
+            )
+        return self._builtins[output_format]
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(variables={sorted(self.variables)})'
+
+
+###################### batch rendering helpers ######################
+def render_item(
+    doc: CompiledMarkdownDoc,
+    index: int,
+    vars: dict[str,typing.Any],
+    output_path: Path,
+    render_kwargs: dict[str,typing.Any],
+) -> RenderResult:
+    '''Render a compiled document to one output, capturing any error instead
+        of raising it. The result lists the files the render read (see 
+        record_dependencies and referenced_files).
+    Args:
+        doc: the compiled document.
+        index: the index reported in the result.
+        vars: the variables to substitute into the jinja template.
+        output_path: path to the output file.
+        render_kwargs: other arguments of CompiledMarkdownDoc.render_to_file.
+    '''
+    start = time.perf_counter()
+    error = None
+    with record_dependencies() as dependencies:
+        try:
+            doc.render_to_file(output_path=output_path, vars=vars, **render_kwargs)
+        except Exception as e:
+            error = e
+    dependencies |= referenced_files(doc.md_text, render_kwargs.get('pandoc_args'))
+    return RenderResult(index, Path(output_path), time.perf_counter()-start, error, doc.image_choices(), dependencies)
+
+
+def _collect_done(
+    pending: dict[concurrent.futures.Future, tuple[int, Path]]
+) -> typing.Iterator[RenderResult]:
+    '''Wait for at least one future and yield results of finished ones.'''
+    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+        index, output_path = pending.pop(future)
+        try:
+            yield future.result()
+        except Exception as e:
+            # the worker itself failed (e.g. the process died)
+            yield RenderResult(index, Path(output_path), 0.0, e)
+
+
+_worker_doc: CompiledMarkdownDoc | None = None
+
+def _init_worker(state: dict[str,typing.Any]) -> None:
+    '''Compile the document once per worker process.'''
+    global _worker_doc
+    _worker_doc = CompiledMarkdownDoc(**state)
+
+    # atexit does not run in pool workers; remove the temp folder on shutdown
+    multiprocessing.util.Finalize(_worker_doc, _worker_doc.close, exitpriority=10)
+
+def _render_in_worker(
+    index: int,
+    vars: dict[str,typing.Any],
+    output_path: Path,
+    render_kwargs: dict[str,typing.Any],
+) -> RenderResult:
+    '''Render a batch item with the worker's compiled document.'''
+    return render_item(_worker_doc, index, vars, output_path, render_kwargs)
+
+
+
+###################### rendering many documents ######################
+def render_files(
+    md_paths: typing.Iterable[Path],
+    output_paths: typing.Iterable[list[Path]],
+    vars: typing.Optional[dict[str,typing.Any]] = None,
+    strict_render: bool = True,
+    pandoc_args: PandocArgs | None = None,
+    cache_dir: Path | None = None,
+    output_cache: OutputCache | None = None,
+    image_cache: ImageCache | None = None,
+    workers: int | None = None,
+) -> typing.Iterator[RenderResult]:
+    '''Render many markdown files in this interpreter, yielding one result per
+        output file as documents complete. Each document is compiled once and
+        rendered to all of its outputs; errors are reported per output in the
+        results and do not stop the batch.
+    Args:
+        md_paths: the markdown files to render.
+        output_paths: the output files of each markdown file. The format of
+            each output is inferred from its suffix. Result indices refer 
+            to the position of the markdown file.
+        vars: the variables substituted into every template.
+        strict_render: if True, raise an error if not all variables are provided.
+        pandoc_args: the arguments for the pandoc conversions.
+        cache_dir: optional directory for persistent caches.
+        output_cache: if provided, reuse pandoc outputs of identical conversions.
+        image_cache: if provided, reuse images rasterized by builtin methods.
+        workers: number of worker processes. Render in this process if 
+            None or 1.
+    '''
+    render_kwargs = dict(vars=vars, strict_render=strict_render, pandoc_args=pandoc_args)
+    yield from render_documents(
+        ((md_path, outputs, render_kwargs) for md_path, outputs in zip(md_paths, output_paths, strict=True)),
+        doc_kwargs=dict(cache_dir=cache_dir, output_cache=output_cache, image_cache=image_cache),
+        workers=workers,
+    )
+
+
+def render_documents(
+    items: typing.Iterable[tuple[Path, list[Path], dict[str,typing.Any]]],
+    doc_kwargs: dict[str,typing.Any],
+    workers: int | None,
+) -> typing.Iterator[RenderResult]:
+    '''Render markdown files to their outputs, each with its own vars, 
+        strict_render and pandoc_args, yielding one result per output file
+        as documents complete (see render_files).
+    Args:
+        items: tuples of a markdown file, its output files and a dict with
+            its vars, strict_render and pandoc_args.
+        doc_kwargs: arguments for CompiledMarkdownDoc (cache_dir, 
+            output_cache, image_cache).
+        workers: number of worker processes. Render in this process if 
+            None or 1.
+    '''
+    items = enumerate(items)
+    if workers is None or workers <= 1:
+        for i, (md_path, outputs, render_kwargs) in items:
+            yield from _render_file(i, md_path, outputs, doc_kwargs, render_kwargs)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_file_worker,
+        initargs=(get_table_engine(),),
+    ) as executor:
+        # keep a bounded number of documents in flight so large batches stream
+        pending: dict[concurrent.futures.Future, tuple[int, list[Path]]] = {}
+        for i, (md_path, outputs, render_kwargs) in items:
+            if len(pending) >= 4 * workers:
+                yield from _collect_done_files(pending)
+            future = executor.submit(_render_file_list, i, md_path, outputs, doc_kwargs, render_kwargs)
+            pending[future] = (i, outputs)
+
+        while pending:
+            yield from _collect_done_files(pending)
+
+
+def _render_file(
+    index: int,
+    md_path: Path,
+    output_paths: list[Path],
+    doc_kwargs: dict[str,typing.Any],
+    render_kwargs: dict[str,typing.Any],
+) -> typing.Iterator[RenderResult]:
+    '''Compile a markdown file and render it to each of its outputs.'''
+    start = time.perf_counter()
+    md_dependency = str(Path(md_path).resolve())
+    try:
+        doc = CompiledMarkdownDoc(Path(md_path).read_text(), **doc_kwargs)
+    except Exception as e:
+        # the template could not be read or compiled; every output fails
+        for output_path in output_paths:
+            yield RenderResult(index, Path(output_path), time.perf_counter()-start, e, dependencies={md_dependency})
+        return
+
+    vars = render_kwargs['vars']
+    with doc:
+        for output_path in output_paths:
+            result = render_item(doc, index, vars, output_path, {
+                'output_format': Path(output_path).suffix[1:],
+                'strict_render': render_kwargs['strict_render'],
+                'pandoc_args': render_kwargs['pandoc_args'],
+            })
+            result.dependencies.add(md_dependency)
+            yield result
+
+
+def _collect_done_files(
+    pending: dict[concurrent.futures.Future, tuple[int, list[Path]]]
+) -> typing.Iterator[RenderResult]:
+    '''Wait for at least one document and yield the results of finished ones.'''
+    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+        index, output_paths = pending.pop(future)
+        try:
+            yield from future.result()
+        except Exception as e:
+            # the worker itself failed (e.g. the process died)
+            for output_path in output_paths:
+                yield RenderResult(index, Path(output_path), 0.0, e)
+
+
+def _init_file_worker(table_engine: str) -> None:
+    '''Use the table engine of the parent process.'''
+    set_table_engine(table_engine)
+
+def _render_file_list(
+    index: int,
+    md_path: Path,
+    output_paths: list[Path],
+    doc_kwargs: dict[str,typing.Any],
+    render_kwargs: dict[str,typing.Any],
+) -> list[RenderResult]:
+    '''Render a markdown file in a worker process.'''
+    return list(_render_file(index, md_path, output_paths, doc_kwargs, render_kwargs))
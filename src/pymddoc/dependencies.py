@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import typing
+import contextlib
+import contextvars
+import os
+from pathlib import Path
+
+from .util import val_or_None
+from .compile import PandocArgs
+from .files import referenced_paths
+
+
+_recorded: contextvars.ContextVar[set[str] | None] = contextvars.ContextVar('recorded_dependencies', default=None)
+
+@contextlib.contextmanager
+def record_dependencies() -> typing.Iterator[set[str]]:
+    '''Collect the local files read by builtin methods (tables, images)
+        while rendering inside this context.
+    '''
+    dependencies: set[str] = set()
+    token = _recorded.set(dependencies)
+    try:
+        yield dependencies
+    finally:
+        _recorded.reset(token)
+
+def add_dependency(fname: str | Path) -> None:
+    '''Record that a local file was read, if dependencies are being recorded.'''
+    if (dependencies := _recorded.get()) is not None and os.path.isfile(fname):
+        dependencies.add(str(Path(fname).resolve()))
+
+def referenced_files(md_text: str, pandoc_args: PandocArgs | None = None) -> set[str]:
+    '''Get the local files read by pandoc itself: files linked from the 
+        markdown or its yaml header, bibliographies and pandoc templates.
+    '''
+    extra_args = val_or_None(pandoc_args, PandocArgs()).to_list()[0]
+    return {str(Path(p).expanduser().resolve()) for p in referenced_paths(md_text, extra_args)}
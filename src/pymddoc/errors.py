@@ -4,6 +4,6 @@ class PandocError(Exception):
     """Base class for Pandoc errors."""
     pass
 
-
-
-
+class ImageConversionError(Exception):
+    """Raised when a template could not convert an image."""
+    pass
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import typing
+import json
+import os
+import re
+from pathlib import Path
+
+
+###################### Referenced Files ######################
+def referenced_paths(input_text: str, extra_args: list[str]) -> set[str]:
+    '''Get existing local files referenced by the input or pandoc arguments:
+        link and image targets, html src/href attributes, file-like values
+        in the yaml header and file arguments (e.g. --bibliography). Paths
+        are returned as written, so relative ones refer to the current folder.
+    Args:
+        input_text: the markdown passed to pandoc.
+        extra_args: the pandoc command line arguments.
+    '''
+    candidates = set(_link_target_pattern.findall(input_text))
+    candidates.update(_html_attr_pattern.findall(input_text))
+    if (header := _yaml_header_pattern.match(input_text)) is not None:
+        candidates.update(_yaml_path_pattern.findall(header.group(1)))
+    for arg in extra_args:
+        candidates.add(arg.split('=', 1)[-1])
+
+    return {
+        c for c in candidates
+        if '://' not in c and os.path.isfile(os.path.expanduser(c))
+    }
+
+# link/image targets, html src/href attributes and file-like values in the yaml header
+_link_target_pattern = re.compile(r'\]\(\s*<?([^)\s>]+)')
+_html_attr_pattern = re.compile(r'''(?:src|href)\s*=\s*["']([^"']+)["']''')
+_yaml_header_pattern = re.compile(r'\A---[ \t]*\n(.*?)\n(?:---|\.\.\.)[ \t]*$', re.S | re.M)
+_yaml_path_pattern = re.compile(r'''[\w~./\\-]+\.\w+''')
+
+
+###################### Build Manifests ######################
+def read_manifest(manifest_path: Path) -> dict[str, dict[str,typing.Any]]:
+    '''Read a json manifest of built files. Missing or corrupt manifests are
+        empty, so everything is built again.
+    '''
+    try:
+        with Path(manifest_path).open('r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_manifest(manifest_path: Path, manifest: dict[str, dict[str,typing.Any]]) -> None:
+    '''Write a json manifest atomically, so an interrupted write keeps the
+        previous manifest.
+    '''
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_name(f'{manifest_path.name}.{os.getpid()}.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
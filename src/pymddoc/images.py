@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import typing
+import dataclasses
+import hashlib
+import json
+import os
+import sys
+import threading
+import contextlib
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+
+from .errors import ImageConversionError
+from .info import default_cache_dir
+from .output_cache import FileCache
+from .dependencies import add_dependency
+
+
+ImageFormat = typing.Literal['svg', 'png', 'webp']
+
+@dataclasses.dataclass(frozen=True)
+class ImagePolicy:
+    '''Format and resolution of images written by the builtin image 
+        methods for an output format.
+    Args:
+        format: 'svg' keeps vector figures as svg (svg files are linked
+            as they are), 'png' and 'webp' rasterize them.
+        dpi: resolution of rasterized images.
+    '''
+    format: ImageFormat
+    dpi: int
+
+# vector images for html; print resolution where pandoc needs rasters
+image_policies: dict[str|None, ImagePolicy] = {
+    'html': ImagePolicy('svg', 144),
+    'pdf': ImagePolicy('png', 300),
+    'docx': ImagePolicy('png', 300),
+}
+default_image_policy = ImagePolicy('png', 300)
+
+def get_image_policy(output_format: str | None) -> ImagePolicy:
+    '''Get the image policy for an output format.'''
+    return image_policies.get(output_format, default_image_policy)
+
+
+@dataclasses.dataclass(frozen=True)
+class ImageChoice:
+    '''Image inserted by a builtin image method during a render.
+    Args:
+        source: path or url of the source file.
+        path: path of the inserted image.
+        format: format of the inserted image.
+        dpi: resolution of the image, or None for svg.
+    '''
+    source: str
+    path: str
+    format: ImageFormat
+    dpi: int | None
+
+
+class ImageCache(FileCache):
+    '''Persistent cache of rasterized images (e.g. from svg_to_png and
+        pdf_to_png). Conversions are keyed by the content of the source
+        file and the conversion parameters, so unchanged figures are not
+        rasterized again and figures that share a file name do not collide.
+        The least recently used images are removed once the cache grows
+        beyond max_bytes. Images are stored with the extension of their
+        format.
+    Args:
+        directory: folder where images are stored.
+        max_bytes: maximum total size of stored images.
+    '''
+    suffix = '.png'
+    suffixes = ('.png', '.webp', '.svg')
+
+    def __init__(self,
+        directory: Path = default_cache_dir / 'images',
+        max_bytes: int = 256*1024**2,
+    ):
+        super().__init__(directory, max_bytes)
+
+    def _path(self, key: str, output_path: Path | None = None) -> Path:
+        suffix = Path(output_path).suffix if output_path is not None else self.suffix
+        return self.directory / f'{key}{suffix}'
+
+    def _stored_files(self) -> typing.Iterator[Path]:
+        for suffix in self.suffixes:
+            yield from self.directory.glob(f'*{suffix}')
+
+
+def image_key(
+    source: str, 
+    converter: str, 
+    params: dict[str,typing.Any], 
+    digest: str | None = None,
+) -> str:
+    '''Get the key identifying the conversion of a source file. Sources that
+        are not local files (e.g. urls) are keyed by name only.
+    Args:
+        source: path or url of the source file.
+        converter: name and version of the library doing the conversion.
+        params: conversion parameters such as page number and dpi.
+        digest: the source_digest() of the source, computed if None.
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps([
+        converter,
+        sorted((k, repr(v)) for k,v in params.items()),
+    ]).encode('utf-8'))
+    h.update((digest if digest is not None else source_digest(source)).encode('utf-8'))
+    return h.hexdigest()
+
+def source_digest(source: str) -> str:
+    '''Hash the contents of a local source file, or its name if it is not 
+        a local file, and record it as a dependency.
+    '''
+    add_dependency(source)
+    if os.path.isfile(source):
+        with open(source, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+    return f'\0{source}'
+
+
+class PdfDocuments:
+    '''Open pdf documents shared by the conversions of an ImageConverter, 
+        keyed by path and modification time. Changed files are reopened, 
+        each document is used by one thread at a time and all documents 
+        are closed by close().
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: dict[str, tuple[int, typing.Any, threading.Lock]] = {}
+
+    @contextlib.contextmanager
+    def open(self, filename: str) -> typing.Iterator[typing.Any]:
+        '''Get the open document of a pdf file (a fitz.Document), locked
+            for the current thread.
+        '''
+        import fitz
+
+        path = os.path.abspath(filename)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            stale = self._documents.get(path)
+            if stale is None or stale[0] != mtime_ns:
+                self._documents[path] = (mtime_ns, fitz.open(path), threading.Lock())
+            else:
+                stale = None
+            _, document, lock = self._documents[path]
+
+        if stale is not None:
+            _close_document(stale)
+        # pymupdf documents must not be used from several threads at once
+        with lock:
+            yield document
+
+    def close(self) -> None:
+        '''Close all open documents.'''
+        with self._lock:
+            documents, self._documents = self._documents, {}
+        for entry in documents.values():
+            _close_document(entry)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+
+def _close_document(entry: tuple[int, typing.Any, threading.Lock]) -> None:
+    '''Close a document once the thread using it is done.'''
+    _, document, lock = entry
+    with lock:
+        document.close()
+
+
+class ImageConverter:
+    '''Converts source files to pngs in a folder, reusing cached images.
+        With more than one worker, conversions are scheduled on a process
+        pool and the output path is returned immediately; call wait() 
+        before the images are read.
+    Args:
+        tmpfolder: folder where pngs are written.
+        image_cache: if provided, reuse images of identical conversions.
+        workers: number of processes converting images. Images are 
+            converted in the calling thread if None or 1.
+    '''
+    def __init__(self,
+        tmpfolder: str,
+        image_cache: ImageCache | None = None,
+        workers: int | None = None,
+    ):
+        self.tmpfolder = tmpfolder
+        self.image_cache = image_cache
+        self.workers = workers
+        self._executor: concurrent.futures.ProcessPoolExecutor | None = None
+        self._futures: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pdf_documents = PdfDocuments()
+
+    def convert(self,
+        source: str,
+        converter: str,
+        params: dict[str,typing.Any],
+        convert: typing.Callable[..., None],
+        *args: typing.Any,
+        format: ImageFormat = 'png',
+    ) -> str:
+        '''Convert a source file to an image and return the image path. See 
+            convert_many().
+        '''
+        return self.convert_many(source, converter, [params], convert, *args, format=format)[0]
+
+    def convert_many(self,
+        source: str,
+        converter: str,
+        params: list[dict[str,typing.Any]],
+        convert: typing.Callable[..., None],
+        *args: typing.Any,
+        format: ImageFormat = 'png',
+    ) -> list[str]:
+        '''Convert a source file to one image per set of parameters (e.g. 
+            one per page) and return the image paths. Images that are not
+            already available are written by a single call, and the source
+            is hashed once for all of their keys.
+        Args:
+            source: path or url of the source file.
+            converter: name and version of the library doing the conversion.
+            params: conversion parameters of each image, part of their keys.
+            convert: module-level function called as 
+                convert(source, [(outfile, params), ...], *args) to write images.
+            format: format of the written images, used as file extension.
+        '''
+        # hash the source once for all of its images
+        digest = source_digest(source)
+        items = []
+        for p in params:
+            key = image_key(source, converter, p, digest)
+            items.append((f'{self.tmpfolder}/{key[:16]}-{Path(source).name}.{format}', key, p))
+        outfiles = [outfile for outfile, _, _ in items]
+        lineno = _template_lineno()
+        for outfile, _, p in items:
+            self.record(ImageChoice(source, outfile, format, p.get('dpi') if format != 'svg' else None))
+
+        if not self.parallel:
+            todo = [item for item in items if not os.path.isfile(item[0])]
+            if len(todo):
+                try:
+                    _convert(convert, source, todo, args, self.image_cache)
+                except Exception as e:
+                    raise _conversion_error(source, lineno, e) from e
+            return outfiles
+
+        with self._lock:
+            todo = []
+            for item in items:
+                future = self._futures.get(item[0])
+                if future is None or (future.done() and future.exception() is not None):
+                    todo.append(item)
+                else:
+                    self._pending().append((future, source, lineno))
+
+            if len(todo):
+                if self._executor is None:
+                    # forked workers would inherit the stdin pipe of a running
+                    # pandoc process and keep it from ever seeing EOF
+                    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(start_method),
+                    )
+                future = self._executor.submit(_convert, convert, source, todo, args, self.image_cache)
+                self._futures.update({outfile: future for outfile, _, _ in todo})
+                self._pending().append((future, source, lineno))
+        return outfiles
+
+    def wait(self) -> None:
+        '''Wait for the conversions scheduled by the current thread, raising
+            an ImageConversionError for the first failed conversion.
+        '''
+        pending, self._local.pending = self._pending(), []
+        for future, source, lineno in pending:
+            if (e := future.exception()) is not None:
+                raise _conversion_error(source, lineno, e) from e
+
+    def record(self, choice: ImageChoice) -> None:
+        '''Record an image inserted by the current thread (see choices()).'''
+        self._choices().append(choice)
+
+    def choices(self) -> list[ImageChoice]:
+        '''Get the images inserted by the current thread since reset_choices().'''
+        return list(self._choices())
+
+    def reset_choices(self) -> None:
+        '''Forget the images recorded by the current thread.'''
+        self._local.choices = []
+
+    @property
+    def parallel(self) -> bool:
+        '''Whether conversions run in worker processes.'''
+        return self.workers is not None and self.workers > 1
+
+    def close(self) -> None:
+        '''Stop the process pool and close open pdf documents.'''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._futures.clear()
+        self.pdf_documents.close()
+
+    def _pending(self) -> list[tuple[concurrent.futures.Future, str, int | None]]:
+        # each render thread waits only for its own conversions
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = []
+        return self._local.pending
+
+    def _choices(self) -> list[ImageChoice]:
+        if not hasattr(self._local, 'choices'):
+            self._local.choices = []
+        return self._local.choices
+
+
+def _convert(
+    convert: typing.Callable[..., None],
+    source: str,
+    items: list[tuple[str, str, dict[str,typing.Any]]],
+    args: tuple,
+    image_cache: ImageCache | None,
+) -> None:
+    '''Write the pngs of a batch, reusing the cache where possible.'''
+    cacheable = image_cache is not None and os.path.isfile(source)
+    if cacheable:
+        items = [item for item in items if not image_cache.get_file(item[1], item[0])]
+    if not len(items):
+        return
+
+    convert(source, [(outfile, params) for outfile, _, params in items], *args)
+    if cacheable:
+        for outfile, key, _ in items:
+            image_cache.put_file(key, outfile)
+
+
+def _template_lineno() -> int | None:
+    '''Get the template line of the jinja call currently executing, if any.'''
+    frame = sys._getframe(1)
+    while frame is not None:
+        if (template := frame.f_globals.get('__jinja_template__')) is not None:
+            return template.get_corresponding_lineno(frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+def _conversion_error(source: str, lineno: int | None, e: Exception) -> ImageConversionError:
+    where = f' (template line {lineno})' if lineno is not None else ''
+    return ImageConversionError(f'Could not convert "{source}"{where}: {e}')
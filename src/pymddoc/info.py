@@ -1 +1,5 @@
-package_name = 'pymddoc'
\ No newline at end of file
+import os
+from pathlib import Path
+
+package_name = 'pymddoc'
+default_cache_dir = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser() / package_name
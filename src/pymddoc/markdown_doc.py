@@ -8,35 +8,79 @@ import jinja2
 import tempfile
 
 from .metadata import Metadata
-from .builtin_methods import get_builtin_methods
+from .metadata_index import MetadataIndex
 from .util import val_or_None
 
-from .render import jinja_render, jinja_get_variables
-from .compile import pandoc_convert_text, pandoc_convert_file, PandocArgs
+from .render import jinja_render, jinja_get_variables, get_template_cache
+from .compile import PandocArgs
+from .compiled_doc import CompiledMarkdownDoc
+from .output_cache import OutputCache
+from .images import ImageCache
 
 
 
 
 @dataclasses.dataclass(repr=False)
 class MarkdownDoc:
-    '''Used to manipulate markdown data using pypandoc.'''
+    '''Used to manipulate markdown data using pypandoc.
+    Args:
+        md_text: the markdown text (a jinja template).
+        cache_dir: optional directory for persistent caches. When provided,
+            compiled jinja templates are stored on disk and reused by 
+            later processes.
+        output_cache: if provided, pandoc is skipped when an identical
+            conversion has been cached (see OutputCache).
+        image_cache: if provided, svg_to_png and pdf_to_png reuse images
+            of unchanged figures (see ImageCache).
+        image_workers: number of processes rasterizing images while the
+            template is rendered.
+    '''
     md_text: str
+    cache_dir: Path | None = None
+    output_cache: OutputCache | None = None
+    image_cache: ImageCache | None = None
+    image_workers: int | None = None
 
     @classmethod
-    def from_file(cls, fpath: Path) -> typing.Self:
-        '''Read markdown from the file.'''
+    def from_file(cls, fpath: Path, **kwargs) -> typing.Self:
+        '''Read markdown from the file. Keyword arguments are passed to the constructor.'''
         with Path(fpath).open('r') as f:
-            return cls.from_str(f.read())
+            return cls.from_str(f.read(), **kwargs)
         
     @classmethod
-    def from_str(cls, md_text: str) -> typing.Self:
-        '''Instantiate from a string.'''
-        return cls(str(md_text))
+    def from_str(cls, md_text: str, **kwargs) -> typing.Self:
+        '''Instantiate from a string. Keyword arguments are passed to the constructor.'''
+        return cls(str(md_text), **kwargs)
     
     ###################### Extract Component Data ######################
-    def extract_metadata(self) -> Metadata:
-        '''Get metadata from the document'''
-        return Metadata.from_markdown_text(self.md_text)
+    def extract_metadata(self, exact: bool = False) -> Metadata:
+        '''Get metadata from the document. Set exact to always use pandoc.'''
+        return Metadata.from_markdown_text(self.md_text, exact=exact)
+
+    async def aextract_metadata(self, timeout: float | None = None, exact: bool = False) -> Metadata:
+        '''Get metadata from the document without blocking the event loop.'''
+        return await Metadata.afrom_markdown_text(self.md_text, timeout=timeout, exact=exact)
+
+    @classmethod
+    def index_metadata(cls,
+        root: Path,
+        db_path: Path,
+        pattern: str = '*.md',
+        workers: int | None = None,
+    ) -> MetadataIndex:
+        '''Scan a directory tree and store the metadata of every document in
+            a sqlite index, re-reading only files changed since the last scan.
+            The returned index keeps its database connection open; the caller
+            owns it and should use it as a context manager or call close().
+        Args:
+            root: directory to scan recursively.
+            db_path: path to the sqlite database file.
+            pattern: glob pattern for document file names.
+            workers: number of processes used to read metadata.
+        '''
+        index = MetadataIndex(db_path)
+        index.scan(root, pattern=pattern, workers=workers)
+        return index
 
     ###################### type-specific methods ######################
     def render_to_docx(self,
@@ -98,35 +142,15 @@ class MarkdownDoc:
             strict_render: if True, raise an error if not all variables are provided.
             pandoc_args: the arguments for the pandoc conversion.
         '''
-        with tempfile.TemporaryDirectory() as tmp:
-
-            # jinja render step
-            rendered = jinja_render(
-                input_text=self.md_text,
-                vars={
-                    **get_builtin_methods(
-                        tmp_dir=tmp, 
-                        output_format=output_format
-                    ), 
-                    **val_or_None(vars, {}),
-                }, 
-                strict=strict_render,
-            )
-
-            # create dummy file to temporarily dump input
-            tmp_source_path = Path(f'{tmp}/source_input.md')
-            with tmp_source_path.open('w') as f:
-                f.write(rendered)
-
-            return pandoc_convert_file(
-                input_path=tmp_source_path,
-                input_format='md',
+        with self.compile() as compiled:
+            return compiled.render_to_file(
                 output_path=output_path,
-                output_format=output_format, 
+                output_format=output_format,
+                vars=vars,
+                strict_render=strict_render,
                 pandoc_args=pandoc_args,
             )
 
-
     def render_to_string(self,
         output_format: typing.Literal['html'],
         vars: typing.Optional[dict[str,typing.Any]] = None,
@@ -140,44 +164,117 @@ class MarkdownDoc:
             strict_render: if True, raise an error if not all variables are provided.
             pandoc_args: the arguments for the pandoc conversion.
         '''
+        with self.compile() as compiled:
+            return compiled.render_to_string(
+                output_format=output_format,
+                vars=vars,
+                strict_render=strict_render,
+                pandoc_args=pandoc_args,
+            )
 
-        with tempfile.TemporaryDirectory() as tmp:
+    def render_to_files(self,
+        output_paths: dict[typing.Literal['html', 'pdf', 'docx'], Path],
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+    ) -> dict[str, str]:
+        '''Render/compile the markdown document to several formats at once,
+            parsing the markdown only once (see CompiledMarkdownDoc.render_to_files).
+        Args:
+            output_paths: output file for each format, e.g. {'html': 'doc.html'}.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+        '''
+        with self.compile() as compiled:
+            return compiled.render_to_files(
+                output_paths=output_paths,
+                vars=vars,
+                strict_render=strict_render,
+                pandoc_args=pandoc_args,
+            )
 
-            # jinja render step
-            rendered = jinja_render(
-                input_text=self.md_text,
-                vars={
-                    **get_builtin_methods(tmp_dir=tmp, output_format=output_format), 
-                    **val_or_None(vars, {}),
-                }, 
-                strict=strict_render,
+    async def arender_to_file(self,
+        output_path: Path,
+        output_format: typing.Literal['html', 'pdf', 'docx'] | None = None,
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        '''Async version of render_to_file driving pandoc through asyncio.
+        Args:
+            output_path: path to the output file.
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+            timeout: seconds to wait for pandoc before raising PandocError.
+        '''
+        with self.compile() as compiled:
+            return await compiled.arender_to_file(
+                output_path=output_path,
+                output_format=output_format,
+                vars=vars,
+                strict_render=strict_render,
+                pandoc_args=pandoc_args,
+                timeout=timeout,
             )
 
-            # pandoc compile step
-            return pandoc_convert_text(
-                input_text=rendered,
-                input_format='md',
-                output_format=output_format, 
+    async def arender_to_string(self,
+        output_format: typing.Literal['html'],
+        vars: typing.Optional[dict[str,typing.Any]] = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        timeout: float | None = None,
+    ) -> str:
+        '''Async version of render_to_string driving pandoc through asyncio.
+        Args:
+            output_format: the format of the output file.
+            vars: the variables to substitute into the jinja template.
+            strict_render: if True, raise an error if not all variables are provided.
+            pandoc_args: the arguments for the pandoc conversion.
+            timeout: seconds to wait for pandoc before raising PandocError.
+        '''
+        with self.compile() as compiled:
+            return await compiled.arender_to_string(
+                output_format=output_format,
+                vars=vars,
+                strict_render=strict_render,
                 pandoc_args=pandoc_args,
+                timeout=timeout,
             )
 
+    def compile(self) -> CompiledMarkdownDoc:
+        '''Compile the jinja template once so that it can be rendered many 
+            times with different variables (see CompiledMarkdownDoc).
+        '''
+        return CompiledMarkdownDoc(
+            self.md_text, 
+            cache_dir=self.cache_dir, 
+            output_cache=self.output_cache,
+            image_cache=self.image_cache,
+            image_workers=self.image_workers,
+        )
+
     ###################### templating ######################
     def render_template(self,
         vars: dict[str,typing.Any],
         strict_render: bool = False,
     ) -> typing.Self:
         '''Render the markdown document as a jinja template.'''
-        return self.from_str(
+        return dataclasses.replace(self,
             md_text=jinja_render(
                 input_text=self.md_text,
                 vars=vars,
                 strict=strict_render,
+                cache=get_template_cache(self.cache_dir),
             )
         )
     
     def get_template_variables(self) -> list[str]:
         '''Get the variables in the jinja template.'''
-        return jinja_get_variables(self.md_text)
+        return jinja_get_variables(self.md_text, cache=get_template_cache(self.cache_dir))
 
     ###################### dunder ######################
     def __repr__(self) -> str:
@@ -5,15 +5,26 @@ import tempfile
 import pypandoc
 from pathlib import Path
 import json
+import re
 
 from .util import pandoc_execute
+from .compile import apandoc_convert_text, PandocArgs
 
 class Metadata(dict[str,str|int|bool|float]):
     '''Store and manage document metadata. dict subtype.'''
 
     @classmethod
-    def from_markdown_text(cls, markdown_text: str) -> typing.Self:
-        '''Read metadata from pandoc yaml header.'''
+    def from_markdown_text(cls, markdown_text: str, exact: bool = False) -> typing.Self:
+        '''Read metadata from the yaml header. Simple headers are parsed 
+            in-process; anything else (or everything if exact) is read by pandoc.
+        '''
+        if not exact and (metadata := parse_yaml_header(markdown_text)) is not None:
+            return cls(metadata)
+        return cls.from_markdown_text_pandoc(markdown_text)
+
+    @classmethod
+    def from_markdown_text_pandoc(cls, markdown_text: str) -> typing.Self:
+        '''Read metadata from pandoc yaml header using pandoc.'''
         with tempfile.TemporaryDirectory() as tmp:
             tmp_template_path = Path(f'{tmp}/metadata.pandoc-tpl')
             #tmp_output_path = Path(f'{tmp}/output.txt')
@@ -37,3 +48,187 @@ class Metadata(dict[str,str|int|bool|float]):
             #    return json.load(f)
             return cls(json.loads(converted))
 
+    @classmethod
+    async def afrom_markdown_text(cls, 
+        markdown_text: str, 
+        timeout: float | None = None,
+        exact: bool = False,
+    ) -> typing.Self:
+        '''Read metadata from pandoc yaml header without blocking the event loop.'''
+        if not exact and (metadata := parse_yaml_header(markdown_text)) is not None:
+            return cls(metadata)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_template_path = Path(f'{tmp}/metadata.pandoc-tpl')
+            with tmp_template_path.open('w') as f:
+                f.write('$meta-json$')
+
+            converted = await apandoc_convert_text(
+                str(markdown_text),
+                input_format='md',
+                output_format='html',
+                pandoc_args=PandocArgs(template=tmp_template_path),
+                timeout=timeout,
+            )
+            return cls(json.loads(converted))
+
+
+###################### In-Process YAML Header Parsing ######################
+class _UnsupportedYAML(Exception):
+    '''Raised for yaml the fast parser does not handle like pandoc does.'''
+
+MetaValue = str | bool | list['MetaValue'] | dict[str, 'MetaValue']
+
+def parse_yaml_header(markdown_text: str) -> dict[str, MetaValue] | None:
+    '''Parse the leading yaml metadata block the same way pandoc does. 
+        Returns None if the text uses anything pandoc may interpret 
+        differently (markdown formatting, yaml features beyond simple 
+        scalars, lists and mappings, a % title block, or metadata blocks 
+        after the header), in which case pandoc should be used instead.
+    '''
+    lines = markdown_text.split('\n')
+    # pandoc reads title, author and date from a leading % title block
+    if lines[0].startswith('%'):
+        return None
+    try:
+        if _is_block_start(lines, 0):
+            end = next(i for i in range(1, len(lines)) if lines[i].rstrip() in ('---', '...'))
+            metadata, _ = _parse_mapping(lines[1:end], 0, 0)
+        else:
+            end, metadata = -1, {}
+    except (_UnsupportedYAML, StopIteration):
+        return None
+
+    # pandoc merges metadata blocks from anywhere in the document
+    if any(_is_block_start(lines, i) for i in range(end+1, len(lines))):
+        return None
+    return metadata
+
+def _is_block_start(lines: list[str], i: int) -> bool:
+    '''Whether line i opens a pandoc yaml metadata block.'''
+    return (
+        lines[i].rstrip() == '---'
+        and (i == 0 or not lines[i-1].strip())
+        and i+1 < len(lines) and bool(lines[i+1].strip())
+    )
+
+_key_pattern = re.compile(r'^( *)([A-Za-z][\w-]*):(?: +(.*))?$')
+_item_pattern = re.compile(r'^( *)-(?: +(.*))?$')
+
+def _parse_mapping(lines: list[str], start: int, indent: int) -> tuple[dict[str, MetaValue], int]:
+    '''Parse "key: value" lines at the given indentation.'''
+    mapping: dict[str, MetaValue] = {}
+    i = start
+    while i < len(lines):
+        if not lines[i].strip():
+            i += 1
+            continue
+        if (m := _key_pattern.match(lines[i])) is None:
+            raise _UnsupportedYAML(lines[i])
+        if len(m.group(1)) < indent:
+            break
+        if len(m.group(1)) > indent or m.group(2).endswith('_') or m.group(2) in mapping:
+            raise _UnsupportedYAML(lines[i])
+        
+        key, value = m.group(2), (m.group(3) or '').strip()
+        if value:
+            mapping[key] = _parse_flow_value(value)
+            i += 1
+        else:
+            mapping[key], i = _parse_block_value(lines, i+1, indent)
+    
+    # pandoc's meta-json lists keys in sorted order
+    return dict(sorted(mapping.items())), i
+
+def _parse_block_value(lines: list[str], start: int, parent_indent: int) -> tuple[MetaValue, int]:
+    '''Parse the indented list or mapping following "key:".'''
+    i = start
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    if i == len(lines):
+        return '', i
+    
+    indent = len(lines[i]) - len(lines[i].lstrip(' '))
+    if (m := _item_pattern.match(lines[i])) is not None and indent >= parent_indent:
+        return _parse_list(lines, i, indent)
+    elif indent > parent_indent:
+        return _parse_mapping(lines, i, indent)
+    return '', i
+
+def _parse_list(lines: list[str], start: int, indent: int) -> tuple[list[MetaValue], int]:
+    '''Parse "- item" lines with scalar items at the given indentation.'''
+    items: list[MetaValue] = []
+    i = start
+    while i < len(lines):
+        if not lines[i].strip():
+            i += 1
+            continue
+        m = _item_pattern.match(lines[i])
+        if m is None or len(m.group(1)) != indent:
+            if len(lines[i]) - len(lines[i].lstrip(' ')) > indent:
+                raise _UnsupportedYAML(lines[i])
+            break
+        items.append(_parse_scalar((m.group(2) or '').strip()))
+        i += 1
+    return items, i
+
+def _parse_flow_value(value: str) -> MetaValue:
+    '''Parse a value written on the same line as its key.'''
+    if value.startswith('[') and value.endswith(']'):
+        inner = value[1:-1].strip()
+        items = [v.strip() for v in inner.split(',')] if inner else []
+        if not all(items):
+            raise _UnsupportedYAML(value)
+        return [_parse_scalar(v) for v in items]
+    return _parse_scalar(value)
+
+_bool_values = {
+    **{v: True for v in ('y', 'Y', 'yes', 'Yes', 'YES', 'true', 'True', 'TRUE', 'on', 'On', 'ON')},
+    **{v: False for v in ('n', 'N', 'no', 'No', 'NO', 'false', 'False', 'FALSE', 'off', 'Off', 'OFF')},
+}
+_null_values = {'', '~', 'null', 'Null', 'NULL'}
+_canonical_number_pattern = re.compile(r'^(0|-?[1-9][0-9]*)(\.[0-9]*[1-9])?$')
+
+# text pandoc's markdown reader leaves unchanged when converting to html
+_plain_text_pattern = re.compile(r'^[\w ,.:;/()!?+=%-]*$')
+_plain_text_exclusions = re.compile(r'--|\.\.\.|  |^[-+]( |$)|^[0-9]+[.)]( |$)|^\.|: |:$|(?<![^\W_])_|_(?![^\W_])')
+
+# plain (unquoted) yaml scalars must not start with an indicator character
+_plain_scalar_start_pattern = re.compile(r'^[^\W_]')
+
+def _parse_scalar(value: str) -> str | bool:
+    '''Parse a scalar the way pandoc converts it to meta-json.'''
+    if value[:1] in ('"', "'"):
+        if len(value) < 2 or value[-1] != value[0] or value[0] in value[1:-1] or '\\' in value:
+            raise _UnsupportedYAML(value)
+        return _plain_text(value[1:-1])
+
+    if value in _null_values:
+        return ''
+    if value.lower() in _bool_values:
+        if value not in _bool_values:
+            raise _UnsupportedYAML(value)
+        return _bool_values[value]
+    
+    # pandoc normalizes numbers (e.g. 1.50 -> 1.5, 0x1F -> 31)
+    if _is_number(value) and not _canonical_number_pattern.match(value):
+        raise _UnsupportedYAML(value)
+    if not _plain_scalar_start_pattern.match(value) and not _canonical_number_pattern.match(value):
+        raise _UnsupportedYAML(value)
+    return _plain_text(value)
+
+def _is_number(value: str) -> bool:
+    try:
+        int(value, 0)
+    except ValueError:
+        try:
+            float(value)
+        except ValueError:
+            return False
+    return True
+
+def _plain_text(value: str) -> str:
+    '''Return text that pandoc would not transform, or raise.'''
+    if value != value.strip() or not _plain_text_pattern.match(value) or _plain_text_exclusions.search(value):
+        raise _UnsupportedYAML(value)
+    return value
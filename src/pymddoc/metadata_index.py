@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import typing
+import sqlite3
+import json
+import os
+import dataclasses
+import concurrent.futures
+from pathlib import Path
+
+from .metadata import Metadata
+
+
+@dataclasses.dataclass
+class ScanResult:
+    '''Summary of a MetadataIndex.scan() call.
+    Args:
+        added: paths indexed for the first time.
+        updated: paths re-read because their mtime or size changed.
+        removed: paths no longer found in the scanned directory.
+        unchanged: number of paths that were not re-read.
+        errors: paths that could not be read, with the error message.
+    '''
+    added: list[str] = dataclasses.field(default_factory=list)
+    updated: list[str] = dataclasses.field(default_factory=list)
+    removed: list[str] = dataclasses.field(default_factory=list)
+    unchanged: int = 0
+    errors: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+class MetadataIndex:
+    '''SQLite index of the metadata of markdown documents in a directory
+        tree. Each document is stored with its mtime and size so rescans
+        only re-read changed files, and queries never read the documents.
+    Args:
+        db_path: path to the sqlite database file.
+    '''
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        ''')
+        self.connection.commit()
+
+    def scan(self,
+        root: Path,
+        pattern: str = '*.md',
+        workers: int | None = None,
+        exact: bool = False,
+    ) -> ScanResult:
+        '''Index documents under root, re-reading only new or changed files
+            and removing entries for files that no longer exist.
+        Args:
+            root: directory to scan recursively.
+            pattern: glob pattern for document file names.
+            workers: number of processes used to read metadata. Read in
+                this process if None or 1.
+            exact: always read metadata with pandoc (see Metadata).
+        '''
+        root = Path(root).resolve()
+        result = ScanResult()
+        prefix = f'{root}{os.sep}'
+        indexed = {
+            path: (mtime_ns, size) for path, mtime_ns, size in self.connection.execute(
+                'SELECT path, mtime_ns, size FROM documents WHERE substr(path, 1, ?) = ?',
+                (len(prefix), prefix),
+            )
+        }
+
+        changed: dict[str, tuple[int, int]] = {}
+        for path in root.rglob(pattern):
+            if not path.is_file():
+                continue
+            stat = path.stat()
+            key = (stat.st_mtime_ns, stat.st_size)
+            if indexed.pop(str(path), None) == key:
+                result.unchanged += 1
+            else:
+                changed[str(path)] = key
+
+        # whatever is left in the index was deleted from disk
+        result.removed = sorted(indexed)
+        self.connection.executemany('DELETE FROM documents WHERE path = ?', [(p,) for p in result.removed])
+
+        existing = {p for p, in self.connection.execute('SELECT path FROM documents')}
+        for path, metadata, error in _read_all_metadata(list(changed), workers, exact):
+            if error is not None:
+                # never serve metadata of an earlier version of the file
+                result.errors[path] = error
+                self.connection.execute('DELETE FROM documents WHERE path = ?', (path,))
+                continue
+            (result.updated if path in existing else result.added).append(path)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                (path, *changed[path], json.dumps(metadata)),
+            )
+
+        self.connection.commit()
+        return result
+
+    def get(self, path: Path) -> Metadata | None:
+        '''Get the indexed metadata of a document.'''
+        row = self.connection.execute(
+            'SELECT metadata FROM documents WHERE path = ?',
+            (str(Path(path).resolve()),),
+        ).fetchone()
+        return Metadata(json.loads(row[0])) if row is not None else None
+
+    def items(self) -> typing.Iterator[tuple[Path, Metadata]]:
+        '''Iterate over all indexed documents and their metadata.'''
+        for path, metadata in self.connection.execute('SELECT path, metadata FROM documents ORDER BY path'):
+            yield Path(path), Metadata(json.loads(metadata))
+
+    def query(self, **fields: typing.Any) -> list[tuple[Path, Metadata]]:
+        '''Get documents whose metadata fields equal the given values. A
+            list field matches if it contains the value, e.g.
+            query(author='Jane Doe', tags='draft'). Fields are compared in 
+            sqlite, so only matching documents are decoded.
+        '''
+        conditions, params = [], []
+        for key, value in fields.items():
+            path = f'$.{json.dumps(key)}'
+            if isinstance(value, (list, dict)):
+                conditions.append('json_extract(metadata, ?) = json(?)')
+                params += [path, json.dumps(value)]
+            else:
+                # json_each yields a scalar field itself or each item of a list field
+                conditions.append(
+                    'EXISTS (SELECT 1 FROM json_each(metadata, ?) AS f '
+                    'WHERE f.value IS ? AND f.type NOT IN (\'object\', \'array\') '
+                    'AND json_type(metadata, ?) != \'object\')'
+                )
+                params += [path, value, path]
+
+        where = ' AND '.join(conditions) if len(conditions) else '1'
+        return [
+            (Path(path), Metadata(json.loads(metadata))) for path, metadata in self.connection.execute(
+                f'SELECT path, metadata FROM documents WHERE {where} ORDER BY path', params,
+            )
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({str(self.db_path)!r})'
+
+
+def _read_metadata(path: str, exact: bool) -> tuple[str, dict | None, str | None]:
+    '''Read the metadata of one document, capturing errors.'''
+    try:
+        with open(path, 'r') as f:
+            return path, Metadata.from_markdown_text(f.read(), exact=exact), None
+    except Exception as e:
+        return path, None, f'{e}'
+
+
+def _read_all_metadata(
+    paths: list[str],
+    workers: int | None,
+    exact: bool,
+) -> typing.Iterator[tuple[str, dict | None, str | None]]:
+    '''Read the metadata of many documents, in parallel if workers > 1.'''
+    if workers is None or workers <= 1:
+        for path in paths:
+            yield _read_metadata(path, exact)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_read_metadata, paths, [exact]*len(paths), chunksize=64)
+
@@ -1,13 +1,622 @@
+from __future__ import annotations
+
+import typing
+import base64
+import hashlib
+import json
+import os
+import re
+import tempfile
+import concurrent.futures
+from pathlib import Path
 import jinja2
 
 from .util import indent
+from .util import val_or_None
+from .render import text_as_jinja_template, get_template_cache, jinja_get_variables, jinja_render
+from .compile import pandoc_convert_file, pandoc_convert_stream, PandocArgs, RenderFormat
+from .builtin_methods import get_builtin_methods
+from .images import ImageCache, ImageConverter
+from .output_cache import OutputCache
+from .files import read_manifest, write_manifest
 
-def convert_ipynb2md(template: str, ipynb_data: dict, linenums: bool) -> str:
-    env = jinja2.Environment()
-    template = env.from_string(template, globals={'indent': indent})
+def convert_ipynb2md(
+    template: str,
+    ipynb_data: dict,
+    linenums: bool = False,
+    cache_dir: Path | None = None,
+) -> str:
+    template = compile_ipynb2md_template(template, cache_dir=cache_dir)
     markdown = template.render(**ipynb_data, linenums=linenums)
     return markdown
 
 
+def compile_ipynb2md_template(template: str, cache_dir: Path | None = None) -> jinja2.Template:
+    '''Compile a notebook to markdown template with its helper functions.'''
+    return text_as_jinja_template(
+        template,
+        globals={'indent': indent},
+        cache=get_template_cache(cache_dir),
+    )
+
+
+def convert_ipynb2md_file(
+    template: str,
+    ipynb_path: Path,
+    md_path: Path,
+    linenums: bool = False,
+    cache_dir: Path | None = None,
+    mime_types: typing.Collection[str] | None = None,
+    assets_dir: Path | None = None,
+) -> None:
+    '''Convert a notebook file to a markdown file, reading one cell at a
+        time (see read_notebook) and writing the markdown as it is rendered.
+    Args:
+        template: the jinja template that receives the notebook json.
+        ipynb_path: the notebook to convert.
+        md_path: the markdown file to write.
+        linenums: passed to the template.
+        cache_dir: optional directory for persistent caches.
+        mime_types: output data to keep. Inferred from the template if None
+            (see template_mime_types).
+        assets_dir: if provided, image outputs are written here and linked
+            from the markdown (see read_notebook).
+    '''
+    _convert_notebook(
+        compile_ipynb2md_template(template, cache_dir=cache_dir),
+        _template_fields(template, cache_dir),
+        ipynb_path,
+        md_path,
+        linenums,
+        val_or_None(mime_types, template_mime_types(template)),
+        assets_dir,
+    )
+
+
+###################### Streaming Notebook Reading ######################
+def read_notebook(
+    ipynb_path: Path,
+    fields: typing.Collection[str] | None = None,
+    mime_types: typing.Collection[str] | None = None,
+    assets_dir: Path | None = None,
+    link_dir: Path | None = None,
+) -> dict[str, typing.Any]:
+    '''Read a notebook for rendering without loading all of its cells. The
+        cells are a NotebookCells iterable that parses one cell at a time.
+    Args:
+        ipynb_path: the notebook file.
+        fields: top-level fields to read besides cells (e.g. metadata). All
+            fields if None. Reading them parses the file once more.
+        mime_types: output data to keep (e.g. 'text/plain'). All if None.
+        assets_dir: if provided, png, jpeg and svg outputs are written to 
+            this folder under content-hashed names, so identical images are
+            stored once, and linked from output['files'] as paths relative
+            to link_dir. Their data is dropped from output['data'] unless 
+            mime_types is None or names them.
+        link_dir: the folder paths in output['files'] are relative to, 
+            usually that of the markdown file. The current folder if None.
+    '''
+    notebook, num_cells = {}, None
+    if fields is None or len(set(fields) - {'cells'}):
+        with Path(ipynb_path).open('r', encoding='utf-8') as f:
+            stream = _JsonStream(f)
+            for key in stream.object_keys():
+                if key == 'cells':
+                    # parse the cells one at a time only to count them
+                    num_cells = sum(1 for _ in stream.array_values())
+                elif fields is None or key in fields:
+                    notebook[key] = stream.value()
+                else:
+                    stream.value()
+    notebook['cells'] = NotebookCells(ipynb_path, mime_types, assets_dir, link_dir, num_cells)
+    return notebook
+
+
+class NotebookCells:
+    '''Cells of a notebook file, parsed one at a time whenever they are
+        iterated, so memory use is proportional to the largest cell. The
+        other top-level fields are read into fields during iteration.
+        Templates can also use len(cells) (e.g. cells|length, loop.length)
+        and index cells (cells[0], cells|last), but each index parses the
+        file up to that cell, so loops should iterate over the cells rather
+        than index them.
+    Args:
+        ipynb_path: the notebook file.
+        mime_types: output data to keep (e.g. 'text/plain'). All if None.
+        assets_dir: if provided, folder where image outputs are written.
+        link_dir: the folder that paths to written images are relative to.
+            The images written so far are listed in assets.
+        num_cells: the number of cells if known. Counted when needed if None.
+    '''
+    def __init__(self, 
+        ipynb_path: Path, 
+        mime_types: typing.Collection[str] | None = None,
+        assets_dir: Path | None = None,
+        link_dir: Path | None = None,
+        num_cells: int | None = None,
+    ):
+        self.ipynb_path = Path(ipynb_path)
+        self.mime_types = frozenset(mime_types) if mime_types is not None else None
+        self.assets_dir = Path(assets_dir) if assets_dir is not None else None
+        self.link_dir = Path(val_or_None(link_dir, '.'))
+        self.fields: dict[str, typing.Any] = {}
+        self.assets: set[Path] = set()
+        self._num_cells = num_cells
+
+    def __iter__(self) -> typing.Iterator[dict[str, typing.Any]]:
+        self.fields.clear()
+        num_cells = 0
+        for key, value in self._read():
+            if key != 'cells':
+                self.fields[key] = value
+                continue
+            num_cells += 1
+            yield self._prepare(value)
+        self._num_cells = num_cells
+
+    def __len__(self) -> int:
+        if self._num_cells is None:
+            self._num_cells = sum(1 for key, _ in self._read() if key == 'cells')
+        return self._num_cells
+
+    @typing.overload
+    def __getitem__(self, index: int) -> dict[str, typing.Any]: ...
+    @typing.overload
+    def __getitem__(self, index: slice) -> list[dict[str, typing.Any]]: ...
+    def __getitem__(self, index: int | slice) -> dict[str, typing.Any] | list[dict[str, typing.Any]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            cells = (value for key, value in self._read() if key == 'cells')
+            for i, cell in enumerate(cells):
+                if i == index:
+                    return self._prepare(cell)
+        raise IndexError('notebook cell index out of range')
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({str(self.ipynb_path)!r})'
+
+    def _read(self) -> typing.Iterator[tuple[str, typing.Any]]:
+        '''Parse the top-level fields of the notebook, yielding each cell
+            with the key 'cells'.
+        '''
+        with self.ipynb_path.open('r', encoding='utf-8') as f:
+            stream = _JsonStream(f)
+            for key in stream.object_keys():
+                if key != 'cells':
+                    yield key, stream.value()
+                    continue
+                for cell in stream.array_values():
+                    yield key, cell
+
+    def _prepare(self, cell: dict[str, typing.Any]) -> dict[str, typing.Any]:
+        '''Write the images of a cell to assets and drop unused outputs.'''
+        if self.assets_dir is not None:
+            cell = _extract_images(cell, self.assets_dir, self.link_dir, self.mime_types, self.assets)
+        return _filter_mime_types(cell, self.mime_types)
+
+
+def template_mime_types(template: str) -> frozenset[str] | None:
+    '''Get the MIME types named in a template (e.g. output.data['text/plain']).
+        Returns None, meaning all types are needed, if it names none.
+    '''
+    parsed = get_template_cache().env.parse(template)
+    mime_types = frozenset(
+        node.value for node in parsed.find_all(jinja2.nodes.Const)
+        if isinstance(node.value, str) and _mime_type_pattern.match(node.value)
+    )
+    return mime_types if len(mime_types) else None
+
+_mime_type_pattern = re.compile(r'^[a-z]+/[\w.+-]+$')
+
+def _filter_mime_types(cell: dict[str, typing.Any], mime_types: frozenset[str] | None) -> dict[str, typing.Any]:
+    '''Drop output data and attachments of unused MIME types.'''
+    if mime_types is None:
+        return cell
+    for output in cell.get('outputs', []):
+        if 'data' in output:
+            output['data'] = {k: v for k, v in output['data'].items() if k in mime_types}
+    for name, bundle in cell.get('attachments', {}).items():
+        cell['attachments'][name] = {k: v for k, v in bundle.items() if k in mime_types}
+    return cell
+
+# image outputs written to files, with their file extensions
+_image_suffixes = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/svg+xml': '.svg'}
+
+def _extract_images(
+    cell: dict[str, typing.Any], 
+    assets_dir: Path, 
+    link_dir: Path,
+    mime_types: frozenset[str] | None,
+    written: set[Path],
+) -> dict[str, typing.Any]:
+    '''Write image outputs to files and link them from output['files']. The
+        data of images a template reads itself (named in mime_types) is left
+        in place, and so is all data if mime_types is None.
+    '''
+    for output in cell.get('outputs', []):
+        data = output.get('data', {})
+        for mime_type, suffix in _image_suffixes.items():
+            if mime_type not in data or (mime_types is not None and mime_type in mime_types):
+                continue
+            value = data[mime_type] if mime_types is None else data.pop(mime_type)
+            value = ''.join(value) if isinstance(value, list) else value
+            content = value.encode('utf-8') if mime_type == 'image/svg+xml' else base64.b64decode(value)
+            path = write_asset(content, suffix, assets_dir)
+            written.add(path)
+            output.setdefault('files', {})[mime_type] = Path(os.path.relpath(path, link_dir)).as_posix()
+    return cell
+
+def write_asset(content: bytes, suffix: str, assets_dir: Path) -> Path:
+    '''Write a file named by the hash of its content, unless it exists.'''
+    assets_dir = Path(assets_dir)
+    path = assets_dir / f'{hashlib.sha256(content).hexdigest()[:16]}{suffix}'
+    if not path.is_file():
+        assets_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+    return path
+
+def _template_fields(template: str, cache_dir: Path | None) -> list[str]:
+    '''Get the top-level notebook fields a template may use.'''
+    variables = jinja_get_variables(template, cache=get_template_cache(cache_dir))
+    return [v for v in variables if v not in ('linenums', 'indent')]
+
+
+class _JsonStream:
+    '''Reads json values from a text file incrementally. Each value is
+        parsed with the json module once it is entirely in the buffer.
+    '''
+    def __init__(self, f: typing.TextIO, chunk_size: int = 1024**2):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def object_keys(self) -> typing.Iterator[str]:
+        '''Iterate over the keys of an object. The caller reads each value
+            (with value() or array_values()) before asking for the next key.
+        '''
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._next() == '}':
+                return
+
+    def array_values(self) -> typing.Iterator[typing.Any]:
+        '''Iterate over the values of an array, parsing one at a time.'''
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._next() == ']':
+                return
+
+    def value(self) -> typing.Any:
+        '''Parse the next value.'''
+        while True:
+            self._peek()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _fill(self) -> bool:
+        '''Read more of the file. Reads grow with the buffer so large 
+            values are not parsed again many times.
+        '''
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        '''Skip whitespace and get the next character.'''
+        while True:
+            self.pos = _whitespace_pattern.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of notebook json.')
+
+    def _expect(self, char: str) -> None:
+        if (found := self._peek()) != char:
+            raise ValueError(f'Expected "{char}" in notebook json, found "{found}".')
+        self.pos += 1
+
+    def _next(self) -> str:
+        '''Consume the separator after an object or array member.'''
+        char = self._peek()
+        if char not in ',}]':
+            raise ValueError(f'Expected "," in notebook json, found "{char}".')
+        self.pos += 1
+        return char
+
+_whitespace_pattern = re.compile(r'[ \t\n\r]*')
+
+
+###################### Rendering Notebooks with Pandoc ######################
+def render_notebook(
+    ipynb_path: Path,
+    output_path: Path,
+    output_format: RenderFormat | None = None,
+    vars: dict[str,typing.Any] | None = None,
+    strict_render: bool = True,
+    pandoc_args: PandocArgs | None = None,
+    cache_dir: Path | None = None,
+    output_cache: OutputCache | None = None,
+    image_cache: ImageCache | None = None,
+    assets_dir: Path | None = None,
+) -> str:
+    '''Render a notebook to a file with pandoc's ipynb reader, without an 
+        intermediate markdown file. Markdown cells containing jinja syntax 
+        are rendered as templates with the builtin methods, OUTPUT_FORMAT 
+        and vars, one cell at a time (a block cannot span cells). Image 
+        outputs are written to files and shown below their code cell, so 
+        pandoc does not parse their base64 data. The notebook is streamed
+        to pandoc, which reads it directly if there is nothing to change.
+        Pandoc's ipynb reader keeps the cell structure but is slower than
+        its markdown reader on text-heavy notebooks (see 
+        experiments/benchmark_notebook_render.py).
+    Args:
+        ipynb_path: the notebook to render.
+        output_path: path to the output file.
+        output_format: the format of the output file. Inferred from output_path if None.
+        vars: the variables to substitute into templated cells.
+        strict_render: if True, raise an error if not all variables are provided.
+        pandoc_args: the arguments for the pandoc conversion.
+        cache_dir: optional directory for persistent caches.
+        output_cache: if provided, reuse pandoc outputs of identical conversions.
+        image_cache: if provided, reuse images rasterized by builtin methods.
+        assets_dir: folder for image outputs. The assets folder next to the
+            output file if None, or a temporary folder if the output embeds
+            images (docx, pdf or pandoc_args.embed_resources). Images are 
+            linked relative to the output file, or to the current folder when
+            pandoc embeds them, since pandoc reads them from there.
+    '''
+    output_format = val_or_None(output_format, Path(output_path).suffix[1:])
+    uses_jinja, has_images = _scan_notebook(ipynb_path)
+    if not uses_jinja and not has_images:
+        return pandoc_convert_file(ipynb_path, 'ipynb', output_path, output_format, pandoc_args, output_cache)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_converter = ImageConverter(tmp_dir, image_cache=image_cache)
+        vars = {
+            **get_builtin_methods(tmp_dir, output_format, image_converter=image_converter),
+            **val_or_None(vars, {}),
+        }
+        embeds = output_format in ('docx', 'pdf') or (pandoc_args is not None and pandoc_args.embed_resources)
+        if embeds:
+            cells = NotebookCells(ipynb_path, assets_dir=val_or_None(assets_dir, Path(tmp_dir) / 'assets'))
+        else:
+            link_dir = Path(output_path).parent
+            cells = NotebookCells(ipynb_path, assets_dir=val_or_None(assets_dir, link_dir / 'assets'), link_dir=link_dir)
+        rendered = (
+            rendered for cell in cells
+            for rendered in _link_images(_render_cell(cell, vars, strict_render, cache_dir))
+        )
+        try:
+            return pandoc_convert_stream(
+                input_chunks=_notebook_chunks(rendered, cells.fields),
+                input_format='ipynb',
+                output_path=output_path,
+                output_format=output_format,
+                pandoc_args=pandoc_args,
+                output_cache=output_cache.ignoring_dirs(tmp_dir) if output_cache is not None else None,
+            )
+        finally:
+            image_converter.close()
+
+def _scan_notebook(ipynb_path: Path, chunk_size: int = 1024**2) -> tuple[bool, bool]:
+    '''Check whether a notebook file may contain jinja delimiters and image
+        outputs. False positives only cost streaming the notebook.
+    '''
+    uses_jinja, has_images = False, False
+    tail = b''
+    with Path(ipynb_path).open('rb') as f:
+        while not (uses_jinja and has_images) and (chunk := f.read(chunk_size)):
+            # keep a few bytes so markers split between chunks are found
+            chunk = tail + chunk
+            uses_jinja = uses_jinja or _has_jinja_delimiter(chunk)
+            has_images = has_images or b'"image/' in chunk
+            tail = chunk[-8:]
+    return uses_jinja, has_images
+
+def _has_jinja_delimiter(chunk: bytes) -> bool:
+    # searching for a single byte is much faster than for '{{' and '{%'
+    pos = chunk.find(b'{')
+    while pos != -1:
+        if chunk[pos+1:pos+2] in (b'{', b'%'):
+            return True
+        pos = chunk.find(b'{', pos+1)
+    return False
+
+def _link_images(cell: dict[str, typing.Any]) -> list[dict[str, typing.Any]]:
+    '''Replace outputs written to files by a markdown cell linking them.'''
+    outputs, links = [], []
+    for output in cell.get('outputs', []):
+        if 'files' in output:
+            # the image replaces the whole output, including its text/plain placeholder
+            links.append(f'![]({next(iter(output["files"].values()))})')
+        else:
+            outputs.append(output)
+    if not len(links):
+        return [cell]
+    cell['outputs'] = outputs
+    links = '\n\n'.join(links)
+    return [cell, {'cell_type': 'markdown', 'metadata': {}, 'source': links}]
+
+def _render_cell(
+    cell: dict[str, typing.Any],
+    vars: dict[str,typing.Any],
+    strict_render: bool,
+    cache_dir: Path | None,
+) -> dict[str, typing.Any]:
+    '''Render the source of a markdown cell as a jinja template if it uses jinja.'''
+    source = cell.get('source', '')
+    source = ''.join(source) if isinstance(source, list) else source
+    if cell.get('cell_type') != 'markdown' or ('{{' not in source and '{%' not in source):
+        return cell
+
+    cell['source'] = jinja_render(source, vars, strict=strict_render, cache=get_template_cache(cache_dir))
+    return cell
+
+def _notebook_chunks(
+    cells: typing.Iterable[dict[str, typing.Any]],
+    fields: dict[str, typing.Any],
+) -> typing.Iterator[str]:
+    '''Write a notebook as json, one cell at a time. The other fields are
+        written once all cells are consumed (see NotebookCells.fields).
+    '''
+    yield '{"cells": ['
+    for i, cell in enumerate(cells):
+        yield f'{"," if i else ""}{json.dumps(cell)}'
+    yield ']'
+    for key, value in fields.items():
+        yield f', {json.dumps(key)}: {json.dumps(value)}'
+    yield '}'
+
+
+###################### Converting Many Notebooks ######################
+def convert_ipynb2md_files(
+    template: str,
+    ipynb_paths: typing.Iterable[Path],
+    md_paths: typing.Iterable[Path],
+    linenums: bool = False,
+    cache_dir: Path | None = None,
+    workers: int | None = None,
+    manifest_path: Path | None = None,
+    force: bool = False,
+    assets_dir: Path | None = None,
+) -> dict[Path, bool]:
+    '''Convert notebooks to markdown files, compiling the template once per
+        process. Returns whether each markdown file was written.
+    Args:
+        template: the jinja template that receives the notebook json.
+        ipynb_paths: the notebooks to convert.
+        md_paths: the markdown file written for each notebook.
+        linenums: passed to the template.
+        cache_dir: optional directory for persistent caches.
+        workers: number of processes converting notebooks. Convert in this
+            process if None or 1.
+        manifest_path: if provided, a json file recording the hash of each
+            converted notebook and template. Notebooks whose hashes match
+            and whose markdown file and image assets exist are skipped.
+        force: convert all notebooks, even if unchanged.
+        assets_dir: if provided, image outputs of all notebooks are written
+            here and linked from the markdown (see read_notebook).
+    '''
+    assets_dir = str(Path(assets_dir).resolve()) if assets_dir is not None else None
+    template_hash = hashlib.sha256(json.dumps([template, linenums, assets_dir]).encode('utf-8')).hexdigest()
+    manifest = read_manifest(manifest_path) if manifest_path is not None else {}
+
+    todo: dict[Path, tuple[Path, dict[str,str]]] = {}
+    converted: dict[Path, bool] = {}
+    for ipynb_path, md_path in zip(ipynb_paths, md_paths, strict=True):
+        ipynb_path, md_path = Path(ipynb_path), Path(md_path)
+        with ipynb_path.open('rb') as f:
+            entry = {
+                'input': hashlib.file_digest(f, 'sha256').hexdigest(),
+                'template': template_hash,
+                'output': str(md_path.resolve()),
+            }
+        converted[md_path] = force or not _notebook_converted(manifest.get(str(ipynb_path.resolve())), entry, md_path)
+        if converted[md_path]:
+            todo[md_path] = (ipynb_path, entry)
+
+    try:
+        if workers is None or workers <= 1:
+            compiled = compile_ipynb2md_template(template, cache_dir=cache_dir)
+            fields, mime_types = _template_fields(template, cache_dir), template_mime_types(template)
+            for md_path, (ipynb_path, entry) in todo.items():
+                assets = _convert_notebook(compiled, fields, ipynb_path, md_path, linenums, mime_types, assets_dir)
+                manifest[str(ipynb_path.resolve())] = {**entry, 'assets': assets}
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(template, cache_dir),
+            ) as executor:
+                futures = {
+                    executor.submit(_convert_in_worker, ipynb_path, md_path, linenums, assets_dir): (ipynb_path, entry)
+                    for md_path, (ipynb_path, entry) in todo.items()
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    assets = future.result()
+                    ipynb_path, entry = futures[future]
+                    manifest[str(ipynb_path.resolve())] = {**entry, 'assets': assets}
+    finally:
+        # record finished notebooks even if another one failed
+        if manifest_path is not None:
+            write_manifest(manifest_path, manifest)
+
+    return converted
+
+
+def _convert_notebook(
+    template: jinja2.Template,
+    fields: typing.Collection[str],
+    ipynb_path: Path,
+    md_path: Path,
+    linenums: bool,
+    mime_types: typing.Collection[str] | None,
+    assets_dir: Path | None = None,
+) -> list[str]:
+    '''Render a notebook read one cell at a time into a markdown file.
+        Returns the image assets linked from the markdown.
+    '''
+    notebook = read_notebook(
+        ipynb_path, 
+        fields=fields, 
+        mime_types=mime_types, 
+        assets_dir=assets_dir, 
+        link_dir=Path(md_path).parent,
+    )
+    with Path(md_path).open('w') as f:
+        f.writelines(template.generate(**notebook, linenums=linenums))
+    return sorted(str(path.resolve()) for path in notebook['cells'].assets)
+
+def _notebook_converted(recorded: dict[str,typing.Any] | None, entry: dict[str,str], md_path: Path) -> bool:
+    '''Check that a notebook was converted with the same hashes and that its
+        markdown file and the images it links still exist.
+    '''
+    if recorded is None or {k: v for k, v in recorded.items() if k != 'assets'} != entry:
+        return False
+    return md_path.is_file() and all(Path(path).is_file() for path in recorded.get('assets', []))
+
+
+_worker_template: tuple[jinja2.Template, list[str], frozenset[str] | None] | None = None
+
+def _init_worker(template: str, cache_dir: Path | None) -> None:
+    '''Compile the template once per worker process.'''
+    global _worker_template
+    _worker_template = (
+        compile_ipynb2md_template(template, cache_dir=cache_dir),
+        _template_fields(template, cache_dir),
+        template_mime_types(template),
+    )
 
+def _convert_in_worker(ipynb_path: Path, md_path: Path, linenums: bool, assets_dir: Path | None) -> list[str]:
+    compiled, fields, mime_types = _worker_template
+    return _convert_notebook(compiled, fields, ipynb_path, md_path, linenums, mime_types, assets_dir)
 
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import typing
+import hashlib
+import json
+import os
+import shutil
+import copy
+from pathlib import Path
+import pypandoc
+
+if typing.TYPE_CHECKING:
+    from .compile import PandocArgs
+
+from .info import default_cache_dir
+from .files import referenced_paths
+
+
+class FileCache:
+    '''Folder of files stored under hash keys. The least recently used
+        files are removed once the folder grows beyond max_bytes.
+    Args:
+        directory: folder where files are stored.
+        max_bytes: maximum total size of stored files.
+    '''
+    suffix = '.cached'
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory).expanduser()
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get_file(self, key: str, output_path: Path) -> bool:
+        '''Copy the stored file to output_path. Returns False on a miss.'''
+        path = self._path(key, output_path)
+        try:
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            return False
+        os.utime(path)
+        return True
+
+    def put_file(self, key: str, output_path: Path) -> None:
+        '''Store the file under the key.'''
+        path = self._path(key, output_path)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        shutil.copyfile(output_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_text(self, key: str) -> str | None:
+        '''Get the stored text, or None on a miss.'''
+        path = self._path(key)
+        try:
+            with path.open('r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return text
+
+    def put_text(self, key: str, output_text: str) -> None:
+        '''Store the text under the key.'''
+        path = self._path(key)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            f.write(output_text)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        '''Remove least recently used files until the cache fits in max_bytes.'''
+        entries = []
+        for path in self._stored_files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        '''Remove all stored files.'''
+        for path in self._stored_files():
+            path.unlink(missing_ok=True)
+
+    def _path(self, key: str, output_path: Path | None = None) -> Path:
+        return self.directory / f'{key}{self.suffix}'
+
+    def _stored_files(self) -> typing.Iterator[Path]:
+        return self.directory.glob(f'*{self.suffix}')
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({str(self.directory)!r}, max_bytes={self.max_bytes})'
+
+
+class OutputCache(FileCache):
+    '''Content-addressed cache of pandoc outputs. Conversions are keyed by
+        the input text, the pandoc arguments, the contents of referenced
+        local files (images, bibliography, templates) and the pandoc
+        version. On a hit the stored output is copied instead of running
+        pandoc. The least recently used outputs are removed once the cache
+        grows beyond max_bytes.
+    Args:
+        directory: folder where outputs are stored.
+        max_bytes: maximum total size of stored outputs.
+    '''
+    suffix = '.pandoc-output'
+
+    def __init__(self,
+        directory: Path = default_cache_dir / 'pandoc',
+        max_bytes: int = 1024**3,
+    ):
+        super().__init__(directory, max_bytes)
+        self.volatile_dirs: tuple[str, ...] = tuple()
+
+    def ignoring_dirs(self, *volatile_dirs: str) -> typing.Self:
+        '''Get a view of this cache whose keys do not depend on the names
+            of the given folders (e.g. per-render temporary folders). The 
+            contents of files referenced inside them are still part of the key.
+        '''
+        view = copy.copy(self)
+        view.volatile_dirs = self.volatile_dirs + tuple(str(d) for d in volatile_dirs)
+        return view
+
+    def key(self,
+        input_text: str,
+        input_format: str,
+        output_format: str,
+        pandoc_args: PandocArgs,
+    ) -> str:
+        '''Get the key identifying a conversion.'''
+        extra_args, kwargs = pandoc_args.to_list()
+        h = hashlib.sha256()
+        h.update(json.dumps([
+            pypandoc.get_pandoc_version(),
+            input_format,
+            output_format,
+            extra_args,
+            sorted((k, repr(v)) for k,v in kwargs.items()),
+        ]).encode('utf-8'))
+        h.update(self._normalize(input_text).encode('utf-8'))
+
+        # resources are read by pandoc, so their contents are part of the key
+        for path in sorted(referenced_paths(input_text, extra_args)):
+            h.update(f'\0{self._normalize(path)}\0'.encode('utf-8'))
+            try:
+                with open(path, 'rb') as f:
+                    h.update(hashlib.file_digest(f, 'sha256').digest())
+            except OSError:
+                h.update(b'missing')
+        return h.hexdigest()
+
+    def _normalize(self, text: str) -> str:
+        '''Replace volatile folder names with a placeholder.'''
+        for i, volatile_dir in enumerate(self.volatile_dirs):
+            text = text.replace(volatile_dir, f'<volatile-dir-{i}>')
+        return text
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import typing
+import dataclasses
+import glob
+import hashlib
+import json
+import os
+import contextlib
+import tomllib
+from pathlib import Path
+
+from .compiled_doc import RenderResult, render_documents
+from .compile import PandocArgs, RenderFormat
+from .output_cache import OutputCache
+from .images import ImageCache
+from .files import read_manifest, write_manifest
+
+
+@dataclasses.dataclass
+class ProjectDocument:
+    '''Markdown file of a project and the outputs built from it.
+    Args:
+        md_path: path to the markdown file.
+        output_paths: the output files; formats are inferred from suffixes.
+        vars: the variables to substitute into the jinja template.
+        pandoc_args: the arguments for the pandoc conversions.
+    '''
+    md_path: Path
+    output_paths: list[Path]
+    vars: dict[str,typing.Any] = dataclasses.field(default_factory=dict)
+    pandoc_args: PandocArgs | None = None
+
+
+@dataclasses.dataclass
+class Project:
+    '''Set of documents built together, like a makefile. The files each
+        output was built from (the markdown file, tables and images read by
+        builtin methods, bibliographies and pandoc templates) are recorded
+        in a manifest, and later builds only render outputs whose files or
+        settings changed.
+    Args:
+        documents: the documents of the project.
+        manifest_path: json file recording the dependencies of each output.
+        strict_render: if True, raise an error if not all variables are provided.
+        cache_dir: optional directory for persistent caches.
+        root: if provided, builds render with this folder as the working 
+            directory, so relative paths inside documents (e.g. 
+            csv_to_markdown('data.csv') or image links) resolve against it.
+            Otherwise they resolve against the current folder.
+    '''
+    documents: list[ProjectDocument]
+    manifest_path: Path
+    strict_render: bool = True
+    cache_dir: Path | None = None
+    root: Path | None = None
+
+    @classmethod
+    def from_file(cls, fpath: Path) -> typing.Self:
+        '''Read a project file (toml). Paths are relative to the project file,
+            and so are paths inside the documents, which are rendered with 
+            the project folder as the working directory (see root).
+            Top-level out_dir, formats, vars and [pandoc] (PandocArgs fields)
+            are defaults that each [[documents]] entry can override; the path
+            of a document may be a glob pattern. Example:
+
+                out_dir = "site"
+                formats = ["html"]
+
+                [pandoc]
+                citeproc_bibliography = "refs.bib"
+
+                [[documents]]
+                path = "docs/*.md"
+
+                [[documents]]
+                path = "report.md"
+                formats = ["html", "docx"]
+                vars = {title = "Report"}
+        '''
+        fpath = Path(fpath)
+        root = fpath.resolve().parent
+        with fpath.open('rb') as f:
+            config = tomllib.load(f)
+
+        documents = []
+        for entry in config.get('documents', []):
+            if 'path' not in entry:
+                raise ValueError(f'Document without a path in {fpath}: {entry}')
+            out_dir = root / entry.get('out_dir', config.get('out_dir', '.'))
+            formats: list[RenderFormat] = entry.get('formats', config.get('formats', ['html']))
+            vars = {**config.get('vars', {}), **entry.get('vars', {})}
+            pandoc_args = _pandoc_args({**config.get('pandoc', {}), **entry.get('pandoc', {})}, root)
+
+            md_paths = sorted(glob.glob(entry['path'], root_dir=root, recursive=True)) if glob.has_magic(entry['path']) else [entry['path']]
+            for md_path in md_paths:
+                documents.append(ProjectDocument(
+                    md_path=root / md_path,
+                    output_paths=[(out_dir / md_path).with_suffix(f'.{fmt}') for fmt in formats],
+                    vars=vars,
+                    pandoc_args=pandoc_args,
+                ))
+
+        return cls(
+            documents=documents,
+            manifest_path=root / config.get('manifest', '.pymddoc-build.json'),
+            strict_render=config.get('strict_render', True),
+            cache_dir=_project_path(config.get('cache_dir'), root),
+            root=root,
+        )
+
+    def outdated(self) -> list[Path]:
+        '''Get the outputs that are missing or whose files or settings changed
+            since they were last built.
+        '''
+        manifest = read_manifest(self.manifest_path)
+        return [
+            output_path
+            for document in self.documents
+            for output_path in document.output_paths
+            if not self._up_to_date(manifest, document, output_path)
+        ]
+
+    def build(self,
+        force: bool = False,
+        workers: int | None = None,
+        output_cache: OutputCache | None = None,
+        image_cache: ImageCache | None = None,
+    ) -> typing.Iterator[RenderResult]:
+        '''Render the outdated outputs, yielding results as documents complete.
+            Result indices refer to the position of the document. Successful
+            outputs are recorded in the manifest, failed ones are rendered
+            again by the next build. If root is set, the working directory
+            is root until the build finishes, including while results are
+            consumed; paths in the project should therefore be absolute.
+        Args:
+            force: render all outputs, even if up to date.
+            workers: number of worker processes. Render in this process if
+                None or 1.
+            output_cache: if provided, reuse pandoc outputs of identical conversions.
+            image_cache: if provided, reuse images rasterized by builtin methods.
+        '''
+        manifest = read_manifest(self.manifest_path)
+        indices, items = [], []
+        for i, document in enumerate(self.documents):
+            todo = [p for p in document.output_paths if force or not self._up_to_date(manifest, document, p)]
+            if not len(todo):
+                continue
+            for output_path in todo:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+            indices.append(i)
+            items.append((document.md_path, todo, dict(
+                vars=document.vars,
+                strict_render=self.strict_render,
+                pandoc_args=document.pandoc_args,
+            )))
+
+        # paths inside documents are relative to the project folder
+        workdir = contextlib.chdir(self.root) if self.root is not None else contextlib.nullcontext()
+        try:
+            with workdir:
+                for result in render_documents(
+                    items,
+                    doc_kwargs=dict(cache_dir=self.cache_dir, output_cache=output_cache, image_cache=image_cache),
+                    workers=workers,
+                ):
+                    # results refer to the documents with outputs to build
+                    result.index = indices[result.index]
+                    document = self.documents[result.index]
+                    key = str(result.output_path.resolve())
+                    if result.ok:
+                        manifest[key] = {
+                            'settings': _settings_hash(document, result.output_path, self.strict_render),
+                            'dependencies': {path: _file_entry(path) for path in sorted(result.dependencies)},
+                        }
+                    else:
+                        manifest.pop(key, None)
+                    yield result
+        finally:
+            # record finished outputs even if the build was interrupted
+            write_manifest(self.manifest_path, manifest)
+
+    def _up_to_date(self,
+        manifest: dict[str, typing.Any],
+        document: ProjectDocument,
+        output_path: Path,
+    ) -> bool:
+        '''Check that an output exists and was built from the current files and settings.'''
+        entry = manifest.get(str(output_path.resolve()))
+        if entry is None or not output_path.is_file():
+            return False
+        if entry['settings'] != _settings_hash(document, output_path, self.strict_render):
+            return False
+        return all(_file_unchanged(path, recorded) for path, recorded in entry['dependencies'].items())
+
+
+def _project_path(path: str | None, root: Path) -> Path | None:
+    '''Resolve a path from the project file relative to the project folder.'''
+    return root / path if path is not None else None
+
+def _pandoc_args(config: dict[str,typing.Any], root: Path) -> PandocArgs | None:
+    '''Create PandocArgs from a [pandoc] table, resolving file paths.'''
+    if not len(config):
+        return None
+    fields = {f.name for f in dataclasses.fields(PandocArgs)}
+    if len(unknown := config.keys() - fields):
+        raise ValueError(f'Unknown pandoc settings {sorted(unknown)}. Expected any of {sorted(fields)}.')
+    return PandocArgs(**{
+        **config,
+        'citeproc_bibliography': _project_path(config.get('citeproc_bibliography'), root),
+        'template': _project_path(config.get('template'), root),
+    })
+
+def _settings_hash(document: ProjectDocument, output_path: Path, strict_render: bool) -> str:
+    '''Hash the settings an output is rendered with.'''
+    return hashlib.sha256(json.dumps([
+        str(document.md_path.resolve()),
+        output_path.suffix,
+        document.vars,
+        dataclasses.asdict(document.pandoc_args) if document.pandoc_args is not None else None,
+        strict_render,
+    ], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def _file_entry(path: str) -> list[typing.Any] | None:
+    '''Get the modification time, size and content hash of a file, or None if it is missing.'''
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            return [st.st_mtime_ns, st.st_size, hashlib.file_digest(f, 'sha256').hexdigest()]
+    except OSError:
+        return None
+
+def _file_unchanged(path: str, recorded: list[typing.Any] | None) -> bool:
+    '''Check a file against its manifest entry, hashing it only if its
+        modification time or size changed (e.g. after a checkout).
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return recorded is None
+    if recorded is None:
+        return False
+    if [st.st_mtime_ns, st.st_size] == recorded[:2]:
+        return True
+    current = _file_entry(path)
+    return current is not None and current[2] == recorded[2]
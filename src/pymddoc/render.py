@@ -1,44 +1,86 @@
+from __future__ import annotations
+
 import typing
 import jinja2
 import pathlib
+import dataclasses
+import collections
+import hashlib
+import threading
+import types
+import marshal
+import importlib.util
+import time
+import os
+import contextlib
+import contextvars
+from pathlib import Path
 
 import jinja2.meta
 
+from .util import val_or_None
+
 
 def jinja_render(
     input_text: str,
     vars: dict[str,typing.Any],
     strict: bool = True,
+    cache: TemplateCache | None = None,
 ) -> str:
     '''Return the same document rendered as a jinja template.
     Args:
         input_text: the text to render.
         vars: the variables to substitute into the jinja template.
         strict: if True, raise an error if not all variables are provided.
+        cache: compiled template cache to use. Defaults to the module cache.
     '''
     try:
         # NOTE: not sure which of these causes the exception
-        template = text_as_jinja_template(input_text)
-        rendered_text = template.render(vars)
+        template = text_as_jinja_template(input_text, cache=cache)
+        with track_undefined() as used:
+            rendered_text = template.render(vars)
     except jinja2.exceptions.TemplateSyntaxError as e:
         raise _add_line_number_to_exception_message(e)
     
-    if strict and (jv := len(jinja_get_variables(input_text=rendered_text))):
-        raise ValueError(f'strict=True but not all jinja template variables '
-            f'have been provided: {jv}')
+    if strict and len(used):
+        raise missing_variables_error(sorted(used))
     return rendered_text
 
 
-def jinja_get_variables(input_text: str) -> list[str]:
+def jinja_generate(
+    template: jinja2.Template,
+    vars: dict[str,typing.Any],
+    strict: bool = True,
+) -> typing.Iterator[str]:
+    '''Render a template in chunks (see jinja2.Template.generate). If strict,
+        raise an error after the last chunk if undefined variables were used.
+    '''
+    used: set[str] = set()
+    chunks = template.generate(vars)
+    while True:
+        # track per chunk: the consumer may suspend the generator between chunks
+        with track_undefined(used):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+    if strict and len(used):
+        raise missing_variables_error(sorted(used))
+
+
+def jinja_get_variables(
+    input_text: str,
+    cache: TemplateCache | None = None,
+) -> list[str]:
     '''Get list of jinja variables to populate.
     Args:
         input_text: the text to look for variables in.
+        cache: compiled template cache to use. Defaults to the module cache.
     '''
-    env = _get_jinja_environment()
+    cache = val_or_None(cache, _template_cache)
     try:
-        # NOTE: not sure which of these causes the exception
-        parsed = env.parse(input_text)
-        return list(jinja2.meta.find_undeclared_variables(parsed))
+        return cache.get_variables(input_text)
     except jinja2.exceptions.TemplateSyntaxError as e:
         raise _add_line_number_to_exception_message(e)
 
@@ -46,14 +88,267 @@ def jinja_get_variables(input_text: str) -> list[str]:
 def text_as_jinja_template(
     input_text: str,
     globals: dict[str, typing.Any] | None = None,
+    cache: TemplateCache | None = None,
 ) -> jinja2.Template:
     '''Get a jinja template of the current document.'''
-    env = _get_jinja_environment()
-    return env.from_string(
-        source = input_text,
+    cache = val_or_None(cache, _template_cache)
+    return cache.get_template(
+        input_text = input_text,
         globals = globals,
     )
 
+
+###################### Undefined Variables ######################
+_used_undefined: contextvars.ContextVar[set[str] | None] = contextvars.ContextVar('used_undefined', default=None)
+
+@contextlib.contextmanager
+def track_undefined(used: set[str] | None = None) -> typing.Iterator[set[str]]:
+    '''Collect the names of undefined variables that templates print or 
+        iterate over while rendering inside this context. Undefined 
+        variables that are only tested (e.g. "is defined", "|default") 
+        are not collected.
+    '''
+    used = val_or_None(used, set())
+    token = _used_undefined.set(used)
+    try:
+        yield used
+    finally:
+        _used_undefined.reset(token)
+
+
+class TrackingUndefined(jinja2.Undefined):
+    '''Undefined that renders as nothing, like jinja2.Undefined, and records
+        the names of undefined variables that are used (see track_undefined()).
+    '''
+    __slots__ = ()
+
+    def _record(self) -> None:
+        # only variables: undefined attributes of defined objects are not missing vars
+        if self._undefined_obj is jinja2.utils.missing and (used := _used_undefined.get()) is not None:
+            used.add(self._undefined_name)
+
+    def __str__(self) -> str:
+        self._record()
+        return super().__str__()
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        self._record()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self._record()
+        return super().__len__()
+
+
+###################### Compiled Template Cache ######################
+@dataclasses.dataclass(frozen=True)
+class TemplateCacheInfo:
+    '''Hit/miss statistics of a TemplateCache.'''
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+@dataclasses.dataclass(frozen=True)
+class _CompiledSource:
+    '''Compiled code and undeclared variables of a single template source.'''
+    code: types.CodeType
+    variables: tuple[str, ...]
+
+
+class TemplateCache:
+    '''Bounded LRU cache of compiled jinja templates keyed by source hash.
+        Each distinct source is parsed and compiled once. Templates returned
+        from the cache share the compiled code but get their own globals.
+    Args:
+        env: the jinja environment used to parse and compile templates.
+        maxsize: the maximum number of compiled templates to keep.
+        bytecode_cache: optional on-disk cache consulted before compiling.
+    '''
+    def __init__(self, 
+        env: jinja2.Environment | None = None, 
+        maxsize: int = 128,
+        bytecode_cache: TemplateBytecodeCache | None = None,
+    ):
+        self.env = val_or_None(env, _get_jinja_environment())
+        self.maxsize = maxsize
+        self.bytecode_cache = bytecode_cache
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[str, _CompiledSource] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_template(self,
+        input_text: str,
+        globals: dict[str, typing.Any] | None = None,
+    ) -> jinja2.Template:
+        '''Get a template for the source, compiling it only on a cache miss.'''
+        entry = self._get_entry(input_text)
+        return self.env.template_class.from_code(
+            self.env, 
+            entry.code, 
+            self.env.make_globals(globals), 
+            None,
+        )
+
+    def get_variables(self, input_text: str) -> list[str]:
+        '''Get the undeclared variables of the source.'''
+        return list(self._get_entry(input_text).variables)
+
+    def clear(self) -> None:
+        '''Remove all compiled templates and reset the hit/miss counters.'''
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> TemplateCacheInfo:
+        '''Get hit/miss statistics for this cache.'''
+        with self._lock:
+            return TemplateCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                maxsize=self.maxsize,
+                currsize=len(self._entries),
+            )
+
+    def _get_entry(self, input_text: str) -> _CompiledSource:
+        '''Get the compiled entry for the source, compiling on a miss.'''
+        key = source_hash(input_text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            
+        # compile outside the lock so other threads are not blocked
+        if self.bytecode_cache is None:
+            entry = self._compile(input_text)
+        elif (entry := self.bytecode_cache.load(key)) is None:
+            entry = self._compile(input_text)
+            self.bytecode_cache.dump(key, entry)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _compile(self, input_text: str) -> _CompiledSource:
+        '''Parse and compile the source once.'''
+        parsed = self.env.parse(input_text)
+        variables = tuple(jinja2.meta.find_undeclared_variables(parsed))
+        return _CompiledSource(
+            code=self.env.compile(parsed),
+            variables=variables,
+        )
+
+
+class TemplateBytecodeCache:
+    '''Persistent on-disk cache of compiled template code.
+        Entries are keyed by the template source hash, the jinja version and 
+        the python bytecode version, so upgrading either never loads stale 
+        code. Entries that have not been used for max_age seconds are removed 
+        when the cache is opened.
+    Args:
+        directory: folder where compiled templates are stored.
+        max_age: seconds after the last use before an entry is removed.
+    '''
+    suffix = '.jinja-cache'
+
+    def __init__(self, directory: Path, max_age: float = 30*24*60*60):
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prune()
+
+    def load(self, key: str) -> _CompiledSource | None:
+        '''Load the compiled entry for the key if it exists on disk.'''
+        path = self._path(key)
+        try:
+            with path.open('rb') as f:
+                code, variables = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError):
+            # corrupt or partially-written entry: recompile
+            path.unlink(missing_ok=True)
+            return None
+        
+        # mark as recently used so it survives pruning
+        os.utime(path)
+        return _CompiledSource(code=code, variables=tuple(variables))
+
+    def dump(self, key: str, entry: _CompiledSource) -> None:
+        '''Write the compiled entry to disk.'''
+        path = self._path(key)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as f:
+            marshal.dump((entry.code, entry.variables), f)
+        
+        # atomic so concurrent processes never read a partial file
+        os.replace(tmp_path, path)
+
+    def prune(self) -> None:
+        '''Remove entries that have not been used for max_age seconds.'''
+        cutoff = time.time() - self.max_age
+        for path in self.directory.glob(f'*{self.suffix}'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        '''Remove all entries.'''
+        for path in self.directory.glob(f'*{self.suffix}'):
+            path.unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        '''Get the file for a key, specific to the jinja/python versions.'''
+        version_key = f'{key}-{jinja2.__version__}-{importlib.util.MAGIC_NUMBER.hex()}'
+        return self.directory / f'{source_hash(version_key)}{self.suffix}'
+
+
+def source_hash(input_text: str) -> str:
+    '''Get the hash used to identify a template source.'''
+    return hashlib.sha256(input_text.encode('utf-8')).hexdigest()
+
+
+def get_template_cache(cache_dir: Path | None = None) -> TemplateCache:
+    '''Get the template cache shared by all renders.
+    Args:
+        cache_dir: if provided, get the shared cache that also persists 
+            compiled templates to the jinja folder inside this directory.
+    '''
+    if cache_dir is None:
+        return _template_cache
+    
+    directory = Path(cache_dir).expanduser().resolve() / 'jinja'
+    with _disk_template_caches_lock:
+        if directory not in _disk_template_caches:
+            _disk_template_caches[directory] = TemplateCache(
+                bytecode_cache=TemplateBytecodeCache(directory),
+            )
+        return _disk_template_caches[directory]
+
+
+def clear_template_cache() -> None:
+    '''Clear the in-memory template caches. Files on disk are kept.'''
+    _template_cache.clear()
+    with _disk_template_caches_lock:
+        for cache in _disk_template_caches.values():
+            cache.clear()
+
+
+def missing_variables_error(missing: list[str]) -> ValueError:
+    '''Error raised by strict renders when variables were not provided.'''
+    return ValueError(f'strict=True but not all jinja template variables '
+        f'have been provided: {", ".join(missing)}')
+
 def _add_line_number_to_exception_message(
     e: jinja2.exceptions.TemplateSyntaxError
 ) -> jinja2.exceptions.TemplateSyntaxError:
@@ -77,6 +372,10 @@ def _add_line_number_to_exception_message(
 @staticmethod
 def _get_jinja_environment(**environment_kwargs) -> jinja2.Environment:
     '''Get environment for jinja. Consistency across the object.'''
-    return jinja2.Environment(**environment_kwargs)
+    return jinja2.Environment(undefined=TrackingUndefined, **environment_kwargs)
+
 
+_template_cache = TemplateCache()
+_disk_template_caches: dict[Path, TemplateCache] = {}
+_disk_template_caches_lock = threading.Lock()
 
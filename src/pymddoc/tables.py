@@ -0,0 +1,646 @@
+from __future__ import annotations
+
+import typing
+import dataclasses
+import collections
+import threading
+import contextlib
+import csv
+import re
+import math
+import os
+import sys
+from pathlib import Path
+
+from .util import val_or_None
+from .dependencies import add_dependency
+
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+T = typing.TypeVar("T")
+
+
+###################### Loaded Table Cache ######################
+@dataclasses.dataclass(frozen=True)
+class TableCacheInfo:
+    '''Hit/miss statistics of a TableCache.'''
+    hits: int
+    misses: int
+    max_bytes: int
+    currbytes: int
+    currsize: int
+
+
+class TableCache:
+    '''Bounded LRU cache of loaded tables and the markdown rendered from
+        them. Entries are keyed by the file path, its modification time and
+        size, and the read/markdown arguments, so changed files are read
+        again. Excel workbooks are loaded once for all of their sheets.
+    Args:
+        max_bytes: the approximate maximum memory used by cached entries.
+    '''
+    def __init__(self, max_bytes: int = 256*1024**2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[tuple, tuple[typing.Any, int]] = collections.OrderedDict()
+        self._currbytes = 0
+        self._lock = threading.Lock()
+
+    def read_table(self,
+        read_func: typing.Callable[..., pd.DataFrame],
+        fname: str,
+        read_kwargs: dict[str,typing.Any] | None = None,
+    ) -> pd.DataFrame:
+        '''Read a table with read_func(fname, **read_kwargs), reusing the
+            cached table if the file has not changed. The returned table is
+            shared and should not be modified in place.
+        '''
+        import pandas as pd
+
+        read_kwargs = val_or_None(read_kwargs, {})
+        if read_func is pd.read_excel:
+            return self.read_excel(fname, read_kwargs)
+        return self.memoize(
+            fname,
+            ('table', func_key(read_func), kwargs_key(read_kwargs)),
+            lambda: read_func(fname, **read_kwargs),
+        )
+
+    def read_excel(self,
+        fname: str,
+        read_kwargs: dict[str,typing.Any] | None = None,
+    ) -> pd.DataFrame:
+        '''Read a sheet of an excel file (see pandas.read_excel). The
+            workbook is loaded once and shared by all sheets read from it.
+        '''
+        import pandas as pd
+
+        read_kwargs = dict(val_or_None(read_kwargs, {}))
+        workbook_kwargs = {k: read_kwargs.pop(k) for k in _workbook_kwargs if k in read_kwargs}
+
+        def read_sheet() -> pd.DataFrame:
+            workbook = self.memoize(
+                fname,
+                ('workbook', kwargs_key(workbook_kwargs)),
+                lambda: pd.ExcelFile(fname, **workbook_kwargs),
+            )
+            return workbook.parse(**read_kwargs)
+
+        return self.memoize(
+            fname,
+            ('excel', kwargs_key(workbook_kwargs), kwargs_key(read_kwargs)),
+            read_sheet,
+        )
+
+    def memoize(self, fname: str, key: tuple, load: typing.Callable[[], T]) -> T:
+        '''Get the entry for a file and key, calling load() on a miss. 
+            Sources that are not local files (urls, file-like objects) are
+            not cached, since they cannot be checked for changes.
+        Args:
+            fname: the file the entry is derived from.
+            key: the (hashable) parameters the entry depends on.
+            load: function computing the entry from the file.
+        '''
+        if not _is_local_file(fname):
+            return load()
+        full_key = (*_file_key(fname), *key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry[0]
+
+        # load outside the lock so other threads are not blocked
+        value = load()
+        nbytes = _sizeof(value, fname)
+
+        evicted = []
+        with self._lock:
+            self.misses += 1
+            if (old := self._entries.pop(full_key, None)) is not None:
+                self._currbytes -= old[1]
+                evicted.append(old[0])
+            self._entries[full_key] = (value, nbytes)
+            self._currbytes += nbytes
+            while self._currbytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted_value, evicted_bytes) = self._entries.popitem(last=False)
+                self._currbytes -= evicted_bytes
+                evicted.append(evicted_value)
+        _close_values(evicted, keep=value)
+        return value
+
+    def invalidate(self, fname: str | None = None) -> None:
+        '''Remove the entries of a file, or all entries if fname is None.
+            Removed entries holding open files (excel workbooks) are closed.
+        '''
+        path = str(Path(fname).resolve()) if fname is not None else None
+        with self._lock:
+            removed = [self._entries.pop(k) for k in [k for k in self._entries if path is None or k[0] == path]]
+            self._currbytes -= sum(nbytes for _, nbytes in removed)
+        _close_values([value for value, _ in removed])
+
+    def clear(self) -> None:
+        '''Remove all entries and reset the hit/miss counters.'''
+        self.invalidate()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> TableCacheInfo:
+        '''Get hit/miss statistics for this cache.'''
+        with self._lock:
+            return TableCacheInfo(
+                hits=self.hits,
+                misses=self.misses,
+                max_bytes=self.max_bytes,
+                currbytes=self._currbytes,
+                currsize=len(self._entries),
+            )
+
+
+def _close_values(values: list[typing.Any], keep: typing.Any = None) -> None:
+    '''Close removed cache entries that hold open files (e.g. pd.ExcelFile).'''
+    for value in values:
+        if value is not keep and callable(getattr(value, 'close', None)):
+            value.close()
+
+
+###################### Bounded Table Reading ######################
+def read_head_and_tail(
+    read_func: typing.Callable[..., pd.DataFrame],
+    fname: str,
+    head_rows: int,
+    tail_rows: int,
+    read_kwargs: dict[str,typing.Any] | None = None,
+    chunksize: int = 65536,
+) -> pd.DataFrame:
+    '''Read the first head_rows and last tail_rows rows of a table, with a
+        row of ellipses in place of the rows in between. csv files are read
+        in chunks so memory use does not depend on the size of the file.
+    Args:
+        read_func: the function to read the table.
+        fname: the file name to read.
+        head_rows: the number of rows from the start of the table.
+        tail_rows: the number of rows from the end of the table.
+        read_kwargs: the keyword arguments to pass to the read function.
+        chunksize: the number of rows parsed at a time from csv files.
+    '''
+    import pandas as pd
+
+    read_kwargs = val_or_None(read_kwargs, {})
+    if read_func is pd.read_csv:
+        chunks = read_func(fname, chunksize=chunksize, **read_kwargs)
+    else:
+        chunks = contextlib.nullcontext([get_table_cache().read_table(read_func, fname, read_kwargs)])
+
+    head, tail, total = None, collections.deque(), 0
+    with chunks as reader:
+        for chunk in reader:
+            if head is None:
+                head = chunk.iloc[:0]
+            if len(head) < head_rows:
+                head = pd.concat([head, chunk.iloc[:head_rows-len(head)]])
+            total += len(chunk)
+
+            # keep just enough trailing chunks to cover tail_rows
+            tail.append(chunk.iloc[-tail_rows:] if tail_rows > 0 else chunk.iloc[:0])
+            while len(tail) > 1 and sum(len(c) for c in tail) - len(tail[0]) >= tail_rows:
+                tail.popleft()
+
+    if head is None:
+        # no rows at all; read just the header
+        return read_func(fname, **{**read_kwargs, 'nrows': 0})
+
+    tail = pd.concat(tail)
+    num_tail = max(0, min(tail_rows, total - len(head)))
+    return _join_head_and_tail(head, tail.iloc[len(tail)-num_tail:], total)
+
+def _join_head_and_tail(head: pd.DataFrame, tail: pd.DataFrame, total: int) -> pd.DataFrame:
+    '''Concatenate head and tail rows, with a row of ellipses between them
+        if rows were skipped.'''
+    import pandas as pd
+
+    if total - len(head) - len(tail) <= 0:
+        return pd.concat([head, tail])
+    ellipses = pd.DataFrame([['...']*len(head.columns)], columns=head.columns)
+    return pd.concat([head.astype(object), ellipses, tail.astype(object)])
+
+
+###################### Columnar Table Reading ######################
+ArrowFormat = typing.Literal['parquet', 'ipc']
+
+def read_arrow_table(
+    fname: str,
+    format: ArrowFormat | None = None,
+    columns: list[str] | None = None,
+    filters: list[tuple] | None = None,
+    num_rows: int | None = None,
+    tail_rows: int | None = None,
+) -> pd.DataFrame:
+    '''Read a parquet or Arrow IPC (feather) file through a memory map,
+        reading only the requested columns and rows. Parquet row groups 
+        whose statistics rule out the filters are skipped, and reading 
+        stops once num_rows rows are found. Requires pyarrow.
+    Args:
+        fname: the file name to read.
+        format: 'parquet' or 'ipc'. Inferred from the file extension if None.
+        columns: the columns to read. All columns if None.
+        filters: predicates as (column, op, value) tuples that rows must all
+            satisfy, e.g. [('year', '>=', 2020)], or a list of such lists 
+            to match any of them (see pyarrow.parquet.filters_to_expression).
+        num_rows: the number of rows to read.
+        tail_rows: also read this many rows from the end of the table,
+            separated from the first num_rows rows by a row of ellipses.
+    '''
+    try:
+        import pyarrow.dataset as ds
+        import pyarrow.fs
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(f'Reading "{fname}" requires pyarrow (pip install pyarrow).') from e
+
+    format = val_or_None(format, _arrow_format(fname))
+    dataset = ds.dataset(fname, format=format, filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    columns = list(columns) if columns is not None else None
+    expression = pq.filters_to_expression(filters) if filters else None
+
+    if num_rows is None and tail_rows is None:
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    head = dataset.head(val_or_None(num_rows, 0), columns=columns, filter=expression).to_pandas()
+    if tail_rows is None:
+        return head
+
+    # parquet files store row counts, so unfiltered counts do not scan
+    total = dataset.count_rows(filter=expression)
+    first = max(len(head), total - int(tail_rows))
+    tail = dataset.take(list(range(first, total)), columns=columns, filter=expression).to_pandas()
+    return _join_head_and_tail(head, tail, total)
+
+def _arrow_format(fname: str) -> ArrowFormat:
+    suffix = Path(fname).suffix.lower()
+    if suffix in ('.parquet', '.pq'):
+        return 'parquet'
+    elif suffix in ('.feather', '.arrow', '.ipc'):
+        return 'ipc'
+    raise ValueError(f'Cannot infer the format of "{fname}"; use format="parquet" or format="ipc".')
+
+
+###################### Pandas-free csv engine ######################
+TableEngine = typing.Literal['pandas', 'csv']
+
+_table_engine: TableEngine = 'pandas'
+
+def set_table_engine(engine: TableEngine) -> None:
+    '''Set the engine used by csv_to_markdown when no engine is given.
+    Args:
+        engine: 'pandas' supports all read and markdown arguments; 'csv'
+            reads files with the csv module and writes pipe or grid tables
+            without importing pandas.
+    '''
+    global _table_engine
+    if engine not in typing.get_args(TableEngine):
+        raise ValueError(f'Unknown table engine "{engine}". Expected one of {typing.get_args(TableEngine)}.')
+    _table_engine = engine
+
+def get_table_engine() -> TableEngine:
+    '''Get the engine used by csv_to_markdown when no engine is given.'''
+    return _table_engine
+
+
+def csv_to_markdown_table(
+    fname: str,
+    num_rows: int | None = None,
+    read_kwargs: dict[str,typing.Any] | None = None,
+    to_markdown_kwargs: dict[str,typing.Any] | None = None,
+    columns: list[str] | None = None,
+    tail_rows: int | None = None,
+) -> str:
+    '''Read a csv file with the csv module and write it as a markdown table
+        equivalent to pandas' to_markdown(index=False). Only rows that are
+        shown are kept in memory.
+    Args:
+        fname: the file name to read.
+        num_rows: the number of rows to read.
+        read_kwargs: supports sep/delimiter, quotechar, encoding, usecols and nrows.
+        to_markdown_kwargs: supports tablefmt ('pipe' or 'grid') and index=False.
+        columns: the columns to read. All columns if None.
+        tail_rows: also show this many rows from the end of the table.
+    '''
+    read_kwargs = dict(val_or_None(read_kwargs, {}))
+    to_markdown_kwargs = {'index': False, 'tablefmt': 'pipe', **val_or_None(to_markdown_kwargs, {})}
+    if unsupported := sorted(set(read_kwargs) - _csv_read_kwargs):
+        raise ValueError(f'read_kwargs {unsupported} are not supported by the csv table engine; use engine="pandas".')
+    if to_markdown_kwargs.keys() != {'index', 'tablefmt'} or to_markdown_kwargs['index'] \
+            or to_markdown_kwargs['tablefmt'] not in ('pipe', 'grid'):
+        raise ValueError(f'to_markdown_kwargs {to_markdown_kwargs} are not supported by the csv table engine; use engine="pandas".')
+
+    num_rows = val_or_None(num_rows, read_kwargs.pop('nrows', None))
+    columns = val_or_None(columns, read_kwargs.pop('usecols', None))
+    if tail_rows is not None:
+        num_rows = val_or_None(num_rows, 0)
+
+    with open(fname, 'r', newline='', encoding=read_kwargs.get('encoding', 'utf-8-sig')) as f:
+        reader = csv.reader(
+            f,
+            delimiter=read_kwargs.get('sep', read_kwargs.get('delimiter', ',')),
+            quotechar=read_kwargs.get('quotechar', '"'),
+        )
+        headers = _mangle_headers(next((row for row in reader if len(row)), []))
+        selected = _select_columns(headers, columns)
+
+        # with a tail, types are inferred from every row like pandas does
+        head, tail, total = [], collections.deque(maxlen=tail_rows or None), 0
+        inference = [_DtypeInference() for _ in selected]
+        for row in reader:
+            if not len(row):
+                continue
+            row = [row[i] if i < len(row) else '' for i in selected]
+            if num_rows is None or len(head) < num_rows:
+                head.append(row)
+            elif tail_rows is None:
+                break
+            elif tail_rows > 0:
+                tail.append(row)
+            if tail_rows is not None:
+                for inf, value in zip(inference, row):
+                    inf.update(value)
+            total += 1
+
+    headers = [headers[i] for i in selected]
+    rows = head + list(tail)
+    return format_markdown_table(
+        headers, 
+        rows, 
+        to_markdown_kwargs['tablefmt'], 
+        ellipsis_at=len(head) if total > len(rows) else None,
+        dtypes=[inf.dtype for inf in inference] if tail_rows is not None else None,
+    )
+
+
+def format_markdown_table(
+    headers: list[str],
+    rows: list[list[str]],
+    tablefmt: typing.Literal['pipe', 'grid'] = 'pipe',
+    ellipsis_at: int | None = None,
+    dtypes: list[str] | None = None,
+) -> str:
+    '''Write csv cells as a markdown table, inferring column types and 
+        formatting them the way pandas and tabulate would.
+    Args:
+        headers: the column names.
+        rows: the raw csv cells of each row.
+        tablefmt: 'pipe' or 'grid'.
+        ellipsis_at: if provided, insert a row of ellipses before this row.
+        dtypes: the pandas dtype of each column. Inferred from rows if None.
+    '''
+    headers = list(headers)
+    if dtypes is None:
+        dtypes = [_column_dtype([row[i] for row in rows]) for i in range(len(headers))]
+    cols = [[_parse_cell(row[i], dtype) for row in rows] for i, dtype in enumerate(dtypes)]
+
+    if ellipsis_at is not None:
+        # the ellipsis row makes every column a column of strings
+        for col in cols:
+            col.insert(ellipsis_at, '...')
+        types = [str]*len(cols)
+    elif len(dtypes) and all(d in ('int', 'intna', 'float', 'bool') for d in dtypes) \
+            and (all(d == 'bool' for d in dtypes) or {'intna', 'float'} & set(dtypes) and 'bool' not in dtypes):
+        # pandas passes numeric frames to tabulate as one float array
+        cols = [[float(v) for v in col] for col in cols]
+        types = [float]*len(cols)
+    else:
+        # only columns of python objects need to be inspected value by value
+        types = [_dtype_types.get(d) or _tabulate_type(col) for col, d in zip(cols, dtypes)]
+
+    widths, aligns = [], []
+    for i, (header, column_type) in enumerate(zip(headers, types)):
+        if column_type in (int, float):
+            align = 'decimal'
+            cells = [_format_value(v, column_type) for v in cols[i]]
+            if all(isinstance(v, float) for v in cols[i]):
+                decimals = [_afterpoint_g(c) for c in cells]
+            else:
+                decimals = [_afterpoint(c) for c in cells]
+            most = max(decimals, default=-1)
+            cells = [c + ' '*(most - d) for c, d in zip(cells, decimals)]
+        else:
+            align = 'left'
+            cells = [f'{v}'.strip() for v in cols[i]]
+
+        width = max([len(header) + 2] + [len(c) for c in cells])
+        cols[i] = [c.ljust(width) for c in cells] if align == 'left' else [c.rjust(width) for c in cells]
+        headers[i] = header.ljust(width) if align == 'left' else header.rjust(width)
+        widths.append(width)
+        aligns.append(align)
+
+    lines = [f'| {" | ".join(headers)} |']
+    body = [f'| {" | ".join(cells)} |' for cells in zip(*cols)]
+    if tablefmt == 'pipe':
+        lines.append('|' + '|'.join(
+            '-'*(w+2) if not len(rows) else ':' + '-'*(w+1) if align == 'left' else '-'*(w+1) + ':'
+            for w, align in zip(widths, aligns)
+        ) + '|')
+        lines.extend(body)
+    else:
+        rule = '+' + '+'.join('-'*(w+2) for w in widths) + '+'
+        lines = [rule, lines[0], rule.replace('-', '=')]
+        for line in body:
+            lines.extend([line, rule])
+        if not len(body):
+            lines.append(rule)
+    return '\n'.join(lines)
+
+
+# arguments understood by the csv engine and pandas' default missing values
+_csv_read_kwargs = {'sep', 'delimiter', 'quotechar', 'encoding', 'usecols', 'nrows'}
+_na_values = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', 
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+_true_values = {'True', 'TRUE', 'true'}
+_false_values = {'False', 'FALSE', 'false'}
+_int_pattern = re.compile(r'^\s*[+-]?\d+\s*$')
+_thousands_pattern = re.compile(r'^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$')
+_float_pattern = re.compile(r'^\s*[+-]?(\d+\.?\d*([eE][+-]?\d+)?|\.\d+([eE][+-]?\d+)?|inf|infinity)\s*$', re.I)
+
+def _mangle_headers(headers: list[str]) -> list[str]:
+    '''Name unnamed columns and number duplicates like pandas does.'''
+    headers = [h if h != '' else f'Unnamed: {i}' for i, h in enumerate(headers)]
+    mangled: list[str] = []
+    counts: dict[str, int] = {}
+    for h in headers:
+        name = h
+        while name in mangled:
+            counts[h] = counts.get(h, 0) + 1
+            name = f'{h}.{counts[h]}'
+        mangled.append(name)
+    return mangled
+
+def _select_columns(headers: list[str], columns: list[str|int] | None) -> list[int]:
+    '''Get indices of selected columns, in file order like pandas' usecols.'''
+    if columns is None:
+        return list(range(len(headers)))
+    if missing := [c for c in columns if not isinstance(c, int) and c not in headers]:
+        raise ValueError(f'Usecols do not match columns, columns expected but not found: {missing}')
+    return [i for i, h in enumerate(headers) if h in columns or i in columns]
+
+class _DtypeInference:
+    '''Infer the pandas dtype of a column one csv cell at a time.'''
+    def __init__(self):
+        self.count = 0
+        self.has_na = False
+        self.all_bool = self.all_int = self.all_float = True
+
+    def update(self, value: str) -> None:
+        self.count += 1
+        if value in _na_values:
+            self.has_na = True
+            return
+        self.all_bool = self.all_bool and (value in _true_values or value in _false_values)
+        self.all_int = self.all_int and _int_pattern.match(value) is not None
+        self.all_float = self.all_float and _float_pattern.match(value) is not None
+
+    @property
+    def dtype(self) -> typing.Literal['int', 'intna', 'float', 'bool', 'boolnan', 'object']:
+        if self.count == 0:
+            return 'object'
+        elif not (self.all_bool or self.all_int or self.all_float):
+            return 'object'
+        elif self.all_bool and self.all_int:
+            # only missing values
+            return 'float'
+        elif self.all_bool:
+            return 'boolnan' if self.has_na else 'bool'
+        elif self.all_int:
+            return 'intna' if self.has_na else 'int'
+        return 'float'
+
+def _column_dtype(values: list[str]) -> typing.Literal['int', 'intna', 'float', 'bool', 'boolnan', 'object']:
+    '''Get the dtype pandas would infer for a column of csv cells.'''
+    inference = _DtypeInference()
+    for value in values:
+        inference.update(value)
+    return inference.dtype
+
+def _parse_cell(value: str, dtype: str) -> typing.Any:
+    '''Convert a csv cell to the python value pandas would hold.'''
+    if value in _na_values:
+        return math.nan
+    elif dtype == 'int':
+        return int(value)
+    elif dtype == 'intna':
+        # integers with missing values are parsed as integers first
+        return float(int(value))
+    elif dtype == 'float':
+        return float(value)
+    elif dtype in ('bool', 'boolnan'):
+        return value in _true_values
+    return value
+
+def _tabulate_type(values: list[typing.Any]) -> type:
+    '''Get the most generic type of a column as tabulate infers it.'''
+    order = [type(None), bool, int, float, str]
+    column_type = bool
+    for v in values:
+        if isinstance(v, bool) or v in ('True', 'False'):
+            t = bool
+        elif isinstance(v, int) or isinstance(v, str) and (
+                _convertible(int, v) or _thousands_pattern.match(v) and '.' not in v):
+            t = int
+        elif isinstance(v, float) or isinstance(v, str) and (_isnumber(v) or _thousands_pattern.match(v)):
+            t = float
+        else:
+            t = str
+        column_type = max(column_type, t, key=order.index)
+        if column_type is str:
+            break
+    return column_type
+
+# tabulate's type for columns whose pandas dtype is not object
+_dtype_types = {'int': int, 'intna': float, 'float': float, 'bool': bool, 'boolnan': float}
+
+def _format_value(value: typing.Any, column_type: type) -> str:
+    '''Format a value of a column of the given type like tabulate does.'''
+    if column_type is float:
+        try:
+            return format(float(value.replace(',', '') if isinstance(value, str) else value), 'g')
+        except ValueError:
+            return f'{value}'
+    return f'{value}'
+
+def _convertible(conv: typing.Callable, s: str) -> bool:
+    try:
+        conv(s)
+        return True
+    except ValueError:
+        return False
+
+def _isnumber(s: str) -> bool:
+    '''Whether a string is a number, excluding overflows to inf.'''
+    if not _convertible(float, s):
+        return False
+    number = float(s)
+    return not (math.isinf(number) or math.isnan(number)) or s.lower() in ('inf', '-inf', 'nan')
+
+def _afterpoint_g(s: str) -> int:
+    '''Digits after the decimal point of a float formatted with 'g'.'''
+    pos = s.rfind('.')
+    pos = s.rfind('e') if pos < 0 else pos
+    return len(s) - pos - 1 if pos >= 0 else -1
+
+def _afterpoint(s: str) -> int:
+    '''Digits after the decimal point, used to align numbers.'''
+    if not (_isnumber(s) or _thousands_pattern.match(s)) or _convertible(int, s):
+        return -1
+    pos = s.rfind('.')
+    pos = s.lower().rfind('e') if pos < 0 else pos
+    return len(s) - pos - 1 if pos >= 0 else -1
+
+
+# arguments of pandas.read_excel that belong to the workbook, not the sheet
+_workbook_kwargs = ('engine', 'storage_options', 'engine_kwargs')
+
+_table_cache = TableCache()
+
+def get_table_cache() -> TableCache:
+    '''Get the table cache shared by all renders in this process.'''
+    return _table_cache
+
+def clear_table_cache() -> None:
+    '''Clear the table cache shared by all renders in this process.'''
+    _table_cache.clear()
+
+
+def _is_local_file(fname: typing.Any) -> bool:
+    '''Check that a table source is a path to a local file.'''
+    return isinstance(fname, (str, os.PathLike)) and os.path.isfile(fname)
+
+def _file_key(fname: str) -> tuple[str, int, int]:
+    '''Identify the current contents of a file by path, mtime and size.'''
+    add_dependency(fname)
+    path = Path(fname).resolve()
+    stat = path.stat()
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+def func_key(func: typing.Callable) -> str:
+    '''Name a function for TableCache keys, e.g. pandas.io.parsers.readers.read_csv.'''
+    return f'{getattr(func, "__module__", "")}.{getattr(func, "__qualname__", repr(func))}'
+
+def kwargs_key(kwargs: dict[str,typing.Any]) -> str:
+    '''Represent keyword arguments for TableCache keys, independent of their order.'''
+    return repr(sorted(kwargs.items()))
+
+def _sizeof(value: typing.Any, fname: str) -> int:
+    '''Approximate memory used by a cached value.'''
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, str):
+        return len(value)
+    if hasattr(value, 'parse'):
+        # a loaded workbook is at least as large as its file
+        return os.path.getsize(fname)
+    return sys.getsizeof(value)
@@ -36,6 +36,11 @@ ipynb2md_default = '''
                 {%endif%} {# end if text/html #}
 
 
+                {%if output.files%}
+                    ![]({{ output.files.values()|first }})
+                {%endif%} {# end if images written to files #}
+
+
             {%endif%} {# end if output_type #}
 
         {%endfor%}
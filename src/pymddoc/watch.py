@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import typing
+import os
+import threading
+from pathlib import Path
+
+from .compiled_doc import CompiledMarkdownDoc, RenderResult, render_item
+from .compile import PandocArgs, RenderFormat
+from .output_cache import OutputCache
+from .images import ImageCache
+from .util import val_or_None
+
+
+FileStamp = tuple[int, int] | None
+
+class Watcher:
+    '''Keeps a compiled markdown document in memory and rebuilds its outputs
+        when the document or the files it reads change. The files of each
+        output are those read by builtin methods (tables, images) during its
+        last render and those referenced by the markdown or pandoc arguments
+        (e.g. bibliographies), so only affected outputs are rebuilt. Files
+        are polled for changes in modification time or size.
+    Args:
+        md_path: path to the markdown file.
+        output_paths: paths to the output files.
+        output_formats: format of each output, inferred from the suffix if None.
+        vars: the variables to substitute into the jinja template.
+        strict_render: if True, raise an error if not all variables are provided.
+        pandoc_args: the arguments for the pandoc conversions.
+        cache_dir: optional directory for persistent caches.
+        output_cache: if provided, reuse pandoc outputs of identical conversions.
+        image_cache: if provided, reuse images rasterized by builtin methods.
+        debounce: seconds without further changes before rebuilding.
+        interval: seconds between polls.
+    '''
+    def __init__(self,
+        md_path: Path,
+        output_paths: list[Path],
+        output_formats: list[RenderFormat | None] | None = None,
+        vars: dict[str,typing.Any] | None = None,
+        strict_render: bool = True,
+        pandoc_args: PandocArgs | None = None,
+        cache_dir: Path | None = None,
+        output_cache: OutputCache | None = None,
+        image_cache: ImageCache | None = None,
+        debounce: float = 0.2,
+        interval: float = 0.25,
+    ):
+        self.md_path = Path(md_path).resolve()
+        self.output_paths = [Path(p) for p in output_paths]
+        self.output_formats = val_or_None(output_formats, [None]*len(self.output_paths))
+        self.vars = vars
+        self.strict_render = strict_render
+        self.pandoc_args = pandoc_args
+        self.cache_dir = cache_dir
+        self.output_cache = output_cache
+        self.image_cache = image_cache
+        self.debounce = debounce
+        self.interval = interval
+        self.dependencies: dict[Path, set[str]] = {p: {str(self.md_path)} for p in self.output_paths}
+        self._doc: CompiledMarkdownDoc | None = None
+        self._stamps: dict[str, FileStamp] = {}
+
+    def build(self, output_paths: list[Path] | None = None) -> list[RenderResult]:
+        '''Render outputs (all by default), recompiling the document if the
+            markdown file changed, and record the files each output depends on.
+        '''
+        output_paths = val_or_None(output_paths, self.output_paths)
+        md_stamp = _stamp(str(self.md_path))
+        if self._doc is None or md_stamp != self._stamps.get(str(self.md_path)):
+            self._stamps[str(self.md_path)] = md_stamp
+            self.close()
+            try:
+                self._doc = CompiledMarkdownDoc(
+                    self.md_path.read_text(),
+                    cache_dir=self.cache_dir,
+                    output_cache=self.output_cache,
+                    image_cache=self.image_cache,
+                )
+            except Exception as e:
+                # keep watching the markdown file until it compiles again
+                return [RenderResult(self.output_paths.index(p), p, 0.0, e) for p in output_paths]
+
+        results = []
+        for output_path in output_paths:
+            index = self.output_paths.index(output_path)
+            result = render_item(self._doc, index, self.vars, output_path, {
+                'output_format': val_or_None(self.output_formats[index], output_path.suffix[1:]),
+                'strict_render': self.strict_render,
+                'pandoc_args': self.pandoc_args,
+            })
+            result.dependencies.add(str(self.md_path))
+            # a failed render keeps watching the files it read before failing
+            if not result.ok:
+                result.dependencies |= self.dependencies[output_path]
+            self.dependencies[output_path] = result.dependencies
+            for path in result.dependencies:
+                self._stamps[path] = _stamp(path)
+            results.append(result)
+        return results
+
+    def changed(self) -> set[str]:
+        '''Get the watched files that changed since they were last read.'''
+        return {path for path, stamp in self._stamps.items() if _stamp(path) != stamp}
+
+    def affected(self, changed: set[str]) -> list[Path]:
+        '''Get the outputs that depend on any of the changed files.'''
+        return [p for p in self.output_paths if not self.dependencies[p].isdisjoint(changed)]
+
+    def watch(self, stop: threading.Event | None = None) -> typing.Iterator[list[RenderResult]]:
+        '''Build all outputs, then rebuild affected outputs whenever watched
+            files change, yielding the results of each build until stop is set.
+        '''
+        stop = val_or_None(stop, threading.Event())
+        yield self.build()
+        while not stop.wait(self.interval):
+            if not len(changed := self.changed()):
+                continue
+            # wait until the files stop changing (e.g. editors writing in steps)
+            stamps = {path: _stamp(path) for path in changed}
+            while not stop.wait(self.debounce):
+                changed |= self.changed()
+                current = {path: _stamp(path) for path in changed}
+                if current == stamps:
+                    break
+                stamps = current
+            if stop.is_set():
+                break
+            if len(affected := self.affected(changed)):
+                yield self.build(affected)
+            # stop polling files that no output reads anymore
+            watched = set().union(*self.dependencies.values())
+            self._stamps = {path: stamp for path, stamp in self._stamps.items() if path in watched}
+
+    def close(self) -> None:
+        '''Remove the temporary folder of the compiled document.'''
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    def __enter__(self) -> typing.Self:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _stamp(path: str) -> FileStamp:
+    '''Get the modification time and size of a file, or None if it is missing.'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
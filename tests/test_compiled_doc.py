@@ -0,0 +1,154 @@
+import sys
+sys.path.append('..')
+
+import tempfile
+from pathlib import Path
+
+import pymddoc
+
+def test_render_many():
+    doc = pymddoc.MarkdownDoc.from_str('# Report for {{ name }}\n\nFormat: {{ OUTPUT_FORMAT }}\n')
+
+    with doc.compile() as compiled, tempfile.TemporaryDirectory() as tmp:
+        assert('Report for A' in compiled.render_to_string('html', vars={'name': 'A'}))
+
+        names = ['A', 'B', 'C']
+        results = list(compiled.render_many(
+            vars_iter=[{'name': n} for n in names] + [{}],
+            output_paths=[Path(tmp) / f'{n}.html' for n in names + ['missing']],
+            output_format='html',
+            workers=2,
+        ))
+        assert(len(results) == 4)
+
+        results = sorted(results, key=lambda r: r.index)
+        for name, result in zip(names, results):
+            assert(result.ok)
+            assert(f'Report for {name}' in result.output_path.read_text())
+
+        # errors are reported per item without aborting the batch
+        assert(not results[-1].ok)
+        assert(isinstance(results[-1].error, ValueError))
+
+def test_async_render():
+    import asyncio
+    doc = pymddoc.MarkdownDoc.from_str('---\ntitle: Async\n---\n# Report for {{ name }}\n')
+
+    async def render_all():
+        pymddoc.set_async_pandoc_limit(2)
+        return await asyncio.gather(
+            doc.aextract_metadata(),
+            *[doc.arender_to_string('html', vars={'name': n}) for n in 'ABCD'],
+        )
+
+    metadata, *outputs = asyncio.run(render_all())
+    assert(metadata['title'] == 'Async')
+    for name, output in zip('ABCD', outputs):
+        assert(f'Report for {name}' in output)
+
+def test_stream_error_keeps_output():
+    def chunks():
+        yield '# Partial\n\n' * 1000
+        raise ValueError('template failed')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = Path(tmp) / 'out.html'
+        output_path.write_text('previous output')
+        try:
+            pymddoc.compile.pandoc_convert_stream(chunks(), 'markdown', output_path, 'html')
+        except ValueError as e:
+            assert('template failed' in str(e))
+        else:
+            assert(False)
+        # pandoc is killed before it sees the end of the partial input
+        assert(output_path.read_text() == 'previous output')
+
+def test_render_to_files():
+    doc = pymddoc.MarkdownDoc.from_file('example.md')
+
+    with doc.compile() as compiled, tempfile.TemporaryDirectory() as tmp:
+        paths = {'html': Path(tmp) / 'example.html', 'docx': Path(tmp) / 'example.docx'}
+        compiled.render_to_files(paths)
+        assert(paths['docx'].stat().st_size > 0)
+
+        # same output as rendering the format on its own
+        html = paths['html'].read_text()
+        assert('This is an HTML document.' in html)
+        assert(html == compiled.render_to_string('html'))
+
+        ast = compiled.render_ast('html')
+        assert(ast.to_string('html') == html)
+
+        assert(compiled.render_to_files({}) == {})
+
+    # image builtins choose formats per output even without OUTPUT_FORMAT
+    with pymddoc.CompiledMarkdownDoc('![]({{ svg_to_png("test_data/drawing.svg") }})\n') as compiled, tempfile.TemporaryDirectory() as tmp:
+        compiled.render_to_files({'html': Path(tmp) / 'fig.html'})
+        assert('src="test_data/drawing.svg"' in (Path(tmp) / 'fig.html').read_text())
+
+def test_render_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        md_paths = [tmp / 'a.md', tmp / 'bad.md', tmp / 'b.md']
+        md_paths[0].write_text('# Doc A\n')
+        md_paths[1].write_text('# Bad {{\n')
+        md_paths[2].write_text('# Doc B\n')
+        output_paths = [[p.with_suffix('.html'), p.with_suffix('.docx')] for p in md_paths]
+
+        for workers in [1, 2]:
+            results = sorted(pymddoc.render_files(md_paths, output_paths, workers=workers), key=lambda r: r.index)
+            assert([r.output_path for r in results] == [p for paths in output_paths for p in paths])
+
+            # a failing document does not stop the others
+            assert([r.ok for r in results] == [True, True, False, False, True, True])
+            assert('Doc B' in (tmp / 'b.html').read_text())
+            assert((tmp / 'b.docx').stat().st_size > 0)
+
+def test_watcher():
+    import threading
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / 'a.csv').write_text('x,y\n1,2\n')
+        (tmp / 'doc.md').write_text(
+            "# Watched\n\n{% if OUTPUT_FORMAT == 'html' %}{{ csv_to_markdown('" + str(tmp / 'a.csv') + "') }}{% endif %}\n"
+        )
+        html, docx = tmp / 'doc.html', tmp / 'doc.docx'
+
+        with pymddoc.Watcher(tmp / 'doc.md', [html, docx], debounce=0.05, interval=0.05) as watcher:
+            stop = threading.Event()
+            builds = watcher.watch(stop)
+            assert(all(r.ok for r in next(builds)))
+            assert('>2</td>' in html.read_text())
+            assert(watcher.changed() == set())
+
+            # only the output that reads the table is rebuilt
+            (tmp / 'a.csv').write_text('x,y\n1,3\n')
+            results = next(builds)
+            assert([r.output_path for r in results] == [html])
+            assert('>3</td>' in html.read_text())
+
+            # the markdown file affects every output
+            (tmp / 'doc.md').write_text('# Rewritten\n')
+            results = next(builds)
+            assert([r.output_path for r in results] == [html, docx])
+            assert('Rewritten' in html.read_text())
+            assert(str(tmp / 'a.csv') not in watcher.changed())
+
+            # a syntax error is reported and the markdown file stays watched
+            (tmp / 'doc.md').write_text('# Broken {{\n')
+            results = next(builds)
+            assert([r.ok for r in results] == [False, False])
+            (tmp / 'doc.md').write_text('# Fixed\n')
+            results = next(builds)
+            assert(all(r.ok for r in results))
+            assert('Fixed' in html.read_text())
+            stop.set()
+
+
+if __name__ == '__main__':
+    test_render_many()
+    test_async_render()
+    test_stream_error_keeps_output()
+    test_render_to_files()
+    test_render_files()
+    test_watcher()
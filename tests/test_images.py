@@ -0,0 +1,124 @@
+import sys
+sys.path.append('..')
+
+import os
+import tempfile
+from pathlib import Path
+
+import pymddoc
+from pymddoc.images import ImageConverter
+from pymddoc.errors import ImageConversionError
+
+calls = []
+
+def fake_convert(source: str, items: list[tuple[str, dict]]) -> None:
+    for outfile, _ in items:
+        calls.append(outfile)
+        Path(outfile).write_bytes(b'png')
+
+def test_image_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cache = pymddoc.ImageCache(tmp / 'images')
+        (tmp / 'a').mkdir()
+        (tmp / 'b').mkdir()
+        (tmp / 'a' / 'fig.svg').write_text('<svg>a</svg>')
+        (tmp / 'b' / 'fig.svg').write_text('<svg>b</svg>')
+
+        outdirs = [tmp / 'render1', tmp / 'render2']
+        for outdir in outdirs:
+            outdir.mkdir()
+            converter = ImageConverter(str(outdir), image_cache=cache)
+            a = converter.convert(str(tmp / 'a' / 'fig.svg'), 'test', {'dpi': 300}, fake_convert)
+            b = converter.convert(str(tmp / 'b' / 'fig.svg'), 'test', {'dpi': 300}, fake_convert)
+            assert(a != b and a.endswith('fig.svg.png'))
+
+        # second render is served from the cache
+        assert(len(calls) == 2)
+        converter.convert(str(tmp / 'a' / 'fig.svg'), 'test', {'dpi': 150}, fake_convert)
+        assert(len(calls) == 3)
+        assert(len(list(cache.directory.glob('*.png'))) == 3)
+
+        # images are stored with the extension of their format
+        webp = converter.convert(str(tmp / 'a' / 'fig.svg'), 'test', {'dpi': 150, 'format': 'webp'}, fake_convert, format='webp')
+        assert(webp.endswith('.webp') and len(list(cache.directory.glob('*.webp'))) == 1)
+        cache.clear()
+        assert(not any(cache.directory.iterdir()))
+
+def test_parallel_image_conversion():
+    md_text = '\n'.join(
+        f'![page](<{{{{ pdf_to_png("test_data/drawing.pdf", dpi={dpi}) }}}}>)' for dpi in (20, 30, 40)
+    )
+    with pymddoc.CompiledMarkdownDoc(md_text, image_workers=2) as doc:
+        rendered = doc.render_text()
+        pngs = [line.split('<')[1].split('>')[0] for line in rendered.splitlines()]
+        assert(len(set(pngs)) == 3 and all(Path(p).is_file() for p in pngs))
+
+        doc = pymddoc.CompiledMarkdownDoc('# title\n\n{{ pdf_to_png("missing.pdf") }}\n', image_workers=2)
+        try:
+            doc.render_text()
+        except ImageConversionError as e:
+            assert('template line 3' in str(e))
+        else:
+            assert(False)
+        doc.close()
+
+def test_pdf_pages_to_png():
+    import fitz
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = f'{tmp}/pages.pdf'
+        pdf = fitz.open()
+        for i in range(3):
+            pdf.new_page().insert_text((72, 72), f'page {i}')
+        pdf.save(fname)
+
+        md_text = f'{{% for png in pdf_pages_to_png("{fname}", dpi=20) %}}![]({{{{ png }}}})\n{{% endfor %}}'
+        digests = []
+        source_digest = pymddoc.images.source_digest
+        pymddoc.images.source_digest = lambda source: digests.append(source) or source_digest(source)
+        try:
+            with pymddoc.CompiledMarkdownDoc(md_text) as doc:
+                pngs = [line[4:-1] for line in doc.render_text().splitlines()]
+        finally:
+            pymddoc.images.source_digest = source_digest
+        # the pdf is hashed once for all pages
+        assert(digests == [fname])
+        with pymddoc.CompiledMarkdownDoc(md_text) as doc:
+            pngs = [line[4:-1] for line in doc.render_text().splitlines()]
+            assert(len(set(pngs)) == 3 and all(Path(p).is_file() for p in pngs))
+            documents = doc._get_image_converter().pdf_documents
+            assert(len(documents) == 1)
+
+            # changed files are reopened
+            with documents.open(fname) as first:
+                pass
+            os.utime(fname, ns=(0, 0))
+            with documents.open(fname) as second:
+                assert(second is not first and first.is_closed)
+        # documents are closed with the render
+        assert(len(documents) == 0 and second.is_closed)
+
+def test_output_aware_images():
+    md_text = '{{ svg_to_png("test_data/drawing.svg") }}\n{{ pdf_to_png("test_data/drawing.pdf") }}\n'
+    with pymddoc.CompiledMarkdownDoc(md_text) as doc:
+        svg, pdf = doc.render_text('html').splitlines()
+        assert(svg == 'test_data/drawing.svg' and pdf.endswith('.svg') and Path(pdf).is_file())
+        assert([(c.format, c.dpi) for c in doc.image_choices()] == [('svg', None), ('svg', None)])
+
+        doc.render_text('docx')
+        assert([(c.format, c.dpi) for c in doc.image_choices()] == [('png', 300), ('png', 300)])
+
+    # per-call overrides
+    md_text = '{{ pdf_to_png("test_data/drawing.pdf", dpi=50, format="webp") }}'
+    with pymddoc.CompiledMarkdownDoc(md_text) as doc:
+        webp = doc.render_text('html')
+        assert(webp.endswith('.webp') and Path(webp).read_bytes()[8:12] == b'WEBP')
+        assert(doc.image_choices() == [pymddoc.ImageChoice('test_data/drawing.pdf', webp, 'webp', 50)])
+
+
+if __name__ == '__main__':
+    test_image_cache()
+    test_parallel_image_conversion()
+    test_pdf_pages_to_png()
+    test_output_aware_images()
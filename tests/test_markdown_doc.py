@@ -34,23 +34,26 @@ def test_compile_basics():
     assert('comment_should_not_appear' not in html_str) # comment should not appear
     assert('class="this_class_should_appear"' in html_str) # add class to div
     assert('id="this_id_should_appear"' in html_str) # add id to div
-    assert('static_factory_methods.svg.png' in html_str) # svg to png replacement
-    assert('drawing.pdf.png' in html_str) # pdf to png replacement
+    assert('static_factory_methods.svg"' in html_str) # svg kept for html
+    assert('drawing.pdf.svg' in html_str) # pdf to svg replacement for html
     assert('test_data/drawing.pdf' in html_str) # raw pdf inclusion
     assert('two' in html_str) # table insertion
     assert('three' in html_str) # table insertion
 
     doc.render_to_pdf(
         output_path='test_outputs/test_output.pdf', 
+        vars={'test_variable': 'replaced_variable_value'},
     )
 
     doc.render_to_pdf(
         output_path='test_outputs/test_output_toc.pdf', 
+        vars={'test_variable': 'replaced_variable_value'},
         pandoc_args=pymddoc.PandocArgs(toc=True),
     )
 
     doc.render_to_docx(
         output_path='test_outputs/test_output.docx', 
+        vars={'test_variable': 'replaced_variable_value'},
     )
 
 
@@ -0,0 +1,43 @@
+import sys
+sys.path.append('..')
+
+import pymddoc
+from pymddoc.metadata import parse_yaml_header
+
+def test_yaml_header_fast_path():
+    simple = '''---
+title: Simple Title
+author: [Jane Doe, John Roe]
+bibliography: test_data/references.bib
+tags:
+  - a
+  - b c
+nested:
+  key: value
+  count: 12
+draft: false
+---
+
+Body
+
+---
+
+After a horizontal rule.
+'''
+    assert(parse_yaml_header(simple) == pymddoc.Metadata.from_markdown_text(simple, exact=True))
+    assert(parse_yaml_header('# No header\n') == {})
+
+    # fall back to pandoc for markdown in values, normalized numbers, late blocks and title blocks
+    for text in [
+        '---\ntitle: Hello *World*\n---\n',
+        '---\nversion: 1.50\n---\n',
+        '---\ntitle: it\'s\n---\n',
+        'Body\n\n---\ntitle: late\n---\n',
+        '% My Title\n% Jane Doe\n% 2024\n\nbody\n',
+    ]:
+        assert(parse_yaml_header(text) is None)
+        assert(pymddoc.Metadata.from_markdown_text(text) == pymddoc.Metadata.from_markdown_text(text, exact=True))
+
+
+if __name__ == '__main__':
+    test_yaml_header_fast_path()
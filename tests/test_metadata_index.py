@@ -0,0 +1,48 @@
+import sys
+sys.path.append('..')
+
+import os
+import tempfile
+from pathlib import Path
+
+import pymddoc
+
+def test_metadata_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'docs'
+        (root / 'sub').mkdir(parents=True)
+        (root / 'a.md').write_text('---\ntitle: A\ntags: [draft, notes]\n---\n')
+        (root / 'sub' / 'b.md').write_text('---\ntitle: B\ndraft: false\n---\n')
+
+        with pymddoc.MarkdownDoc.index_metadata(root, Path(tmp) / 'index.sqlite', workers=2) as index:
+            assert(len(index) == 2)
+            assert(index.get(root / 'a.md')['title'] == 'A')
+            assert([p.name for p, _ in index.query(tags='draft')] == ['a.md'])
+            assert([p.name for p, _ in index.query(tags=['draft', 'notes'], title='A')] == ['a.md'])
+            assert([p.name for p, _ in index.query(draft=False)] == ['b.md'])
+            assert(index.query(draft='false') == [] and index.query(title='B', tags='draft') == [])
+
+        index = pymddoc.MetadataIndex(Path(tmp) / 'index.sqlite')
+
+        # only changed files are re-read
+        (root / 'a.md').write_text('---\ntitle: A2\n---\n')
+        os.utime(root / 'a.md', ns=(0, 0))
+        (root / 'sub' / 'b.md').unlink()
+        (root / 'c.md').write_text('---\ntitle: C\n---\n')
+        result = index.scan(root)
+        assert(result.updated == [str((root / 'a.md').resolve())])
+        assert(result.added == [str((root / 'c.md').resolve())])
+        assert(result.removed == [str((root / 'sub' / 'b.md').resolve())])
+        assert(index.scan(root).unchanged == 2)
+        assert(index.get(root / 'a.md')['title'] == 'A2')
+
+        # files that can no longer be read are dropped from the index
+        (root / 'c.md').write_bytes(b'---\ntitle: \xff\n---\n')
+        result = index.scan(root)
+        assert(list(result.errors) == [str((root / 'c.md').resolve())])
+        assert(index.get(root / 'c.md') is None)
+        index.close()
+
+
+if __name__ == '__main__':
+    test_metadata_index()
@@ -0,0 +1,163 @@
+import sys
+sys.path.append('..')
+
+import json
+import re
+import tempfile
+import zipfile
+from pathlib import Path
+
+import pymddoc
+
+def write_notebook(path: Path, source: str) -> None:
+    cell = {'cell_type': 'markdown', 'metadata': {}, 'source': [source]}
+    with path.open('w') as f:
+        json.dump({'cells': [cell], 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5}, f)
+
+def test_convert_ipynb2md_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        notebooks = [tmp / 'a.ipynb', tmp / 'b.ipynb']
+        mds = [tmp / 'a.md', tmp / 'b.md']
+        for i, nb in enumerate(notebooks):
+            write_notebook(nb, f'# notebook {i}')
+
+        def convert(**kwargs) -> list[bool]:
+            converted = pymddoc.convert_ipynb2md_files(
+                pymddoc.ipynb2md_default_template, notebooks, mds, manifest_path=tmp / 'manifest.json', **kwargs,
+            )
+            return [converted[md] for md in mds]
+
+        assert(convert(workers=2) == [True, True])
+        assert('# notebook 1' in mds[1].read_text())
+
+        # only changed notebooks are converted again
+        assert(convert() == [False, False])
+        write_notebook(notebooks[0], '# changed')
+        assert(convert() == [True, False])
+        assert('# changed' in mds[0].read_text())
+
+        mds[1].unlink()
+        assert(convert() == [False, True])
+        assert(convert(force=True) == [True, True])
+
+def test_streamed_notebook():
+    output = {'output_type': 'display_data', 'metadata': {}, 'data': {'image/png': 'iVBOR' * 1000, 'text/plain': ['<Figure>']}}
+    data = {
+        'cells': [{'cell_type': 'code', 'metadata': {}, 'source': [f'x = {i}'], 'outputs': [output]} for i in range(3)],
+        'metadata': {'kernelspec': {'name': 'python3'}},
+        'nbformat': 4,
+        'nbformat_minor': 5,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = Path(tmp) / 'nb.ipynb'
+        with fname.open('w') as f:
+            json.dump(data, f)
+
+        notebook = pymddoc.read_notebook(fname, mime_types={'text/plain'})
+        assert(notebook['metadata'] == data['metadata'])
+        cells = list(notebook['cells'])
+        assert([c['source'] for c in cells] == [c['source'] for c in data['cells']])
+        assert(all(c['outputs'][0]['data'] == {'text/plain': ['<Figure>']} for c in cells))
+
+        # templates may count and index the cells
+        template = '{{ cells|length }} {{ cells[1].source[0] }} {{ (cells|last).source[0] }} {% for c in cells %}{{ loop.length }}{% endfor %}'
+        pymddoc.convert_ipynb2md_file(template, fname, Path(tmp) / 'nb.md')
+        assert((Path(tmp) / 'nb.md').read_text() == '3 x = 1 x = 2 333')
+        assert(len(pymddoc.read_notebook(fname, fields=['cells'])['cells']) == 3)
+
+        # the default template only uses text outputs
+        template = pymddoc.ipynb2md_default_template
+        pymddoc.convert_ipynb2md_file(template, fname, Path(tmp) / 'nb.md')
+        assert((Path(tmp) / 'nb.md').read_text() == pymddoc.convert_ipynb2md(template, data))
+
+def test_notebook_assets():
+    import base64
+    png = base64.b64encode(b'\x89PNG fake image').decode()
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg">', '</svg>']
+    def cell(data: dict) -> dict:
+        output = {'output_type': 'display_data', 'metadata': {}, 'data': {**data, 'text/plain': ['<Figure>']}}
+        return {'cell_type': 'code', 'metadata': {}, 'source': ['plot()'], 'outputs': [output]}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        notebooks = [tmp / 'a.ipynb', tmp / 'b.ipynb']
+        for nb, cells in zip(notebooks, [[cell({'image/png': png}), cell({'image/png': png})], [cell({'image/svg+xml': svg})]]):
+            with nb.open('w') as f:
+                json.dump({'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5}, f)
+
+        mds = [tmp / 'docs' / 'a.md', tmp / 'docs' / 'b.md']
+        mds[0].parent.mkdir()
+        pymddoc.convert_ipynb2md_files(pymddoc.ipynb2md_default_template, notebooks, mds, assets_dir=tmp / 'docs' / 'assets')
+
+        # identical images are stored once and linked relative to the markdown
+        assets = sorted((tmp / 'docs' / 'assets').iterdir(), key=lambda p: p.suffix)
+        assert([p.suffix for p in assets] == ['.png', '.svg'])
+        assert(assets[0].read_bytes() == b'\x89PNG fake image')
+        assert(mds[0].read_text().count(f'![](assets/{assets[0].name})') == 2)
+        assert(f'![](assets/{assets[1].name})' in mds[1].read_text())
+        assert(png not in mds[0].read_text())
+
+        # deleted assets are written again
+        manifest = tmp / 'manifest.json'
+        convert = lambda: pymddoc.convert_ipynb2md_files(pymddoc.ipynb2md_default_template, notebooks, mds, 
+            manifest_path=manifest, assets_dir=tmp / 'docs' / 'assets')
+        assert(list(convert().values()) == [True, True])
+        assert(list(convert().values()) == [False, False])
+        assets[1].unlink()
+        assert(list(convert().values()) == [False, True])
+        assert(assets[1].is_file())
+
+        # templates reading image data get it instead of a file
+        template = "{% for c in cells %}{{ c.outputs[0].data['image/png'] }}{% endfor %}"
+        pymddoc.convert_ipynb2md_file(template, notebooks[0], mds[0], assets_dir=tmp / 'docs' / 'assets')
+        assert(mds[0].read_text() == png*2)
+
+def test_render_notebook():
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = Path(tmp) / 'nb.ipynb'
+        write_notebook(fname, "{% if OUTPUT_FORMAT == 'html' %}html only{% endif %}\n\n"
+            "{{ csv_to_markdown('test_data/testtable.csv') }}\n\n{{ test_variable }}")
+
+        pymddoc.render_notebook(fname, Path(tmp) / 'nb.html', vars={'test_variable': 'replaced_variable_value'})
+        html = (Path(tmp) / 'nb.html').read_text()
+        assert('html only' in html and '<table' in html and 'replaced_variable_value' in html)
+
+        try:
+            pymddoc.render_notebook(fname, Path(tmp) / 'nb.html')
+        except Exception as e:
+            assert('test_variable' in str(e))
+        else:
+            assert(False)
+
+        # image outputs are linked from files instead of parsed by pandoc
+        with fname.open('w') as f:
+            output = {'output_type': 'display_data', 'metadata': {}, 'data': {'image/png': 'iVBORw0KGgo=', 'text/plain': ['<Figure>']}}
+            cell = {'cell_type': 'code', 'metadata': {}, 'execution_count': 1, 'source': ['plot()'], 'outputs': [output]}
+            json.dump({'cells': [cell], 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5}, f)
+        (Path(tmp) / 'out').mkdir()
+        for assets_dir in [None, Path(tmp) / 'assets']:
+            html_path = Path(tmp) / 'out' / 'images.html'
+            pymddoc.render_notebook(fname, html_path, assets_dir=assets_dir)
+            html = html_path.read_text()
+            srcs = re.findall(r'<img src="([^"]+)"', html)
+            assert(len(srcs) == 1 and (html_path.parent / srcs[0]).is_file())
+            assert('&lt;Figure&gt;' not in html)
+        assert(srcs[0].startswith('../assets/') and (Path(tmp) / 'out' / 'assets').is_dir())
+
+        # embedded images are read by pandoc from a temporary folder
+        pymddoc.render_notebook(fname, Path(tmp) / 'out' / 'images.docx')
+        with zipfile.ZipFile(Path(tmp) / 'out' / 'images.docx') as docx:
+            assert(any(name.startswith('word/media/') for name in docx.namelist()))
+
+        # notebooks without jinja are read by pandoc directly
+        write_notebook(fname, '# plain notebook')
+        pymddoc.render_notebook(fname, Path(tmp) / 'plain.html')
+        assert('plain notebook' in (Path(tmp) / 'plain.html').read_text())
+
+
+if __name__ == '__main__':
+    test_convert_ipynb2md_files()
+    test_streamed_notebook()
+    test_notebook_assets()
+    test_render_notebook()
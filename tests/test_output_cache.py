@@ -0,0 +1,38 @@
+import sys
+sys.path.append('..')
+
+import tempfile
+from pathlib import Path
+
+import pymddoc
+
+def test_output_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cache = pymddoc.OutputCache(tmp / 'cache', max_bytes=10**6)
+        doc = pymddoc.MarkdownDoc.from_str('# {{ name }}\n\n![](test_data/drawing.svg)\n', output_cache=cache)
+
+        doc.render_to_file(tmp / 'a.html', vars={'name': 'A'})
+        assert(len(list(cache.directory.iterdir())) == 1)
+
+        # identical conversion is copied from the cache
+        cached_path = next(cache.directory.iterdir())
+        cached_path.write_text('from cache')
+        doc.render_to_file(tmp / 'b.html', vars={'name': 'A'})
+        assert((tmp / 'b.html').read_text() == 'from cache')
+
+        # different input or pandoc arguments are converted again
+        doc.render_to_file(tmp / 'c.html', vars={'name': 'C'})
+        assert('C</h1>' in (tmp / 'c.html').read_text())
+        doc.render_to_file(tmp / 'd.html', vars={'name': 'A'}, pandoc_args=pymddoc.PandocArgs(standalone=True))
+        assert((tmp / 'd.html').read_text() != 'from cache')
+        assert(len(list(cache.directory.iterdir())) == 3)
+
+        # least recently used outputs are evicted
+        cache.max_bytes = 0
+        cache.evict()
+        assert(len(list(cache.directory.iterdir())) == 0)
+
+
+if __name__ == '__main__':
+    test_output_cache()
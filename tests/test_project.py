@@ -0,0 +1,64 @@
+import sys
+sys.path.append('..')
+
+import os
+import tempfile
+from pathlib import Path
+
+import pymddoc
+
+def test_incremental_build():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / 'docs').mkdir()
+        (tmp / 'a.csv').write_text('x,y\n1,2\n')
+        (tmp / 'b.csv').write_text('x,y\n7,8\n')
+        # paths inside documents are relative to the project folder
+        (tmp / 'docs' / 'a.md').write_text("# A\n\n{{ csv_to_markdown('a.csv') }}\n")
+        (tmp / 'docs' / 'b.md').write_text("# B {{ title }}\n\n{{ csv_to_markdown('" + str(tmp / 'b.csv') + "') }}\n")
+        (tmp / 'pymddoc.toml').write_text(
+            'out_dir = "site"\n'
+            '[[documents]]\n'
+            'path = "docs/a.md"\n'
+            '[[documents]]\n'
+            'path = "docs/b.md"\n'
+            'formats = ["html", "docx"]\n'
+            'vars = {title = "Bee"}\n'
+        )
+        project = pymddoc.Project.from_file(tmp / 'pymddoc.toml')
+        a_html, b_html, b_docx = tmp / 'site/docs/a.html', tmp / 'site/docs/b.html', tmp / 'site/docs/b.docx'
+        assert([d.output_paths for d in project.documents] == [[a_html], [b_html, b_docx]])
+
+        results = list(project.build())
+        assert(all(r.ok for r in results) and len(results) == 3)
+        assert('B Bee' in b_html.read_text())
+        assert(str(tmp / 'b.csv') in results[-1].dependencies)
+        assert(str((tmp / 'a.csv').resolve()) in results[0].dependencies)
+        assert(Path.cwd() != tmp.resolve())
+        assert(project.outdated() == [])
+        assert(list(project.build()) == [])
+
+        # only outputs that read the changed table are rebuilt
+        (tmp / 'b.csv').write_text('x,y\n7,9\n')
+        assert(project.outdated() == [b_html, b_docx])
+        assert(sorted(r.output_path for r in project.build()) == sorted([b_html, b_docx]))
+        assert('>9</td>' in b_html.read_text())
+
+        # a new modification time alone does not trigger a rebuild
+        os.utime(tmp / 'a.csv')
+        assert(project.outdated() == [])
+
+        # changed settings and deleted outputs are rebuilt
+        project.documents[1].vars = {'title': 'Wasp'}
+        a_html.unlink()
+        assert(project.outdated() == [a_html, b_html, b_docx])
+
+        # failed outputs are rendered again by the next build
+        (tmp / 'docs' / 'a.md').write_text('# A {{\n')
+        results = list(project.build())
+        assert([r.ok for r in sorted(results, key=lambda r: r.index)] == [False, True, True])
+        assert(project.outdated() == [a_html])
+
+
+if __name__ == '__main__':
+    test_incremental_build()
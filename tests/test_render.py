@@ -0,0 +1,71 @@
+import sys
+sys.path.append('..')
+
+import pathlib
+
+import pymddoc
+from pymddoc.render import jinja_render, jinja_get_variables
+
+def test_template_cache():
+    cache = pymddoc.TemplateCache(maxsize=2)
+
+    assert(jinja_render('Hello {{ name }}', {'name': 'a'}, cache=cache) == 'Hello a')
+    assert(jinja_render('Hello {{ name }}', {'name': 'b'}, cache=cache) == 'Hello b')
+    assert(jinja_get_variables('Hello {{ name }}', cache=cache) == ['name'])
+    info = cache.cache_info()
+    assert(info.misses == 1 and info.currsize == 1)
+    assert(info.hits == 2)
+
+    # least recently used template is evicted
+    jinja_render('{{ a }}', {'a': 1}, cache=cache)
+    jinja_render('{{ b }}', {'b': 2}, cache=cache)
+    assert(cache.cache_info().currsize == 2)
+    jinja_render('Hello {{ name }}', {'name': 'c'}, cache=cache)
+    assert(cache.cache_info().misses == 4)
+
+    cache.clear()
+    assert(cache.cache_info() == pymddoc.render.TemplateCacheInfo(0, 0, 2, 0))
+
+def test_strict_render():
+    text = 'Hello {{ name }} from {{ place }}. {% set x = 1 %}{{ x }} {{ "{{ literal }}" }}'
+    assert(jinja_render(text, {'name': 'a', 'place': 'b'}) == 'Hello a from b. 1 {{ literal }}')
+
+    try:
+        jinja_render(text, {}, strict=True)
+    except ValueError as e:
+        assert('name, place' in str(e))
+    else:
+        raise AssertionError('strict render should raise for missing variables')
+
+    assert(jinja_render(text, {}, strict=False) == 'Hello  from . 1 {{ literal }}')
+
+    # guarded variables are not missing
+    guarded = '{% if subtitle is defined %}{{ subtitle }}{% endif %}# T {{ note|default("-") }}'
+    assert(jinja_render(guarded, {}) == '# T -')
+    doc = pymddoc.MarkdownDoc(guarded)
+    assert('<h1' in doc.render_html())
+
+def test_bytecode_cache():
+    import tempfile
+    from pymddoc.render import TemplateBytecodeCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = pymddoc.TemplateCache(bytecode_cache=TemplateBytecodeCache(tmp))
+        assert(jinja_render('Hello {{ name }}', {'name': 'a'}, cache=cache) == 'Hello a')
+        assert(len(list(pathlib.Path(tmp).iterdir())) == 1)
+
+        # a new process-level cache loads the compiled code from disk
+        new_cache = pymddoc.TemplateCache(bytecode_cache=TemplateBytecodeCache(tmp))
+        new_cache._compile = None # compiling again would fail
+        assert(jinja_render('Hello {{ name }}', {'name': 'b'}, cache=new_cache) == 'Hello b')
+        assert(jinja_get_variables('Hello {{ name }}', cache=new_cache) == ['name'])
+
+        # stale entries are removed when the cache is opened
+        TemplateBytecodeCache(tmp, max_age=-1)
+        assert(len(list(pathlib.Path(tmp).iterdir())) == 0)
+
+
+if __name__ == '__main__':
+    test_template_cache()
+    test_strict_render()
+    test_bytecode_cache()
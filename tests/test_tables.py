@@ -0,0 +1,143 @@
+import sys
+sys.path.append('..')
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pymddoc
+
+def test_table_cache():
+    cache = pymddoc.get_table_cache()
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = f'{tmp}/table.csv'
+        shutil.copyfile('test_data/testtable.csv', fname)
+
+        pymddoc.clear_table_cache()
+        full = pymddoc.csv_to_markdown(fname)
+        head = pymddoc.csv_to_markdown(fname, num_rows=2)
+        assert(pymddoc.csv_to_markdown(fname) == full)
+        assert(len(head.splitlines()) == 4)
+
+        # the head is read with nrows; the repeated view is a hit
+        info = cache.cache_info()
+        assert((info.hits, info.misses) == (1, 4))
+
+        # modified files are read again
+        with open(fname, 'a') as f:
+            f.write(f'{os.linesep}"three", 3{os.linesep}')
+        os.utime(fname, ns=(0, 0))
+        assert(pymddoc.csv_to_markdown(fname) != full)
+
+        cache.invalidate(fname)
+        assert(cache.cache_info().currsize == 0)
+
+def test_excel_sheets_share_workbook():
+    cache = pymddoc.get_table_cache()
+    pymddoc.clear_table_cache()
+    first = pymddoc.excel_to_markdown('test_data/testtable.xlsx', read_kwargs={'sheet_name': 0})
+    again = pymddoc.excel_to_markdown('test_data/testtable.xlsx', num_rows=1, read_kwargs={'sheet_name': 0})
+    assert(again.splitlines()[0] == first.splitlines()[0])
+
+    # one workbook shared by two sheet reads and two markdown views
+    info = cache.cache_info()
+    assert((info.hits, info.currsize) == (1, 5))
+
+    # removed workbooks are closed
+    closed = []
+    workbook = next(value for key, (value, _) in cache._entries.items() if key[3] == 'workbook')
+    workbook.close = lambda: closed.append(workbook)
+    pymddoc.clear_table_cache()
+    assert(closed == [workbook])
+
+    # and so are evicted ones
+    import pandas as pd
+    cache = pymddoc.TableCache(max_bytes=1)
+    first = cache.memoize('test_data/testtable.xlsx', ('workbook', 1), lambda: pd.ExcelFile('test_data/testtable.xlsx'))
+    cache.memoize('test_data/testtable.xlsx', ('workbook', 2), lambda: pd.ExcelFile('test_data/testtable.xlsx'))
+    assert(cache.cache_info().currsize == 1)
+    try:
+        first.parse()
+    except Exception:
+        pass
+    else:
+        assert(False)
+    cache.clear()
+
+def test_non_file_sources():
+    import io
+    pymddoc.clear_table_cache()
+    expected = pymddoc.csv_to_markdown('test_data/testtable.csv')
+    head = pymddoc.csv_to_markdown('test_data/testtable.csv', num_rows=1)
+    cached = pymddoc.get_table_cache().cache_info().currsize
+    url = Path('test_data/testtable.csv').resolve().as_uri()
+    with open('test_data/testtable.csv') as f:
+        text = f.read()
+
+    # urls and file-like objects are read by pandas without caching
+    assert(pymddoc.csv_to_markdown(url) == expected)
+    assert(pymddoc.csv_to_markdown(io.StringIO(text)) == expected)
+    assert(pymddoc.csv_to_markdown(io.StringIO(text), num_rows=1) == head)
+    assert(pymddoc.get_table_cache().cache_info().currsize == cached)
+    pymddoc.clear_table_cache()
+
+def test_head_and_tail():
+    import pandas as pd
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = f'{tmp}/large.csv'
+        pd.DataFrame({'a': range(1000), 'b': range(1000)}).to_csv(fname, index=False)
+
+        df = pymddoc.tables.read_head_and_tail(pd.read_csv, fname, 2, 3, {'usecols': ['a']}, chunksize=7)
+        assert(list(df['a']) == [0, 1, '...', 997, 998, 999])
+
+        md = pymddoc.csv_to_markdown(fname, num_rows=2, columns=['b'], tail_rows=1)
+        assert([line.strip('| ') for line in md.splitlines()[2:]] == ['0', '1', '...', '999'])
+
+        # short tables are shown whole
+        df = pymddoc.tables.read_head_and_tail(pd.read_csv, fname, 600, 600, chunksize=7)
+        assert(list(df['a']) == list(range(1000)))
+
+def test_csv_engine():
+    pymddoc.clear_table_cache()
+    for kwargs in [{}, {'num_rows': 1}, {'to_markdown_kwargs': {'tablefmt': 'grid'}}]:
+        expected = pymddoc.csv_to_markdown('test_data/testtable.csv', **kwargs)
+        assert(pymddoc.csv_to_markdown('test_data/testtable.csv', engine='csv', **kwargs) == expected)
+
+    try:
+        pymddoc.csv_to_markdown('test_data/testtable.csv', read_kwargs={'skiprows': 1}, engine='csv')
+    except ValueError as e:
+        assert('engine="pandas"' in f'{e}')
+    else:
+        assert(False)
+    pymddoc.clear_table_cache()
+
+def test_arrow_tables():
+    import pytest
+    import pandas as pd
+    pytest.importorskip('pyarrow')
+    pymddoc.clear_table_cache()
+    with tempfile.TemporaryDirectory() as tmp:
+        df = pd.DataFrame({'a': range(100), 'b': [f'x{i}' for i in range(100)]})
+        df.to_parquet(f'{tmp}/table.parquet', index=False, row_group_size=10)
+        df.to_feather(f'{tmp}/table.feather')
+
+        for fname, to_md in [(f'{tmp}/table.parquet', pymddoc.parquet_to_markdown), (f'{tmp}/table.feather', pymddoc.feather_to_markdown)]:
+            assert(to_md(fname) == df.to_markdown(index=False))
+            assert(to_md(fname, num_rows=3, columns=['b']) == df[['b']].head(3).to_markdown(index=False))
+
+            md = to_md(fname, num_rows=1, columns=['a'], tail_rows=2, filters=[('a', '>=', 50)])
+            assert([line.strip('| ') for line in md.splitlines()[2:]] == ['50', '...', '98', '99'])
+
+        df = pymddoc.tables.read_arrow_table(f'{tmp}/table.parquet', filters=[('a', '<', 5), ('b', '!=', 'x0')])
+        assert(list(df['a']) == [1, 2, 3, 4])
+    pymddoc.clear_table_cache()
+
+
+if __name__ == '__main__':
+    test_table_cache()
+    test_excel_sheets_share_workbook()
+    test_non_file_sources()
+    test_head_and_tail()
+    test_csv_engine()
+    test_arrow_tables()